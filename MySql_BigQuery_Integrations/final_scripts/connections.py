@@ -0,0 +1,207 @@
+# modules
+import os
+import queue
+import threading
+import time
+from google.cloud import bigquery as bq
+import mysql.connector
+
+# Max number of open MySql connections per credentials file
+POOL_SIZE = 4
+
+# Seconds to wait for a connection to be returned when the pool is exhausted
+POOL_TIMEOUT = 30
+
+_pools = {}
+_bq_clients = {}
+_lock = threading.Lock()
+
+
+def read_credentials(creds_path):
+    """
+    Parse a creds.txt file of 'key=value' lines into connection kwargs.
+    :param creds_path: path of the credentials file
+    :return:
+      credentials: dict of mysql.connector.connect() kwargs
+    """
+    with open(creds_path, "r") as file:
+        credentials = {}
+        for line in file:
+            if "=" in line:  # Check for lines containing '='
+                key, value = line.strip().split("=")
+                credentials[key.strip()] = value.strip()
+    return credentials
+
+
+class PooledConnection:
+    """
+    Wraps a pooled MySql connection. Everything is delegated to the real connection except close(),
+    which hands the connection back to its pool instead of closing it, so existing callers that
+    close their connection when done reuse it without any change.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySql connections for one set of credentials. Idle connections are health checked
+    before being handed out; when every connection is in use, callers wait up to 'timeout' seconds.
+    """
+
+    def __init__(self, credentials, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.credentials = credentials
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time_s': 0.0, 'health_check_failures': 0}
+
+    def _connect(self):
+        try:
+            return mysql.connector.connect(**self.credentials)
+        except mysql.connector.Error:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _healthy(self, conn):
+        try:
+            return conn.is_connected()
+        except mysql.connector.Error:
+            return False
+
+    def get(self):
+        """
+        Check out a connection: reuse an idle one (hit), open a new one while under 'size' (miss),
+        or wait for one to be released (hit, counted in 'waits'/'wait_time_s').
+        :return:
+          conn: PooledConnection object
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+                    self.metrics['misses'] += 1
+            if can_create:
+                return PooledConnection(self, self._connect())
+
+            start = time.perf_counter()
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise mysql.connector.errors.PoolError(
+                    f"No MySql connection available after {self.timeout}s (pool size {self.size}).")
+            with self._lock:
+                self.metrics['waits'] += 1
+                self.metrics['wait_time_s'] += time.perf_counter() - start
+
+        with self._lock:
+            self.metrics['hits'] += 1
+
+        if not self._healthy(conn):
+            # Stale connection (server timeout, network drop): replace it, keeping its slot
+            with self._lock:
+                self.metrics['health_check_failures'] += 1
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            conn = self._connect()
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """
+        Return a connection to the pool. Leftover results from an abandoned unbuffered query are drained
+        and any open transaction rolled back; a connection that can't be cleaned up is discarded.
+        :param conn: raw MySql connection object
+        :return: None
+        """
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except (mysql.connector.Error, AttributeError):
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+
+    def close_all(self):
+        """
+        Close every idle connection. Connections still checked out are closed when released.
+        :return: None
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+
+def get_mysql_connection(creds_path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+    """
+    Check out a pooled MySql connection for the credentials in creds_path. The credentials file is read
+    once, when the pool for it is created. Call close() on the connection to return it to the pool.
+    :param creds_path: path of the credentials file
+    :param size: max number of open connections, used when the pool is first created
+    :param timeout: seconds to wait for a free connection, used when the pool is first created
+    :return:
+      conn: PooledConnection object
+    """
+    key = os.path.abspath(creds_path)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(read_credentials(key), size, timeout)
+    return pool.get()
+
+
+def get_bq_client(project):
+    """
+    Shared BigQuery client for a project. The client is created once per process and is safe to use
+    from several threads.
+    :param project: GCP project id
+    :return:
+      client: BigQuery client object
+    """
+    with _lock:
+        client = _bq_clients.get(project)
+        if client is None:
+            client = _bq_clients[project] = bq.Client(project=project)
+    return client
+
+
+def pool_metrics():
+    """
+    Hit/miss/wait counters of every MySql pool in the process.
+    :return:
+      metrics: dict of creds path -> metrics dict
+    """
+    with _lock:
+        return {key: dict(pool.metrics) for key, pool in _pools.items()}
@@ -0,0 +1,92 @@
+# modules
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Rows per batch read_sql_planned() converts at a time, so the default-dtype (object) copy of the data never
+# exists for more than one batch
+READ_CHUNK_SIZE = 50000
+
+
+def apply_dtype_plan(df, plan):
+    """
+    Cast the columns of a freshly read frame to the pipeline's dtype plan. Columns not in the plan (or plan
+    entries not in the frame) are left alone.
+    :param df: DataFrame object
+    :param plan: dict of column -> dtype; any astype() dtype ('category', 'Int16', 'string[pyarrow]', ...)
+      or 'datetime' to parse w/ pd.to_datetime
+    :return:
+      df: DataFrame object w/ the planned dtypes
+    """
+    for column, dtype in plan.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'datetime':
+            df[column] = pd.to_datetime(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def concat_planned(frames):
+    """
+    Concat batches that went through apply_dtype_plan(). Categorical columns get the union of every batch's
+    categories first, as pd.concat turns categoricals w/ different categories back into object columns.
+    :param frames: list of DataFrame objects w/ the same columns
+    :return:
+      df: DataFrame object
+    """
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([frame[column] for frame in frames], sort_categories=True).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_sql_planned(qry, conn, plan, params=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    pd.read_sql w/ the dtype plan applied batch by batch as the rows come in, instead of to the whole
+    default-dtype frame afterwards.
+    :param qry: SQL text
+    :param conn: open MySql connection object
+    :param plan: dict of column -> dtype, see apply_dtype_plan()
+    :param params: optional query parameters
+    :param chunk_size: rows per batch
+    :return:
+      df: DataFrame object w/ the planned dtypes
+    """
+    frames = [apply_dtype_plan(chunk, plan)
+              for chunk in pd.read_sql(qry, conn, params=params, chunksize=chunk_size)]
+    if not frames:
+        # No rows: read_sql yields nothing, return an empty frame
+        return pd.DataFrame()
+    return concat_planned(frames)
+
+
+def memory_report(before, after, label=''):
+    """
+    Per-column in-memory footprint (incl. the strings object columns point to) of the same data w/ default
+    and w/ planned dtypes.
+    :param before: DataFrame object w/ default dtypes
+    :param after: DataFrame object w/ the dtype plan applied
+    :param label: name printed w/ the totals
+    :return:
+      report: DataFrame w/ dtype and MB per column before/after and the reduction factor
+    """
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'mb_before': before.memory_usage(index=False, deep=True) / 1024 ** 2,
+        'dtype_after': after.dtypes.astype(str),
+        'mb_after': after.memory_usage(index=False, deep=True) / 1024 ** 2,
+    })
+    report.loc['total', ['mb_before', 'mb_after']] = report[['mb_before', 'mb_after']].sum()
+    report['reduction'] = report['mb_before'] / report['mb_after']
+    report = report.round(3)
+
+    total = report.loc['total']
+    print(f"{label} {len(after)} rows: {total['mb_before']} MB -> {total['mb_after']} MB "
+          f"({total['reduction']}x smaller)".strip())
+    return report
@@ -0,0 +1,233 @@
+# modules
+import hashlib
+import json
+import os
+import mysql.connector
+import pandas as pd
+from query_builder import quote
+
+# Directory of cached extracts, resolved against the working dir like creds.txt / watermarks.json
+CACHE_DIR = '.extract_cache'
+
+# Size limit of CACHE_DIR; least recently used extracts are evicted past it
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# How the source table is fingerprinted: 'checksum' (CHECKSUM TABLE: changes w/ any row, scans the table server
+# side but sends nothing back but a number) or 'key' (COUNT(*) and MAX of the key column the pipeline passes: an
+# index lookup, catches added/removed rows but not rows updated in place). information_schema's UPDATE_TIME /
+# TABLE_ROWS aren't used: MySql 8 caches them for up to information_schema_stats_expiry (24 h) and TABLE_ROWS is
+# an estimate, so they'd serve stale extracts. Computed once per extract (once per run for a partitioned one).
+FINGERPRINT_METHOD = 'checksum'
+
+
+def cache_dir():
+    """
+    Location of the cache directory, created if missing.
+    :return:
+      path: absolute path of the cache directory
+    """
+    path = os.path.join(os.getcwd(), CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_key(qry, params, fingerprint, plan=None):
+    """
+    Key of a cached extract: the query text, its parameters, the fingerprint of the source it was read from and
+    the dtype plan it was read w/ (the cached file keeps those dtypes, so a changed plan is a miss).
+    :return:
+      key: hex digest
+    """
+    plan = sorted((column, str(dtype)) for column, dtype in (plan or {}).items())
+    payload = json.dumps([qry, [str(p) for p in params or ()], str(fingerprint), plan])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def mysql_fingerprint(conn, table, method=None, key_column=None):
+    """
+    Fingerprint of a MySql table that changes whenever its rows do.
+    :param conn: open MySql connection object
+    :param table: table name
+    :param method: 'checksum' or 'key', defaults to FINGERPRINT_METHOD
+    :param key_column: column whose max is part of the 'key' fingerprint, e.g. an auto-increment id
+    :return:
+      fingerprint: str
+    """
+    method = method or FINGERPRINT_METHOD
+    if method not in ('checksum', 'key'):
+        raise ValueError(f"Unsupported fingerprint method: {method}. Use 'checksum' or 'key'.")
+    if method == 'key' and key_column is None:
+        raise ValueError("The 'key' fingerprint needs a key column.")
+
+    cursor = conn.cursor()
+    try:
+        if method == 'key':
+            cursor.execute(f"SELECT COUNT(*), MAX({quote(key_column)}) FROM {quote(table)};")
+            row = cursor.fetchone()
+            cursor.fetchall()
+            return f"key:{row[0]}:{row[1]}"
+        cursor.execute(f"CHECKSUM TABLE {quote(table)};")
+        row = cursor.fetchone()
+        cursor.fetchall()
+        if row is None or row[1] is None:  # NULL for a missing table
+            raise ValueError(f"CHECKSUM TABLE returned no checksum for {table}.")
+        return f"checksum:{row[1]}"
+    finally:
+        cursor.close()
+
+
+def try_fingerprint(conn, table, key_column=None):
+    """
+    mysql_fingerprint(), or None (and a note) when the table can't be fingerprinted, e.g. w/o the privileges
+    CHECKSUM TABLE needs. The extract then runs w/o the cache.
+    :param conn: open MySql connection object
+    :param table: table name
+    :param key_column: see mysql_fingerprint()
+    :return:
+      fingerprint: str or None
+    """
+    try:
+        return mysql_fingerprint(conn, table, key_column=key_column)
+    except (mysql.connector.Error, ValueError) as e:
+        print(f"Could not fingerprint {table}, skipping the extract cache: {e}")
+        return None
+
+
+def cache_path(key):
+    """
+    File of a cached extract.
+    :param key: cache key
+    :return:
+      path: .parquet file in the cache directory
+    """
+    return os.path.join(cache_dir(), key + '.parquet')
+
+
+def read_cached(key):
+    """
+    Read a cached extract. A hit marks the entry as recently used.
+    :param key: cache key
+    :return:
+      df: DataFrame object, or None on a miss
+    """
+    path = cache_path(key)
+    try:
+        df = pd.read_parquet(path)
+    except (FileNotFoundError, OSError):
+        return None
+    try:
+        os.utime(path)  # mtime = last use, for LRU eviction
+    except FileNotFoundError:
+        pass  # evicted by another thread since
+    return df
+
+
+def write_cached(key, df):
+    """
+    Store an extract (dtypes incl.) and evict least recently used entries past CACHE_MAX_BYTES.
+    :param key: cache key
+    :param df: DataFrame object
+    :return:
+      path: cached file
+    """
+    path = cache_path(key)
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    evict(keep=path)
+    return path
+
+
+def evict(max_bytes=None, keep=None):
+    """
+    Remove least recently used entries until the cache fits in max_bytes. Entries removed by another thread
+    (evicting at the same time) in the meantime are skipped.
+    :param max_bytes: size limit, defaults to CACHE_MAX_BYTES
+    :param keep: path never to evict (the entry just written)
+    :return:
+      removed: list of removed files
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    directory = cache_dir()
+    entries = []
+    for file in os.listdir(directory):
+        if file.endswith('.parquet'):
+            path = os.path.join(directory, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(path)
+    return removed
+
+
+def invalidate(key=None):
+    """
+    Drop one cached extract, or the whole cache.
+    :param key: cache key, None to clear every entry
+    :return:
+      n: number of entries removed
+    """
+    if key is not None:
+        try:
+            os.remove(cache_path(key))
+            return 1
+        except FileNotFoundError:
+            return 0
+    directory = cache_dir()
+    files = [file for file in os.listdir(directory) if file.endswith('.parquet')]
+    removed = 0
+    for file in files:
+        try:
+            os.remove(os.path.join(directory, file))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def cached_extract(conn, qry, params, table, read, fingerprint=None, key_column=None, plan=None):
+    """
+    Return the cached result of a query if the source table hasn't changed since it was cached, otherwise
+    run read() and cache what it returns.
+    :param conn: open MySql connection object, used for the fingerprint
+    :param qry: SQL text of the extract
+    :param params: query parameters
+    :param table: source table to fingerprint
+    :param read: func() -> DataFrame running the extract
+    :param fingerprint: fingerprint of table computed by the caller, e.g. once for all the ranges of a
+      partitioned extract; computed here if None
+    :param key_column: see mysql_fingerprint()
+    :param plan: dtype plan read() applies (see dtype_plan.py), part of the cache key
+    :return:
+      df: DataFrame object
+    """
+    if fingerprint is None:
+        fingerprint = try_fingerprint(conn, table, key_column)
+        if fingerprint is None:
+            return read()
+
+    key = cache_key(qry, params, fingerprint, plan)
+    df = read_cached(key)
+    if df is not None:
+        print(f"Extract cache hit: {key[:12]}")
+        return df
+
+    df = read()
+    if df is not None and not df.empty:
+        write_cached(key, df)
+    return df
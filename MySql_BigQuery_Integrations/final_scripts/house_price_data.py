@@ -1,26 +1,79 @@
 # modules
-from google.cloud import bigquery as bq
 from google.api_core.exceptions import GoogleAPIError
 from google.auth.exceptions import DefaultCredentialsError
 import mysql.connector
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import os
+from functools import lru_cache, partial
+from connections import get_bq_client, get_mysql_connection
+from dtype_plan import apply_dtype_plan, read_sql_planned
+from extract_cache import cached_extract
+from instrumentation import emit_report, instrument, record_io
+from query_builder import Query
+from runner import Task
+from sinks import BigQuerySink, LocalSink, fan_out
+from staging import STAGING_FORMAT, StagedWriter, file_extension, write_staged
+from watermark import incremental_window, write_watermark
 
 # set df display options for testing:
 pd.set_option('display.max_rows', 20)
 pd.set_option('display.max_columns', 20)
 pd.set_option('display.width', 1000)
 
+# Max number of rows pulled from MySql per round trip when streaming
+CHUNK_SIZE = 5000
+
+# Incremental loads: only rows w/ a Date past the last committed mark are extracted
+PIPELINE = 'house_price_data'
+SOURCE_TABLE = 'city_house_prices'
+WATERMARK_COLUMN = 'Date'
+
+# Optional subset of 'State-City' columns to extract, None for every column
+HOUSE_COLUMNS = None
+
+# Unpivot wide -> long in MySql (UNION ALL per column) instead of reshape() in pandas. Off by default: the long
+# rows repeat Date/State/City for every price, so more bytes cross the wire than w/ the wide rows. Worth it
+# when MySql sits next to the pipeline and the Python process is the bottleneck.
+PUSHDOWN_UNPIVOT = False
+
+# Serve unchanged extracts from the local cache (see extract_cache.py). Streamed extracts always read MySql.
+USE_EXTRACT_CACHE = True
+
+# dtypes the extract is read w/ (see dtype_plan.py); the price columns are already float64. State/City only
+# show up when the unpivot is pushed down.
+HOUSE_DTYPES = {
+    'Date': 'datetime',
+    'State': 'category',
+    'City': 'category',
+}
+
+# BigQuery table the house prices are loaded to
+BQ_TABLE = 'etl-project-419123.house_price_data.house_prices'
+
+# Write each batch to the local file and the BigQuery staging file concurrently in load()
+PARALLEL_SINKS = True
+
+# Explicit column types of the staged output (and so of the BigQuery table)
+HOUSE_SCHEMA = pa.schema([
+    ('Date', pa.date32()),
+    ('City', pa.string()),
+    ('State', pa.string()),
+    ('Price', pa.float64()),
+])
+
 
 def bq_connector():
     """
     Connect to Google BigQuery. In this build, authentication is handled via Google Cloud SDK locally.
+    The client is created once and shared by every caller in the process (see connections.py).
     :return:
       client: client object
     """
     try:
-        # Attempt to create a client object
-        client = bq.Client(project='etl-project-419123')
+        # Attempt to get the shared client object
+        client = get_bq_client('etl-project-419123')
         print("BigQuery connection successful!")
         return client  # Return the client object if successful
     except DefaultCredentialsError:
@@ -51,7 +104,8 @@ def bq_connector():
 
 def mysql_connector():
     """
-    Connect ot MySql using credentials stored in a .txt file.
+    Connect ot MySql using credentials stored in a .txt file. Connections come from a bounded, health checked
+    pool shared by every caller in the process (see connections.py); conn.close() hands it back to the pool.
     :return:
       conn: connection object
     """
@@ -60,15 +114,8 @@ def mysql_connector():
         cur_path = os.getcwd()
         creds_path = os.path.join(cur_path, "creds.txt")
 
-        with open(creds_path, "r") as file:
-            credentials = {}
-            for line in file:
-                if "=" in line:  # Check for lines containing '='
-                    key, value = line.strip().split("=")
-                    credentials[key.strip()] = value.strip()
-
-        # Establish connection
-        conn = mysql.connector.connect(**credentials)
+        # Check out a pooled connection, the credentials file is only read when the pool is created
+        conn = get_mysql_connection(creds_path)
 
         print("Connection Successful!")
         return conn
@@ -78,20 +125,38 @@ def mysql_connector():
         print(f"Error connecting to MySQL: {err}")
 
 
-def extract():
+def house_query(window=None, pushdown=PUSHDOWN_UNPIVOT):
+    """
+    Build the extract query: the HOUSE_COLUMNS prices (all by default) inside the watermark window, unpivoted
+    to Date/State/City/Price rows by MySql or, when not pushed down, by reshape() in Query.finish().
+    :param window: optional (low, high) watermark window; None extracts the full table
+    :param pushdown: if True, unpivot in MySql
+    :return:
+      query: Query object
+    """
+    return (Query(SOURCE_TABLE)
+            .unpivot(WATERMARK_COLUMN, HOUSE_COLUMNS, ['State', 'City'], 'Price', pushdown=pushdown,
+                     fallback=reshape)
+            .window(WATERMARK_COLUMN, window))
+
+
+@instrument(PIPELINE)
+def extract(window=None, query=None, use_cache=USE_EXTRACT_CACHE):
     """
     Execute MySql query, specified in 'qry' object.
+    :param window: optional (low, high) watermark window; None extracts the full table
+    :param query: Query object to run, defaults to house_query(window)
+    :param use_cache: if True, reuse the cached result while city_house_prices is unchanged
     :return:
       df: DataFrame object of MySQL query results
     """
     try:
         conn = mysql_connector()
-        qry = """
-                SELECT * 
-                FROM city_house_prices;
-              """
         if conn:
-            df = pd.read_sql(qry, conn)
+            qry, params = (query or house_query(window)).sql(conn)
+            read = partial(read_sql_planned, qry, conn, HOUSE_DTYPES, params=params or None)
+            # Unchanged source table + same query -> served from the local extract cache, no MySql read
+            df = cached_extract(conn, qry, params, SOURCE_TABLE, read, plan=HOUSE_DTYPES) if use_cache else read()
             conn.close()
             return df
     except mysql.connector.Error as e:
@@ -100,36 +165,113 @@ def extract():
         print(f"An error occurred: {e}")
 
 
-def transformations():
+def extract_chunks(chunk_size=CHUNK_SIZE, window=None, query=None):
     """
-    Ingests df form extract() and performs following transformations:
+    Stream the same MySql query as extract() through an unbuffered cursor, so only one batch of rows
+    is held in memory at a time. Errors are raised to the consumer (after the batches already yielded),
+    unlike extract(), which prints them and returns None.
+    :param chunk_size: max number of rows per batch
+    :param window: optional (low, high) watermark window; None extracts the full table
+    :param query: Query object to run, defaults to house_query(window)
+    :return:
+      generator of DataFrame objects, one per batch of query results
+    """
+    conn = mysql_connector()
+    if not conn:
+        raise ConnectionError("No MySql connection for the streamed extract.")
+
+    try:
+        qry, params = (query or house_query(window)).sql(conn)
+        # Unbuffered cursor: rows stay on the server until fetched
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(qry, params)
+        columns = [col[0] for col in cursor.description]
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            yield apply_dtype_plan(chunk, HOUSE_DTYPES)
+
+        cursor.close()
+    except mysql.connector.Error as e:
+        # Re-raised: a failure mid-stream must not look like the end of the results to the consumer
+        print(f"MySQL Error: {e}")
+        raise
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+@lru_cache(maxsize=8)
+def parse_headers(headers):
+    """
+    Split each 'State-City' column header once into categorical State/City lookups, instead of splitting
+    the header string again on every long-format row. Cached, so streamed batches reuse the lookup.
+    :param headers: tuple of State-City column headers
+    :return:
+      - state_codes, states: per-header category codes and the State categories
+      - city_codes, cities: per-header category codes and the City categories
+    """
+    parts = [header.split('-', 1) for header in headers]
+    state_codes, states = pd.factorize(pd.Index([part[0] for part in parts]))
+    city_codes, cities = pd.factorize(pd.Index([part[1] for part in parts]))
+    return state_codes, states, city_codes, cities
+
+
+def reshape(df):
+    """
+    Applies the house price transformations to a wide DataFrame of query results:
         - Pivots core data so that all prices for a given state are ordered by Date
         - Split State-City values into distinct columns
+    The long frame is built straight from the wide arrays: prices are converted column by column before the
+    melt, dates once per source row, and State/City come from the parsed header lookup as categoricals.
+    Empty source cells are dropped, as df.stack() did.
+    :param df: DataFrame object w/ a 'Date' column and one column per State-City
     :return:
       - df: transformed DataFrame object
     """
-    try:
-        df = extract()
-        if df.empty:
-            raise ValueError("DataFrame is empty. Cannot perform transformations.")
+    dates = pd.to_datetime(df['Date']).to_numpy()
+    wide = df.drop(columns='Date')
+    state_codes, states, city_codes, cities = parse_headers(tuple(wide.columns))
 
-        df.set_index('Date', inplace=True)
-        df = df.stack().reset_index()
-        df.columns = ['Date', 'City', 'Price']
+    # Row-major flattening = the Date-then-column order stack() produced
+    present = wide.notna().to_numpy().ravel()
+    prices = wide.apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64').ravel()[present]
 
-        # Convert 'Price' column to numeric data type
-        df['Price'] = pd.to_numeric(df['Price'], errors='coerce')
+    n_rows, n_cols = wide.shape
+    row_idx = np.repeat(np.arange(n_rows), n_cols)[present]
+    col_idx = np.tile(np.arange(n_cols), n_rows)[present]
 
-        # Convert 'Date' column to datetime datatype
-        df['Date'] = pd.to_datetime(df['Date'])
+    return pd.DataFrame({
+        'Date': dates[row_idx],
+        'City': pd.Categorical.from_codes(city_codes[col_idx], categories=cities),
+        'State': pd.Categorical.from_codes(state_codes[col_idx], categories=states),
+        'Price': prices,
+    })
 
-        # Splitting the City column into State and City columns
-        df[['State', 'City']] = df['City'].str.split('-', expand=True)
 
-        # Rearrange the columns
-        df = df[['Date', 'City', 'State', 'Price']]
+@instrument(PIPELINE)
+def transformations(window=None, pushdown=PUSHDOWN_UNPIVOT):
+    """
+    Ingests df form extract() and performs following transformations:
+        - Pivots core data so that all prices for a given state are ordered by Date
+        - Split State-City values into distinct columns
+    :param window: optional (low, high) watermark window passed through to extract()
+    :param pushdown: if True, MySql does the unpivot and only the dtypes are set here
+    :return:
+      - df: transformed DataFrame object
+    """
+    try:
+        query = house_query(window, pushdown)
+        df = extract(window, query)
+        if df.empty:
+            raise ValueError("DataFrame is empty. Cannot perform transformations.")
 
-        return df
+        return query.finish(df)[list(HOUSE_SCHEMA.names)]
 
     except KeyError:
         print("Error: 'Date' column does not exist in the DataFrame.")
@@ -139,25 +281,130 @@ def transformations():
         print("An unexpected error occurred:", e)
 
 
-def load_local():
+def transformations_stream(chunk_size=CHUNK_SIZE, window=None, pushdown=PUSHDOWN_UNPIVOT):
     """
-    Loads df data into specified local dir as .csv
-    :return: None
+    Streaming counterpart of transformations(). Each batch from extract_chunks() is reshaped as soon
+    as it arrives, so the first rows are transformed before the whole query has been read.
+    :param chunk_size: max number of source rows per batch
+    :param window: optional (low, high) watermark window passed through to extract_chunks()
+    :param pushdown: if True, MySql does the unpivot and only the dtypes are set here
+    :return:
+      - generator of transformed DataFrame objects; raises if the extract fails part way
     """
     try:
-        df = transformations()
-        if df.empty:
-            raise ValueError("DataFrame is empty. Cannot export to CSV.")
+        query = house_query(window, pushdown)
+        for chunk in extract_chunks(chunk_size, window, query):
+            yield query.finish(chunk)[list(HOUSE_SCHEMA.names)]
+
+    except KeyError:
+        print("Error: 'Date' column does not exist in the DataFrame.")
+        raise
+
+
+def is_delta(window):
+    """
+    Whether a watermark window covers only new rows (append) rather than the whole table (replace).
+    :param window: (low, high) watermark window or None
+    :return:
+      bool
+    """
+    return window is not None and window[0] is not None
+
+
+def delta_key(window):
+    """
+    Key of what a delta run writes: the committed mark it starts from. A retried delta (the mark isn't
+    advanced until every sink has the rows) has the same key, so it replaces what the failed run wrote in a
+    sink rather than appending to it.
+    :param window: (low, high) watermark window
+    :return:
+      key: date of the mark, or None on a full load
+    """
+    return pd.Timestamp(window[0]).date() if is_delta(window) else None
 
-        cur_path = os.getcwd()
-        output_dir = os.path.join(cur_path, 'house_price_data')
-        os.makedirs(output_dir, exist_ok=True)  # Create the output directory if it doesn't exist
 
-        file_name = "house_prices.csv"
-        file_path = os.path.join(output_dir, file_name)
+def local_path(fmt=STAGING_FORMAT):
+    """
+    Staged dataset the house prices are written to locally, a dir of part files (see staging.StagedWriter).
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :return:
+      file_path: path in the house_price_data dir, which is created if missing
+    """
+    cur_path = os.getcwd()
+    output_dir = os.path.join(cur_path, 'house_price_data')
+    os.makedirs(output_dir, exist_ok=True)  # Create the output directory if it doesn't exist
+
+    file_name = "house_prices" + file_extension(fmt)
+    return os.path.join(output_dir, file_name)
+
+
+def bq_sink(client, window=None, fmt=STAGING_FORMAT):
+    """
+    BigQuerySink of the house prices table. A full load replaces the table, a delta load (see is_delta())
+    deletes the rows past the mark (left by an earlier attempt at the same delta) and appends to it.
+    :param client: BigQuery client object
+    :param window: optional (low, high) watermark window
+    :param fmt: staging format the data is uploaded in, see staging.FILE_EXTENSIONS
+    :return:
+      sink: sinks.BigQuerySink object
+    """
+    if is_delta(window):
+        return BigQuerySink(client, BQ_TABLE, fmt, HOUSE_SCHEMA, 'WRITE_APPEND',
+                            replace_after=(WATERMARK_COLUMN, delta_key(window)))
+    return BigQuerySink(client, BQ_TABLE, fmt, HOUSE_SCHEMA, 'WRITE_TRUNCATE')
+
+
+def local_sink(window=None, fmt=STAGING_FORMAT):
+    """
+    LocalSink of the staged house prices. A full load replaces the dataset, a delta load adds a part keyed by
+    delta_key(), which replaces the part an earlier attempt at the same delta left.
+    :param window: optional (low, high) watermark window
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :return:
+      sink: sinks.LocalSink object
+    """
+    return LocalSink(local_path(fmt), fmt, HOUSE_SCHEMA, is_delta(window), key=delta_key(window))
 
-        # Export subset of DataFrame to CSV
-        df.to_csv(file_path, index=False)
+
+@instrument(PIPELINE)
+def load_local(stream=False, chunk_size=CHUNK_SIZE, window=None, fmt=STAGING_FORMAT, df=None):
+    """
+    Loads df data into specified local dir as a staged dataset (Parquet by default)
+    :param stream: if True, extract/transform/write in batches of chunk_size rows to keep memory flat
+    :param chunk_size: max number of source rows per batch when streaming
+    :param window: optional (low, high) watermark window; delta rows are added as a new part of the dataset,
+      replacing the part of an earlier attempt at the same delta (see delta_key())
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :param df: already transformed DataFrame to write, skips transformations() (ignored when streaming)
+    :return:
+      True if the export succeeded, otherwise None
+    """
+    try:
+        file_path = local_path(fmt)
+
+        # Delta runs add a part next to the ones from prior runs instead of replacing them
+        append, key = is_delta(window), delta_key(window)
+
+        if stream:
+            # Each batch is written as soon as it is transformed
+            with StagedWriter(file_path, fmt, HOUSE_SCHEMA, append, key) as writer:
+                for df in transformations_stream(chunk_size, window):
+                    writer.write(df)
+
+            if writer.rows == 0:
+                raise ValueError("DataFrame is empty. Cannot export.")
+            record_io(rows_out=writer.rows, bytes_out=writer.bytes)
+            return True
+
+        if df is None:
+            df = transformations(window)
+        if df.empty:
+            raise ValueError("DataFrame is empty. Cannot export.")
+
+        # Export DataFrame to staged file
+        rows, n_bytes = write_staged(df, file_path, fmt, HOUSE_SCHEMA, append, key)
+        record_io(rows_in=rows, rows_out=rows, bytes_out=n_bytes)
+        return True
 
     except FileNotFoundError:
         print("Error: Specified file path does not exist.")
@@ -167,35 +414,31 @@ def load_local():
         print(f"An error occurred: {str(e)}")
 
 
-def load_bq():
+@instrument(PIPELINE)
+def load_bq(window=None, fmt=STAGING_FORMAT, df=None):
     """
-    Loads df data into specified BigQuery dataset. Current load build-out removes prior data
-    and replaces with data from current run.
-    :return: None
+    Loads df data into specified BigQuery dataset. A full load removes prior data and replaces it
+    with data from current run; a delta load (see is_delta()) appends the new rows instead, see bq_sink().
+    :param window: optional (low, high) watermark window passed through to transformations()
+    :param fmt: staging format the data is uploaded in, see staging.FILE_EXTENSIONS
+    :param df: already transformed DataFrame to load, skips transformations()
+    :return:
+      True if the load succeeded, otherwise None
     """
     try:
         client = bq_connector()
-        trg_dataset = 'etl-project-419123.house_price_data.house_prices'
-
-        job_config = bq.LoadJobConfig(
-            autodetect=True,
-            # Replaces existing data w/ most current
-            write_disposition='WRITE_TRUNCATE'
-        )
-
-        df = transformations()  # Assuming transformations() returns the DataFrame to load
 
-        job = client.load_table_from_dataframe(
-            df,
-            trg_dataset,
-            job_config=job_config
-        )
+        # Replaces existing data w/ most current, unless only new rows were extracted
+        sink = bq_sink(client, window, fmt)
 
-        job.result()
+        if df is None:
+            df = transformations(window)  # Assuming transformations() returns the DataFrame to load
 
-        # Data load check
-        destination_tbl = client.get_table(trg_dataset)
-        print(f"{destination_tbl.num_rows} loaded to {destination_tbl}.")
+        # Staged w/ the explicit schema, so column types don't depend on autodetection
+        sink.write(df)
+        stats = sink.close()
+        record_io(rows_in=len(df), rows_out=stats['rows'], bytes_out=stats['bytes'])
+        return True
 
     except GoogleAPIError as error:
         print("BigQuery error:", error)
@@ -203,6 +446,103 @@ def load_bq():
         print("An unexpected error occurred:", e)
 
 
+@instrument(PIPELINE)
+def load(stream=False, chunk_size=CHUNK_SIZE, window=None, fmt=STAGING_FORMAT, parallel=PARALLEL_SINKS, df=None):
+    """
+    Fan-out load: extract and transform once, and write the result to the local staged file and to BigQuery
+    in the same pass (see sinks.fan_out()), instead of load_local() and load_bq() each running the extract.
+    :param stream: if True, extract/transform in batches of chunk_size rows, each batch going to both sinks
+      before the next one is read, to keep memory flat
+    :param chunk_size: max number of source rows per batch when streaming
+    :param window: optional (low, high) watermark window; delta rows are appended in both sinks, replacing
+      what an earlier attempt at the same delta left in either (a failed sink doesn't stop the other one)
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :param parallel: if True, write to the sinks concurrently
+    :param df: already transformed DataFrame to write, skips transformations() (ignored when streaming)
+    :return:
+      True if every sink succeeded, otherwise None
+    """
+    try:
+        client = bq_connector()
+        if client is None:
+            raise ValueError("No BigQuery client. Cannot load.")
+
+        sinks = [local_sink(window, fmt), bq_sink(client, window, fmt)]
+
+        if stream:
+            frames = transformations_stream(chunk_size, window)
+        else:
+            if df is None:
+                df = transformations(window)
+            if df is None or df.empty:
+                raise ValueError("DataFrame is empty. Cannot export.")
+            frames = df
+
+        results = fan_out(frames, sinks, parallel)
+        if any(stats is None for stats in results.values()):
+            return None
+
+        rows = results['local']['rows']
+        record_io(rows_in=rows, rows_out=rows * len(sinks),
+                  bytes_out=sum(stats['bytes'] for stats in results.values()))
+        return True
+
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+
+
+def delta_window():
+    """
+    Compare the committed watermark against the source table to find the rows this run should load.
+    :return:
+      window: (low, high) watermark window, or None if there is nothing new to load
+    """
+    conn = mysql_connector()
+    if not conn:
+        return None
+    try:
+        return incremental_window(conn, PIPELINE, SOURCE_TABLE, WATERMARK_COLUMN)
+    except mysql.connector.Error as e:
+        print(f"MySQL Error: {e}")
+    finally:
+        conn.close()
+
+
+def commit_watermark(window, *loaded):
+    """
+    Advance the mark to the end of the window once every sink has the rows.
+    :param window: (low, high) watermark window that was loaded
+    :param loaded: results of the load stages, only there to order this after them
+    :return:
+      True
+    """
+    write_watermark(PIPELINE, window[1])
+    return True
+
+
+def tasks():
+    """
+    Stages of this pipeline as a DAG for runner.py. The transformed frame is computed once and fanned out to
+    the local file and BigQuery by load(); the mark is only advanced once both sinks succeeded.
+    :return:
+      list of runner.Task objects
+    """
+    return [
+        Task('delta_window', delta_window),
+        Task('transformations', transformations, deps=['delta_window']),
+        Task('load', lambda window, df: load(window=window, df=df), deps=['delta_window', 'transformations']),
+        Task('commit_watermark', commit_watermark, deps=['delta_window', 'load']),
+    ]
+
+
 if __name__ == '__main__':
-    load_local()
-    load_bq()
+    window = delta_window()
+    if window is None:
+        print("No new rows since last run. Nothing to load.")
+    # Only advance the mark once every sink has the delta, so a failed run is retried in full
+    # One streamed extract, each batch written to both the local file and the BigQuery upload
+    elif load(stream=True, window=window):
+        write_watermark(PIPELINE, window[1])
+
+    # Per-stage timings, memory and row counts of this run
+    emit_report()
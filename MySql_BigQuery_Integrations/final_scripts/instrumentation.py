@@ -0,0 +1,338 @@
+# modules
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime as dt
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Where emit_report() appends one JSON line per stage run
+REPORT_FILE = 'stage_report.jsonl'
+
+# Where emit_report() also writes the run in Prometheus text format, e.g. 'etl_stages.prom'. None to skip.
+PROMETHEUS_FILE = None
+
+# How often the process RSS is sampled while a stage runs, for the stage's RSS peak (rss_peak_mb). One
+# background thread samples for every open stage and only runs while there is one.
+RSS_SAMPLE_S = 0.01
+
+# Also trace Python/numpy allocations w/ tracemalloc, for a per-stage traced peak (traced_peak_mb). Off by
+# default: tracing slows every allocation down, several times over for the pandas heavy stages. tracemalloc's
+# peak is process wide, so a stage that overlaps a stage on another thread gets no traced peak (None).
+TRACE_MALLOC = False
+
+RUN_ID = uuid.uuid4().hex[:12]
+
+_records = []
+_records_lock = threading.Lock()
+_local = threading.local()
+
+_rss_windows = []
+_rss_lock = threading.Lock()
+_rss_sampler = None
+
+_trace_lock = threading.Lock()
+_trace_state = {'threads': {}, 'overlaps': 0, 'started': False}
+
+
+def frame_size(obj):
+    """
+    Rows and in-memory bytes of a stage input/output, if it is a DataFrame.
+    :param obj: any stage argument or return value
+    :return:
+      rows, bytes: or (None, None) for anything that isn't a DataFrame
+    """
+    if isinstance(obj, pd.DataFrame):
+        return len(obj), int(obj.memory_usage(index=True, deep=False).sum())
+    return None, None
+
+
+def record_io(rows_in=None, bytes_in=None, rows_out=None, bytes_out=None):
+    """
+    Report rows/bytes for the stage currently running on this thread. For stages whose input or output is
+    not a DataFrame (files written, tables loaded), as those are not picked up automatically.
+    :return: None
+    """
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    frame = stack[-1]
+    for key, value in (('rows_in', rows_in), ('bytes_in', bytes_in), ('rows_out', rows_out), ('bytes_out', bytes_out)):
+        if value is not None:
+            frame[key] = value
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process so far.
+    :return:
+      peak_rss_mb: float, or None where the resource module is not available
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, KB on Linux
+    return round(max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024, 1)
+
+
+def current_rss_mb():
+    """
+    Current resident set size of the process.
+    :return:
+      rss_mb: float, or None where /proc/self/statm isn't available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _sample_rss():
+    global _rss_sampler
+    while True:
+        with _rss_lock:
+            if not _rss_windows:
+                _rss_sampler = None
+                return
+            windows = list(_rss_windows)
+        rss = current_rss_mb()
+        for window in windows:
+            window['peak'] = max(window['peak'], rss)
+        time.sleep(RSS_SAMPLE_S)
+
+
+def _open_rss_window():
+    # Start tracking the RSS peak of a stage, starting the sampler thread if no other stage is open
+    global _rss_sampler
+    rss = current_rss_mb()
+    if rss is None:
+        return None
+    window = {'peak': rss}
+    with _rss_lock:
+        _rss_windows.append(window)
+        if _rss_sampler is None:
+            _rss_sampler = threading.Thread(target=_sample_rss, daemon=True)
+            _rss_sampler.start()
+    return window
+
+
+def _close_rss_window(window):
+    if window is None:
+        return None
+    with _rss_lock:
+        # By identity: windows of overlapping stages can hold the same peak and so compare equal
+        _rss_windows[:] = [open_window for open_window in _rss_windows if open_window is not window]
+    return round(max(window['peak'], current_rss_mb()), 1)
+
+
+def _start_trace(stack):
+    # Returns (traced memory at the start, overlap count at the start), or None if the stage can't get a
+    # traced peak because a stage on another thread is running
+    me = threading.get_ident()
+    with _trace_lock:
+        threads = _trace_state['threads']
+        shared = any(count for thread, count in threads.items() if thread != me)
+        if shared:
+            _trace_state['overlaps'] += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_state['started'] = True
+        threads[me] = threads.get(me, 0) + 1
+        if shared:
+            return None
+        mem_start, parent_peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['child_peak'] = max(stack[-1]['child_peak'], parent_peak)
+        tracemalloc.reset_peak()
+        return mem_start, _trace_state['overlaps']
+
+
+def _stop_trace(trace, frame, stack):
+    # Traced peak of the stage in MB, None if it overlapped a stage on another thread. Stops tracing once no
+    # stage is running anymore, if tracing was started here.
+    me = threading.get_ident()
+    with _trace_lock:
+        traced_peak_mb = None
+        if trace is not None and trace[1] == _trace_state['overlaps']:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            traced_peak_mb = round((peak - trace[0]) / 1024 ** 2, 3)
+            # Let the enclosing stage see this stage's peak, as reset_peak() hid it
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak)
+
+        threads = _trace_state['threads']
+        threads[me] -= 1
+        if not threads[me]:
+            del threads[me]
+        if not threads and _trace_state['started']:
+            tracemalloc.stop()
+            _trace_state['started'] = False
+        return traced_peak_mb
+
+
+def instrument(pipeline, stage=None):
+    """
+    Decorator recording wall time, CPU time, RSS peak while the stage ran, process peak RSS, traced memory peak
+    (w/ TRACE_MALLOC) and rows/bytes in and out for every call of an ETL stage. DataFrame arguments/return
+    values are measured automatically; anything else can be reported from inside the stage w/ record_io().
+    Nested stages are recorded separately, each w/ its own inclusive timings. The pipeline stages catch and print their own errors and return None,
+    so a None result is recorded as status 'failed' (an exception that escapes as 'error').
+    :param pipeline: pipeline name, e.g. 'house_price_data'
+    :param stage: stage name, defaults to the function name
+    :return:
+      decorator
+    """
+    def decorator(func):
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _local.__dict__.setdefault('stack', [])
+            frame = {'stage': name, 'rows_in': None, 'bytes_in': None, 'rows_out': None, 'bytes_out': None,
+                     'child_peak': 0}
+
+            for arg in list(args) + list(kwargs.values()):
+                rows, n_bytes = frame_size(arg)
+                if rows is not None:
+                    frame['rows_in'] = (frame['rows_in'] or 0) + rows
+                    frame['bytes_in'] = (frame['bytes_in'] or 0) + n_bytes
+
+            tracing = TRACE_MALLOC
+            trace = _start_trace(stack) if tracing else None
+            rss_window = _open_rss_window()
+
+            stack.append(frame)
+            status = 'ok'
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except BaseException:
+                status = 'error'
+                result = None
+                raise
+            finally:
+                wall_s = time.perf_counter() - wall_start
+                cpu_s = time.process_time() - cpu_start
+                stack.pop()
+
+                rss_peak_mb = _close_rss_window(rss_window)
+                traced_peak_mb = _stop_trace(trace, frame, stack) if tracing else None
+
+                if status == 'ok' and result is None:
+                    status = 'failed'
+                rows_out, bytes_out = frame_size(result)
+                _record({
+                    'run_id': RUN_ID,
+                    'timestamp': dt.now().isoformat(timespec='seconds'),
+                    'pipeline': pipeline,
+                    'stage': name,
+                    'parent': stack[-1]['stage'] if stack else None,
+                    'status': status,
+                    'wall_s': round(wall_s, 4),
+                    'cpu_s': round(cpu_s, 4),
+                    'rss_peak_mb': rss_peak_mb,
+                    'traced_peak_mb': traced_peak_mb,
+                    'peak_rss_mb': peak_rss_mb(),
+                    'rows_in': frame['rows_in'],
+                    'bytes_in': frame['bytes_in'],
+                    'rows_out': frame['rows_out'] if frame['rows_out'] is not None else rows_out,
+                    'bytes_out': frame['bytes_out'] if frame['bytes_out'] is not None else bytes_out,
+                })
+
+        return wrapper
+
+    return decorator
+
+
+def _record(record):
+    with _records_lock:
+        _records.append(record)
+
+
+def stage_records():
+    """
+    Stage records collected in this process so far, in completion order.
+    :return:
+      records: list of dicts
+    """
+    with _records_lock:
+        return list(_records)
+
+
+def clear_records():
+    """
+    Forget the stage records collected so far, e.g. once they have been emitted by a long-lived worker.
+    :return: None
+    """
+    with _records_lock:
+        _records.clear()
+
+
+def prometheus_text(records):
+    """
+    Render stage records in the Prometheus text exposition format (e.g. for a node_exporter textfile collector).
+    :param records: list of stage records
+    :return:
+      text: str
+    """
+    metrics = [
+        ('etl_stage_wall_seconds', 'gauge', 'Wall time of the ETL stage.', 'wall_s'),
+        ('etl_stage_cpu_seconds', 'gauge', 'CPU time of the ETL stage.', 'cpu_s'),
+        ('etl_stage_rss_peak_megabytes', 'gauge', 'Peak process RSS sampled while the stage ran.', 'rss_peak_mb'),
+        ('etl_stage_traced_peak_megabytes', 'gauge', 'Peak traced memory allocated during the stage.', 'traced_peak_mb'),
+        ('etl_stage_peak_rss_megabytes', 'gauge', 'Process peak RSS at the end of the stage.', 'peak_rss_mb'),
+        ('etl_stage_rows_in', 'gauge', 'Rows passed into the stage.', 'rows_in'),
+        ('etl_stage_rows_out', 'gauge', 'Rows produced by the stage.', 'rows_out'),
+        ('etl_stage_bytes_in', 'gauge', 'Bytes passed into the stage.', 'bytes_in'),
+        ('etl_stage_bytes_out', 'gauge', 'Bytes produced by the stage.', 'bytes_out'),
+    ]
+    # Last run of each stage wins, a gauge holds one value per label set
+    latest = {(r['pipeline'], r['stage']): r for r in records}
+
+    lines = []
+    for metric, metric_type, help_text, key in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for (pipeline, stage), r in latest.items():
+            if r[key] is not None:
+                lines.append(f'{metric}{{pipeline="{pipeline}",stage="{stage}",status="{r["status"]}"}} {r[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def emit_report(report_path=None, prometheus_path=None):
+    """
+    Write the stage records of this run: appended as JSON lines to report_path and, optionally, written
+    (replaced) in Prometheus text format to prometheus_path. Both are resolved against the working dir.
+    :param report_path: JSON lines file, defaults to REPORT_FILE
+    :param prometheus_path: optional .prom file, defaults to PROMETHEUS_FILE
+    :return:
+      records: the stage records written
+    """
+    records = stage_records()
+    report_path = os.path.join(os.getcwd(), report_path or REPORT_FILE)
+    prometheus_path = prometheus_path or PROMETHEUS_FILE
+
+    with open(report_path, "a") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+    if prometheus_path:
+        prometheus_path = os.path.join(os.getcwd(), prometheus_path)
+        tmp_path = prometheus_path + '.tmp'
+        with open(tmp_path, "w") as file:
+            file.write(prometheus_text(records))
+        os.replace(tmp_path, prometheus_path)
+
+    return records
@@ -1,25 +1,102 @@
 # modules
 import os
-from google.cloud import bigquery as bq
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.api_core.exceptions import GoogleAPIError
 from google.auth.exceptions import DefaultCredentialsError
 import mysql.connector
 import pandas as pd
+import pyarrow as pa
+from connections import POOL_SIZE, get_bq_client, get_mysql_connection
+from dtype_plan import read_sql_planned
+from extract_cache import cached_extract, try_fingerprint
+from instrumentation import emit_report, instrument, record_io
+from partitioned_writer import write_partitions
+from query_builder import Query, bucketize, quote
+from runner import Task
+from staging import STAGING_FORMAT, bq_load_config, file_extension, open_upload, remove_staged, staged_size
+from watermark import incremental_window, write_watermark
 
 # set df display options for testing:
 pd.set_option('display.max_rows', 20)
 pd.set_option('display.max_columns', 20)
 pd.set_option('display.width', 1000)
 
+# Incremental loads: only movies w/ a watermark value at/past the last committed mark are extracted.
+# 'year' isn't unique and titles keep being added to the latest year after it was loaded, so the lower bound is
+# inclusive (WATERMARK_INCLUSIVE): every delta extracts the last loaded year again in full, and the yearly files and
+# tables of the years in a delta are replaced rather than appended to, which dedupes the rows loaded before.
+# Titles added to older years are only picked up by a full reload (delete the mark from watermarks.json).
+PIPELINE = 'movie_data'
+SOURCE_TABLE = 'imdb_movies'
+WATERMARK_COLUMN = 'year'
+WATERMARK_INCLUSIVE = True
+
+# Duration buckets for 'length_category'. A duration below LENGTH_THRESHOLDS[i] (and not below the previous
+# threshold) gets LENGTH_LABELS[i]; anything at/above the last threshold, or missing, gets LENGTH_DEFAULT.
+LENGTH_THRESHOLDS = [60, 120]
+LENGTH_LABELS = ['Short Film', 'Avg. Length Film']
+LENGTH_DEFAULT = 'No Data'
+
+# Bucket 'duration' in MySql (CASE expression) instead of pandas. False runs length_category() on the results.
+PUSHDOWN = True
+
+# avg_vote -> movie_category, evaluated by MySql
+MOVIE_CATEGORY_SQL = """case
+                    when avg_vote <= 3 then  'Poor'
+                    when avg_vote > 3 and avg_vote < 7 then  'Average'
+                    when avg_vote >= 7 then  'Excellent'
+                end"""
+
+# Column the local output is split on, one staged file per distinct value
+PARTITION_KEY = 'year'
+
+# Explicit column types of the staged yearly files (and so of the BigQuery tables)
+MOVIE_SCHEMA = pa.schema([
+    ('year', pa.int64()),
+    ('title', pa.string()),
+    ('genre', pa.string()),
+    ('avg_vote', pa.float64()),
+    ('movie_category', pa.string()),
+    ('duration', pa.int64()),
+    ('length_category', pa.string()),
+])
+
+# dtypes the extract is read w/, batch by batch (see dtype_plan.py). avg_vote stays float64 so the staged
+# vals don't change; 'year'/'duration' are nullable ints as either can be missing in the source.
+MOVIE_DTYPES = {
+    'year': 'Int16',
+    'title': 'string[pyarrow]',
+    'genre': 'category',
+    'avg_vote': 'float64',
+    'movie_category': 'category',
+    'duration': 'Int16',
+    'length_category': 'category',
+}
+
+# Serve unchanged extracts from the local cache (see extract_cache.py)
+USE_EXTRACT_CACHE = True
+
+# Partitioned extract (load_local_partitioned()): imdb_movies is read as EXTRACT_PARTITIONS contiguous ranges of
+# PARTITION_KEY w/ about the same number of rows each, at most MAX_EXTRACT_WORKERS at a time over pooled connections.
+# Several times more ranges than workers, so the ranges in flight stay a small share of the table in memory
+EXTRACT_PARTITIONS = 32
+MAX_EXTRACT_WORKERS = POOL_SIZE
+
+# Max number of BigQuery load jobs uploading/running at the same time
+MAX_IN_FLIGHT_LOADS = 8
+
 
 def bq_connector():
     """
     Connect to Google BigQuery. In this build, authentication is handled via Google Cloud SDK locally.
+    The client is created once and shared by every caller in the process (see connections.py).
     :return:
       client: client object
     """
     try:
-        # Attempt to create a client object
-        client = bq.Client(project='etl-project-419123')
+        # Attempt to get the shared client object
+        client = get_bq_client('etl-project-419123')
         print("BigQuery connection successful!")
         return client  # Return the client object if successful
     except DefaultCredentialsError:
@@ -34,7 +111,8 @@ def bq_connector():
 
 def mysql_connector():
     """
-    Connect ot MySql using credentials stored in a .txt file.
+    Connect ot MySql using credentials stored in a .txt file. Connections come from a bounded, health checked
+    pool shared by every caller in the process (see connections.py); conn.close() hands it back to the pool.
     :return:
       conn: connection object
     """
@@ -43,15 +121,8 @@ def mysql_connector():
         cur_path = os.getcwd()
         creds_path = os.path.join(cur_path, "../creds.txt")
 
-        with open(creds_path, "r") as file:
-            credentials = {}
-            for line in file:
-                if "=" in line:  # Check for lines containing '='
-                    key, value = line.strip().split("=")
-                    credentials[key.strip()] = value.strip()
-
-        # Establish connection
-        conn = mysql.connector.connect(**credentials)
+        # Check out a pooled connection, the credentials file is only read when the pool is created
+        conn = get_mysql_connection(creds_path)
 
         print("Connection Successful!")
         return conn
@@ -61,30 +132,41 @@ def mysql_connector():
         print(f"Error connecting to MySQL: {err}")
 
 
-def extract():
+def movie_query(window=None, pushdown=PUSHDOWN):
+    """
+    Build the extract query: the columns the pipeline stages, movie_category and (when pushed down) the
+    length_category buckets computed by MySql, restricted to the watermark window.
+    :param window: optional (low, high) watermark window; None extracts the full table
+    :param pushdown: if False, length_category is left to Query.finish() in pandas
+    :return:
+      query: Query object
+    """
+    return (Query(SOURCE_TABLE)
+            .select('year', 'title', 'genre', 'avg_vote')
+            .select_expr(MOVIE_CATEGORY_SQL, 'movie_category')
+            .select('duration')
+            .bucket('duration', LENGTH_THRESHOLDS, LENGTH_LABELS, LENGTH_DEFAULT, 'length_category',
+                    pushdown=pushdown)
+            .window(WATERMARK_COLUMN, window, WATERMARK_INCLUSIVE))
+
+
+@instrument(PIPELINE)
+def extract(window=None, query=None, use_cache=USE_EXTRACT_CACHE):
     """
     Execute MySql query, specified in 'qry' object.
+    :param window: optional (low, high) watermark window; None extracts the full table
+    :param query: Query object to run, defaults to movie_query(window)
+    :param use_cache: if True, reuse the cached result while imdb_movies is unchanged
     :return:
       df: DataFrame object of MySQL query results
     """
     try:
         conn = mysql_connector()
-        qry = """
-              SELECT 
-                year, 
-                title, 
-                genre, 
-                avg_vote,
-                case
-                    when avg_vote <= 3 then  'Poor'
-                    when avg_vote > 3 and avg_vote < 7 then  'Average'
-                    when avg_vote >= 7 then  'Excellent'
-                end as movie_category,
-                duration
-              FROM imdb_movies;
-              """
+        qry, params = (query or movie_query(window)).sql()
         if conn:
-            df = pd.read_sql(qry, conn)
+            read = partial(read_sql_planned, qry, conn, MOVIE_DTYPES, params=params or None)
+            # Unchanged source table + same query -> served from the local extract cache, no MySql read
+            df = cached_extract(conn, qry, params, SOURCE_TABLE, read, plan=MOVIE_DTYPES) if use_cache else read()
             conn.close()
             return df
     except mysql.connector.Error as e:
@@ -95,7 +177,8 @@ def extract():
 
 def transformations(d):
     """
-    Generates derived column of str data based on input column 'd', which is the duration column in the core dataset
+    Generates derived column of str data based on input column 'd', which is the duration column in the core dataset.
+    Row-wise reference for length_category() and the CASE expression movie_query() pushes down.
     :param d: num val from duration column
     :return:
       - Str val added to each row in derived column based on num val
@@ -110,37 +193,185 @@ def transformations(d):
         return 'No Data'
 
 
-def load_local():
+def length_category(duration, thresholds=None, labels=None, default=None):
+    """
+    Vectorized version of transformations(): bins the whole duration column in one pass.
+    :param duration: Series of num vals from duration column
+    :param thresholds: ascending upper bounds (exclusive) of each bucket, defaults to LENGTH_THRESHOLDS
+    :param labels: label for each bucket, defaults to LENGTH_LABELS
+    :param default: label for durations past the last threshold or missing, defaults to LENGTH_DEFAULT
+    :return:
+      - categorical Series of labels, aligned w/ duration
+    """
+    thresholds = LENGTH_THRESHOLDS if thresholds is None else thresholds
+    labels = LENGTH_LABELS if labels is None else labels
+    default = LENGTH_DEFAULT if default is None else default
+
+    # Index of the first threshold strictly greater than each value; NaN gets the default
+    return bucketize(duration, thresholds, labels, default, closed='left', name='length_category')
+
+
+def extract_transformed(window=None, pushdown=PUSHDOWN):
+    """
+    Extract the movies and apply whatever transformation wasn't pushed down to MySql.
+    :param window: optional (low, high) watermark window passed through to extract()
+    :param pushdown: if True, length_category is computed by MySql, otherwise in pandas
+    :return:
+      df: transformed DataFrame object (empty if there are no rows), or None if the extract failed
+    """
+    query = movie_query(window, pushdown)
+    df = extract(window, query)
+    if df is None or df.empty:
+        return df
+    return query.finish(df)
+
+
+def partition_ranges(conn, window=None, n_partitions=EXTRACT_PARTITIONS):
+    """
+    Split the rows of the watermark window into contiguous PARTITION_KEY ranges of about the same row count,
+    from the per-value row counts (one small GROUP BY) rather than min/max, as movies per year are skewed.
+    :param conn: open MySql connection object
+    :param window: optional (low, high) watermark window; None splits the full table
+    :param n_partitions: max number of ranges
+    :return:
+      ranges: list of (low, high) ranges, low exclusive (None for the first) and high inclusive, like a window
+    """
+    query = Query(SOURCE_TABLE).select(PARTITION_KEY).window(WATERMARK_COLUMN, window, WATERMARK_INCLUSIVE)
+    qry, params = query.sql()
+    key = quote(PARTITION_KEY)
+    qry = f"SELECT {key}, COUNT(*) FROM ({qry}) AS w GROUP BY {key} ORDER BY {key}"
+
+    cursor = conn.cursor()
+    cursor.execute(qry, params)
+    counts = cursor.fetchall()
+    cursor.close()
+
+    # NULL keys can't be range-filtered; they sort first, so skip them
+    counts = [(value, n) for value, n in counts if value is not None]
+    if not counts:
+        return []
+
+    target = sum(n for _, n in counts) / n_partitions
+    ranges, low, rows = [], None, 0
+    for value, n in counts:
+        rows += n
+        if rows >= target * (len(ranges) + 1) and len(ranges) < n_partitions - 1:
+            ranges.append((low, value))
+            low = value
+    if low != counts[-1][0] or not ranges:
+        ranges.append((low, counts[-1][0]))
+    return ranges
+
+
+def extract_partition(key_range, window=None, pushdown=PUSHDOWN, use_cache=USE_EXTRACT_CACHE, fingerprint=None):
+    """
+    Extract and transform one PARTITION_KEY range over its own pooled connection, see partition_ranges().
+    :param key_range: (low, high) range of PARTITION_KEY
+    :param window: optional (low, high) watermark window
+    :param pushdown: if True, length_category is computed by MySql, otherwise in pandas
+    :param use_cache: if True, reuse the cached result of the range while imdb_movies is unchanged
+    :param fingerprint: fingerprint of imdb_movies taken once for all ranges (see extract_cache.py), None to
+      take one for this range
+    :return:
+      df: transformed DataFrame object of the range
+    """
+    query = movie_query(window, pushdown).window(PARTITION_KEY, key_range)
+    qry, params = query.sql()
+    conn = mysql_connector()
+    if not conn:
+        raise ConnectionError("No MySql connection for the partition extract.")
+    try:
+        read = partial(read_sql_planned, qry, conn, MOVIE_DTYPES, params=params or None)
+        if use_cache:
+            df = cached_extract(conn, qry, params, SOURCE_TABLE, read, fingerprint, plan=MOVIE_DTYPES)
+        else:
+            df = read()
+    finally:
+        conn.close()
+    return query.finish(df) if not df.empty else df
+
+
+def is_delta(window):
     """
-    Generates .csv files based on distinct vals in 'Year' column of df
+    Whether a watermark window covers only the years at/past the mark (those years are replaced) rather than
+    the whole table.
+    :param window: (low, high) watermark window or None
+    :return:
+      bool
+    """
+    return window is not None and window[0] is not None
+
+
+def staging_dirs(window=None, fmt=STAGING_FORMAT):
+    """
+    Directories the yearly files are written to, created if missing. On a delta run the delta dir is cleared
+    of the previous run's files, so only this run's rows get uploaded.
+    :param window: optional (low, high) watermark window
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :return:
+      output_dir: '../movie_data'
+      delta_dir: '../movie_data_delta' on a delta run, otherwise None
+    """
+    cur_path = os.getcwd()
+    output_dir = os.path.join(cur_path, '../movie_data')
+    os.makedirs(output_dir, exist_ok=True)  # Create the output directory if it doesn't exist
+
+    delta_dir = None
+    if is_delta(window):
+        delta_dir = os.path.join(cur_path, '../movie_data_delta')
+        os.makedirs(delta_dir, exist_ok=True)
+        for file in os.listdir(delta_dir):
+            if file.endswith(file_extension(fmt)):
+                remove_staged(os.path.join(delta_dir, file))
+    return output_dir, delta_dir
+
+
+def write_yearly(df, output_dir, delta_dir=None, fmt=STAGING_FORMAT, parallel=False):
+    """
+    Export one subset of df per 'year' value, grouped in a single pass. Every year in df is complete (a delta
+    extracts whole years, see WATERMARK_INCLUSIVE), so its yearly file is replaced. With a delta dir the years
+    are also written on their own to the delta dir.
+    :return:
+      stats: per-file stats of the yearly files, see partitioned_writer.write_partitions()
+    """
+    file_template = "movies_{}" + file_extension(fmt)
+    if delta_dir:
+        write_partitions(df, PARTITION_KEY, delta_dir, file_template, parallel=parallel,
+                         fmt=fmt, schema=MOVIE_SCHEMA)
+    return write_partitions(df, PARTITION_KEY, output_dir, file_template, parallel=parallel, fmt=fmt,
+                            schema=MOVIE_SCHEMA)
+
+
+@instrument(PIPELINE)
+def load_local(window=None, parallel=False, fmt=STAGING_FORMAT, pushdown=PUSHDOWN, df=None):
+    """
+    Generates staged files (Parquet by default) based on distinct vals in 'Year' column of df. On a delta run
+    (see is_delta()) the yearly files of the years in the window are replaced and also written on their own to
+    '../movie_data_delta', which is what load_bq() then uploads.
+    :param window: optional (low, high) watermark window passed through to extract()
+    :param parallel: if True, write the yearly files concurrently
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :param pushdown: if True, length_category is computed by MySql, otherwise in pandas
+    :param df: already extracted and transformed DataFrame (see extract_transformed()) to write
     :return:
       -n number of files with movie data segregated by year
+      -True if the export succeeded, otherwise None
     """
     try:
-        df = extract()
+        if df is None:
+            df = extract_transformed(window, pushdown)
         if df.empty:
-            raise ValueError("DataFrame is empty. Cannot export to CSV.")
+            raise ValueError("DataFrame is empty. Cannot export.")
 
-        # Apply transformation
-        df['length_category'] = df['duration'].apply(transformations)
+        output_dir, delta_dir = staging_dirs(window, fmt)
+        stats = write_yearly(df, output_dir, delta_dir, fmt, parallel)
 
-        cur_path = os.getcwd()
-        output_dir = os.path.join(cur_path, '../movie_data')
-        os.makedirs(output_dir, exist_ok=True)  # Create the output directory if it doesn't exist
-
-        # Iterate over unique 'year' values
-        for year_value in df['year'].unique():
-            # Filter DataFrame based on 'year' value
-            year_df = df[df['year'] == year_value]
-            if not year_df.empty:
-                file_name = f"movies_{year_value}.csv"
-                file_path = os.path.join(output_dir, file_name)
-
-                # Export subset of DataFrame to CSV
-                year_df.to_csv(file_path, index=False)
-                print(f"Subset of DataFrame for year {year_value} successfully exported to: {file_path}")
-            else:
-                print(f"No data for year {year_value}. Skipping export.")
+        for part in stats:
+            print(f"Subset of DataFrame for year {part['partition']} successfully exported to: {part['file_path']} "
+                  f"({part['rows']} rows, {part['bytes']} bytes)")
+        record_io(rows_out=sum(part['rows'] for part in stats), bytes_out=sum(part['bytes'] for part in stats))
+
+        return True
 
     except FileNotFoundError:
         print("Error: Specified file path does not exist.")
@@ -150,53 +381,216 @@ def load_local():
         print(f"An error occurred: {str(e)}")
 
 
-def load_bq(csv_dir):
+@instrument(PIPELINE)
+def load_local_partitioned(window=None, n_partitions=EXTRACT_PARTITIONS, max_workers=MAX_EXTRACT_WORKERS,
+                           fmt=STAGING_FORMAT, pushdown=PUSHDOWN, use_cache=USE_EXTRACT_CACHE):
     """
-    Generates distinct tables in specified BigQuery dataset for .csv files in given location
-    :param csv_dir: local location of .csv files
+    Partitioned counterpart of load_local(): the source is split into PARTITION_KEY ranges (partition_ranges())
+    that are extracted concurrently over pooled connections, and each range is transformed and written to its
+    yearly files as soon as it arrives. Extraction, transformation and writing of different ranges overlap,
+    and only the ranges in flight are held in memory. Ranges are disjoint, so each yearly file is written by a
+    single worker. Same files as load_local().
+    :param window: optional (low, high) watermark window
+    :param n_partitions: number of ranges to split the source into
+    :param max_workers: max number of ranges extracted at the same time, at most the connection pool size
+    :param fmt: staging format, see staging.FILE_EXTENSIONS
+    :param pushdown: if True, length_category is computed by MySql, otherwise in pandas
+    :param use_cache: if True, reuse cached ranges while imdb_movies is unchanged
     :return:
-      - generates n number of tables in BigQuery dataset based on .csv files in local
+      True if the export succeeded, otherwise None
     """
-    client = bq_connector()
+    try:
+        conn = mysql_connector()
+        if not conn:
+            raise ConnectionError("No MySql connection.")
+        try:
+            ranges = partition_ranges(conn, window, n_partitions)
+            # One fingerprint for every range, rather than a CHECKSUM TABLE scan per range
+            fingerprint = try_fingerprint(conn, SOURCE_TABLE) if use_cache else None
+            use_cache = use_cache and fingerprint is not None
+        finally:
+            conn.close()  # back to the pool before the workers check theirs out
+        if not ranges:
+            raise ValueError("DataFrame is empty. Cannot export.")
+
+        output_dir, delta_dir = staging_dirs(window, fmt)
+
+        def extract_write(key_range):
+            df = extract_partition(key_range, window, pushdown, use_cache, fingerprint)
+            return len(df), write_yearly(df, output_dir, delta_dir, fmt) if not df.empty else []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, POOL_SIZE, len(ranges))) as executor:
+            results = list(executor.map(extract_write, ranges))
+
+        stats = sorted((part for _, parts in results for part in parts), key=lambda part: part['partition'])
+        for part in stats:
+            print(f"Subset of DataFrame for year {part['partition']} successfully exported to: {part['file_path']} "
+                  f"({part['rows']} rows, {part['bytes']} bytes)")
+        record_io(rows_in=sum(rows for rows, _ in results), rows_out=sum(part['rows'] for part in stats),
+                  bytes_out=sum(part['bytes'] for part in stats))
+        return True
+
+    except mysql.connector.Error as e:
+        print(f"MySQL Error: {e}")
+    except FileNotFoundError:
+        print("Error: Specified file path does not exist.")
+    except PermissionError:
+        print("Error: Permission denied while writing to file.")
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+
+
+def load_file_bq(client, file_path, trg_dataset, job_config):
+    """
+    Uploads a single staged file to a BigQuery table and waits for the load job to finish. Arrow IPC files
+    are sent as Parquet (see staging.open_upload()).
+    :param client: BigQuery client object
+    :param file_path: local staged file
+    :param trg_dataset: fully qualified destination table id
+    :param job_config: LoadJobConfig for the job
+    :return:
+      num_rows: row count of the destination table after the load
+    """
+    with open_upload(file_path) as source_file:
+        load_job = client.load_table_from_file(
+            source_file,
+            trg_dataset,
+            job_config=job_config
+        )
+
+    load_job.result()
+
+    # Data load check
+    return client.get_table(trg_dataset).num_rows
+
+
+@instrument(PIPELINE)
+def load_bq(staging_dir, write_disposition='WRITE_EMPTY', client=None, max_in_flight=MAX_IN_FLIGHT_LOADS,
+            fmt=STAGING_FORMAT):
+    """
+    Generates distinct tables in specified BigQuery dataset for staged files in given location. Load jobs run
+    concurrently, at most max_in_flight at a time, and a failed table does not stop the others.
+    :param staging_dir: local location of staged files
+    :param write_disposition: BigQuery write disposition; load_bq_window() uses 'WRITE_TRUNCATE' (whole years)
+    :param client: BigQuery client object, defaults to bq_connector()
+    :param max_in_flight: max number of concurrent load jobs
+    :param fmt: staging format of the files to upload, see staging.FILE_EXTENSIONS
+    :return:
+      - generates n number of tables in BigQuery dataset based on staged files in local
+      - True if every file was loaded, otherwise None
+    """
+    client = client or bq_connector()
     dataset_id = 'etl-project-419123.movie_data'
 
-    job_config = bq.LoadJobConfig(
-        skip_leading_rows=1,
-        source_format=bq.SourceFormat.CSV,
-        autodetect=True,
-        write_disposition='WRITE_EMPTY'
-    )
+    job_config = bq_load_config(fmt, write_disposition)
 
-    # Get the current working directory and join it with the relative path to csv_directory
+    # Get the current working directory and join it with the relative path to staging_dir
     cwd = os.getcwd()
-    csv_abs_directory = os.path.join(cwd, csv_dir)
+    staging_abs_directory = os.path.join(cwd, staging_dir)
+
+    loaded = {}
+    failed = {}
+    bytes_in = 0
+
+    # Submit a load for each staged file in the directory, then wait on them together
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {}
+        for file in sorted(os.listdir(staging_abs_directory)):
+            if file.endswith(file_extension(fmt)):
+                file_path = os.path.join(staging_abs_directory, file)
+
+                # Extract table name from file name
+                table_name = os.path.splitext(file)[0]
+
+                trg_dataset = f'{dataset_id}.{table_name}'
+                bytes_in += staged_size(file_path)
+                futures[executor.submit(load_file_bq, client, file_path, trg_dataset, job_config)] = trg_dataset
+
+        for future in as_completed(futures):
+            trg_dataset = futures[future]
+            try:
+                loaded[trg_dataset] = future.result()
+            except (GoogleAPIError, OSError) as error:
+                failed[trg_dataset] = error
+
+    # Load summary
+    for trg_dataset, num_rows in sorted(loaded.items()):
+        print(f"{num_rows} loaded to {trg_dataset}.")
+    for trg_dataset, error in sorted(failed.items()):
+        print(f"Load to {trg_dataset} failed: {error}")
+    print(f"{len(loaded)} tables loaded ({sum(loaded.values())} rows), {len(failed)} failed.")
+    record_io(bytes_in=bytes_in, rows_out=sum(loaded.values()))
+
+    if not failed:
+        return True
+
+
+def delta_window():
+    """
+    Compare the committed watermark against the source table to find the rows this run should load.
+    :return:
+      window: (low, high) watermark window, or None if there is nothing new to load
+    """
+    conn = mysql_connector()
+    if not conn:
+        return None
+    try:
+        return incremental_window(conn, PIPELINE, SOURCE_TABLE, WATERMARK_COLUMN, WATERMARK_INCLUSIVE)
+    except mysql.connector.Error as e:
+        print(f"MySQL Error: {e}")
+    finally:
+        conn.close()
 
-    # Iterate over each CSV file in the directory
-    for file in os.listdir(csv_abs_directory):
-        if file.endswith(".csv"):
-            file_path = os.path.join(csv_abs_directory, file)
 
-            # Extract table name from file name
-            table_name = os.path.splitext(file)[0]
+def load_bq_window(window):
+    """
+    Upload what load_local() staged for a window: the delta dir on a delta run, every yearly file otherwise.
+    Either way the files hold whole years, so their tables are replaced (WRITE_TRUNCATE), not appended to; a
+    full reload also overwrites the tables a previous run created.
+    :param window: (low, high) watermark window that was staged
+    :return:
+      True if every file was loaded, otherwise None
+    """
+    # Same dirs staging_dirs() writes to
+    if is_delta(window):
+        return load_bq('../movie_data_delta', write_disposition='WRITE_TRUNCATE')
+    return load_bq('../movie_data', write_disposition='WRITE_TRUNCATE')
 
-            trg_dataset = f'{dataset_id}.{table_name}'
 
-            with open(file_path, 'rb') as source_file:
-                load_job = client.load_table_from_file(
-                    source_file,
-                    trg_dataset,
-                    job_config=job_config
-                )
+def commit_watermark(window, *loaded):
+    """
+    Advance the mark to the end of the window once BigQuery has the rows.
+    :param window: (low, high) watermark window that was loaded
+    :param loaded: results of the load stages, only there to order this after them
+    :return:
+      True
+    """
+    write_watermark(PIPELINE, window[1])
+    return True
 
-            load_job.result()
 
-            # Data load check
-            destination_tbl = client.get_table(trg_dataset)
-            print(f"{destination_tbl.num_rows} loaded from {file} to {destination_tbl}.")
+def tasks():
+    """
+    Stages of this pipeline as a DAG for runner.py.
+    :return:
+      list of runner.Task objects
+    """
+    return [
+        Task('delta_window', delta_window),
+        Task('load_local', load_local_partitioned, deps=['delta_window']),
+        Task('load_bq', load_bq_window, deps=['delta_window', 'load_local']),
+        Task('commit_watermark', commit_watermark, deps=['delta_window', 'load_bq']),
+    ]
 
 
 if __name__ == '__main__':
-    load_local()
-
-    csv_directory = 'movie_data'
-    load_bq(csv_directory)
+    window = delta_window()
+    if window is None:
+        print("No new rows since last run. Nothing to load.")
+    # Only advance the mark once BigQuery has the delta, so a failed run is retried in full
+    # Source split into year ranges, extracted and written concurrently
+    elif load_local_partitioned(window) and load_bq_window(window):
+        write_watermark(PIPELINE, window[1])
+
+    # Per-stage timings, memory and row counts of this run
+    emit_report()
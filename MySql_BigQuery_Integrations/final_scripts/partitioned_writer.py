@@ -0,0 +1,41 @@
+# modules
+import os
+from concurrent.futures import ThreadPoolExecutor
+from staging import STAGING_FORMAT, write_staged
+
+
+def write_partitions(df, key, output_dir, file_template, append=False, parallel=False, max_workers=None,
+                     fmt=STAGING_FORMAT, schema=None):
+    """
+    Split df on the distinct vals of 'key' and write each partition to its own staged file. The frame is
+    grouped once, so every partition comes out of a single pass instead of one boolean mask per value.
+    :param df: DataFrame object to partition
+    :param key: column name (or list of column names) to partition on
+    :param output_dir: directory the partition files are written to, created if missing
+    :param file_template: file name w/ a '{}' placeholder for the partition value, e.g. 'movies_{}.parquet'
+    :param append: if True, add rows to existing partition files instead of replacing them
+    :param parallel: if True, write partitions concurrently in a thread pool
+    :param max_workers: thread pool size when parallel, defaults to ThreadPoolExecutor's default
+    :param fmt: staging format of the partition files, see staging.FILE_EXTENSIONS
+    :param schema: optional pyarrow schema every partition is cast to
+    :return:
+      stats: list of dicts w/ 'partition', 'file_path', 'rows' and 'bytes' per partition written
+    """
+    os.makedirs(output_dir, exist_ok=True)  # Create the output directory if it doesn't exist
+
+    def partition_name(value):
+        # Multi-column keys come back as tuples -> 'a_b'
+        return '_'.join(map(str, value)) if isinstance(value, tuple) else str(value)
+
+    # sort=False keeps first-seen order; observed=True skips empty categorical groups
+    groups = [(value, part_df, os.path.join(output_dir, file_template.format(partition_name(value))))
+              for value, part_df in df.groupby(key, sort=False, observed=True)]
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda g: write_staged(g[1], g[2], fmt, schema, append), groups))
+    else:
+        results = [write_staged(part_df, file_path, fmt, schema, append) for _, part_df, file_path in groups]
+
+    return [{'partition': value, 'file_path': file_path, 'rows': rows, 'bytes': n_bytes}
+            for (value, _, file_path), (rows, n_bytes) in zip(groups, results)]
@@ -0,0 +1,269 @@
+# modules
+import numbers
+import numpy as np
+import pandas as pd
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+
+def quote(name):
+    """
+    Quote a MySql identifier (table or column name), e.g. the 'State-City' columns of city_house_prices.
+    :param name: identifier
+    :return:
+      quoted: identifier w/ backticks
+    """
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+def table_columns(conn, table):
+    """
+    Column names of a table, read from an empty result set instead of information_schema.
+    :param conn: open MySql connection object
+    :param table: table name
+    :return:
+      columns: list of column names, in table order
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {quote(table)} LIMIT 0")
+    columns = [col[0] for col in cursor.description]
+    cursor.fetchall()
+    cursor.close()
+    return columns
+
+
+def bucketize(values, thresholds, labels, default, closed='left', name=None):
+    """
+    Bin numeric vals into labelled buckets in one pass. pandas counterpart of Query.bucket()'s CASE expression.
+    :param values: Series of num vals, non-numeric vals are treated as missing
+    :param thresholds: ascending bucket bounds
+    :param labels: label for each bucket
+    :param default: label for vals past the last threshold or missing
+    :param closed: 'left' -> bucket i holds vals < thresholds[i], 'right' -> vals <= thresholds[i]
+    :param name: name of the returned Series
+    :return:
+      - categorical Series of labels, aligned w/ values
+    """
+    if len(thresholds) != len(labels):
+        raise ValueError("Need exactly one label per threshold.")
+    if closed not in ('left', 'right'):
+        raise ValueError("closed must be 'left' or 'right'.")
+
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    # Index of the first threshold above (closed='left') or at/above (closed='right') each value;
+    # NaN sorts past the end and so gets the default
+    side = 'right' if closed == 'left' else 'left'
+    codes = np.searchsorted(np.asarray(thresholds, dtype='float64'), numeric, side=side)
+
+    categories = list(dict.fromkeys([*labels, default]))
+    lookup = np.array([categories.index(label) for label in [*labels, default]])
+
+    return pd.Series(pd.Categorical.from_codes(lookup[codes], categories=categories),
+                     index=values.index, name=name)
+
+
+def unpivot_frame(df, id_column, value_columns, names_to, values_to, sep='-'):
+    """
+    Generic pandas fallback for Query.unpivot(): wide -> long w/ melt, splitting the column headers into
+    the names_to columns. Empty cells are dropped, rows come out in id order.
+    :return:
+      df: long DataFrame object
+    """
+    value_columns = value_columns or [col for col in df.columns if col != id_column]
+    long = df.melt(id_vars=id_column, value_vars=value_columns, var_name='_name', value_name=values_to)
+    long = long.dropna(subset=[values_to]).sort_values(id_column, kind='stable')
+    names = long.pop('_name').str.split(sep, n=len(names_to) - 1, expand=True)
+    for i, name in enumerate(names_to):
+        long.insert(1 + i, name, names[i].astype('category'))
+    return long.reset_index(drop=True)
+
+
+class Query:
+    """
+    Builds the SELECT statement of an extract. Projection, filters, bucketing and unpivoting are pushed down
+    into MySql, so only the rows and columns the pipeline needs cross the wire and the work runs next to the
+    data. A step that can't be expressed in SQL (or is built w/ pushdown=False) is run in pandas by finish()
+    on the query results instead, so the pipeline gets the same frame either way.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.columns = []  # (sql, alias, params)
+        self.conditions = []  # (sql, params)
+        self.buckets = []
+        self.unpivot_spec = None
+
+    def select(self, *columns):
+        """
+        Add plain columns to the projection. Without any, every column of the table is selected.
+        :return: self
+        """
+        for column in columns:
+            self.columns.append((quote(column), column, ()))
+        return self
+
+    def select_expr(self, expr, alias, params=()):
+        """
+        Add a raw SQL expression to the projection.
+        :param expr: SQL expression, w/ %s placeholders for params
+        :param alias: output column name
+        :param params: tuple of query parameters used by expr
+        :return: self
+        """
+        self.columns.append((expr, alias, tuple(params)))
+        return self
+
+    def where(self, column, op, value):
+        """
+        Add a filter, ANDed w/ the others. The value is passed as a query parameter.
+        :return: self
+        """
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}. Use one of {OPERATORS}.")
+        self.conditions.append((f"{quote(column)} {op} %s", (value,)))
+        return self
+
+    def window(self, column, window, inclusive=False):
+        """
+        Restrict the query to an incremental watermark window, same bounds as watermark.window_clause():
+        low exclusive (inclusive w/ inclusive=True), high inclusive. A None window adds no filter.
+        :return: self
+        """
+        if window is not None:
+            low, high = window
+            if low is not None:
+                self.where(column, '>=' if inclusive else '>', low)
+            self.where(column, '<=', high)
+        return self
+
+    def bucket(self, column, thresholds, labels, default, alias, closed='left', pushdown=True):
+        """
+        Add a derived column binning 'column' into labelled buckets, see bucketize(). Pushed down as a CASE
+        expression; run in pandas when pushdown=False, the bounds aren't numbers or the query unpivots in SQL.
+        :return: self
+        """
+        if len(thresholds) != len(labels):
+            raise ValueError("Need exactly one label per threshold.")
+        if closed not in ('left', 'right'):
+            raise ValueError("closed must be 'left' or 'right'.")
+        numeric = all(isinstance(t, numbers.Real) for t in thresholds)
+        self.buckets.append({'column': column, 'thresholds': list(thresholds), 'labels': list(labels),
+                             'default': default, 'alias': alias, 'closed': closed,
+                             'pushdown': pushdown and numeric})
+        return self
+
+    def unpivot(self, id_column, value_columns, names_to, values_to, sep='-', pushdown=True, fallback=None):
+        """
+        Turn the wide table into long rows: one row per id and non-empty value column, w/ the column header
+        split on 'sep' into the names_to columns. Pushed down as a UNION ALL of one SELECT per value column.
+        :param id_column: column kept on every row, e.g. 'Date'
+        :param value_columns: columns to unpivot, None for every column but id_column
+        :param names_to: list of columns the header parts go to, e.g. ['State', 'City']
+        :param values_to: column the cell vals go to
+        :param sep: separator of the header parts
+        :param pushdown: if False, select the wide columns and unpivot in pandas
+        :param fallback: optional func(df) -> long df used instead of unpivot_frame() when not pushed down
+        :return: self
+        """
+        self.unpivot_spec = {'id_column': id_column, 'value_columns': value_columns, 'names_to': list(names_to),
+                             'values_to': values_to, 'sep': sep, 'pushdown': pushdown, 'fallback': fallback}
+        return self
+
+    def _pushed_unpivot(self):
+        return self.unpivot_spec is not None and self.unpivot_spec['pushdown']
+
+    def _case(self, spec):
+        op = '<' if spec['closed'] == 'left' else '<='
+        whens = " ".join(f"WHEN {quote(spec['column'])} {op} {float(t)!r} THEN %s" for t in spec['thresholds'])
+        return f"CASE {whens} ELSE %s END", (*spec['labels'], spec['default'])
+
+    def _where(self, extra=()):
+        conditions = self.conditions + list(extra)
+        if not conditions:
+            return "", ()
+        return "WHERE " + " AND ".join(sql for sql, _ in conditions), tuple(p for _, params in conditions for p in params)
+
+    def sql(self, conn=None):
+        """
+        Render the query.
+        :param conn: open MySql connection, only needed to list the table's columns for a pushed down
+          unpivot w/o explicit value_columns
+        :return:
+          qry: SQL text w/ %s placeholders
+          params: tuple of query parameters
+        """
+        if self._pushed_unpivot():
+            return self._unpivot_sql(conn)
+
+        select, params = [], []
+        for expr, alias, expr_params in self.columns:
+            select.append(expr if expr == quote(alias) else f"{expr} AS {quote(alias)}")
+            params.extend(expr_params)
+        if self.unpivot_spec is not None and self.unpivot_spec['value_columns'] and not self.columns:
+            spec = self.unpivot_spec
+            select = [quote(col) for col in [spec['id_column'], *spec['value_columns']]]
+        for spec in self.buckets:
+            if spec['pushdown']:
+                case, case_params = self._case(spec)
+                select.append(f"{case} AS {quote(spec['alias'])}")
+                params.extend(case_params)
+
+        where, where_params = self._where()
+        qry = f"SELECT {', '.join(select) or '*'} FROM {quote(self.table)} {where}".strip()
+        return qry, tuple(params) + where_params
+
+    def _unpivot_sql(self, conn):
+        spec = self.unpivot_spec
+        id_column, names_to, values_to = spec['id_column'], spec['names_to'], spec['values_to']
+        value_columns = spec['value_columns']
+        if value_columns is None:
+            if conn is None:
+                raise ValueError("A connection is needed to list the columns to unpivot.")
+            value_columns = [col for col in table_columns(conn, self.table) if col != id_column]
+
+        branches, params = [], []
+        for ordinal, column in enumerate(value_columns):
+            parts = str(column).split(spec['sep'], len(names_to) - 1)
+            if len(parts) != len(names_to):
+                raise ValueError(f"Column {column} doesn't split into {len(names_to)} parts on '{spec['sep']}'.")
+            names = ", ".join(f"%s AS {quote(name)}" for name in names_to)
+            where, where_params = self._where([(f"{quote(column)} IS NOT NULL", ())])
+            branches.append(f"SELECT {quote(id_column)}, {names}, {quote(column)} AS {quote(values_to)}, "
+                            f"{ordinal} AS _ord FROM {quote(self.table)} {where}")
+            params.extend([*parts, *where_params])
+
+        # _ord keeps each id's values in column order, like df.stack()
+        output = ", ".join(quote(col) for col in [id_column, *names_to, values_to])
+        qry = (f"SELECT {output} FROM ({' UNION ALL '.join(branches)}) AS u "
+               f"ORDER BY {quote(id_column)}, _ord")
+        return qry, tuple(params)
+
+    def finish(self, df):
+        """
+        Apply the steps that weren't pushed down to the query results and align dtypes w/ the pandas path,
+        so pushed down and fallback results look the same.
+        :param df: DataFrame object of the query results
+        :return:
+          df: DataFrame object
+        """
+        spec = self.unpivot_spec
+        if spec is not None:
+            if spec['pushdown']:
+                for name in spec['names_to']:
+                    df[name] = df[name].astype('category')
+                df[spec['values_to']] = pd.to_numeric(df[spec['values_to']], errors='coerce')
+            elif spec['fallback'] is not None:
+                df = spec['fallback'](df)
+            else:
+                df = unpivot_frame(df, spec['id_column'], spec['value_columns'], spec['names_to'],
+                                   spec['values_to'], spec['sep'])
+
+        for bucket in self.buckets:
+            if bucket['pushdown'] and not self._pushed_unpivot():
+                categories = list(dict.fromkeys([*bucket['labels'], bucket['default']]))
+                df[bucket['alias']] = pd.Categorical(df[bucket['alias']], categories=categories)
+            else:
+                df[bucket['alias']] = bucketize(df[bucket['column']], bucket['thresholds'], bucket['labels'],
+                                                bucket['default'], bucket['closed'])
+        return df
@@ -0,0 +1,172 @@
+# modules
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from instrumentation import clear_records, emit_report
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pipelines run by default, w/ the working dir each one expects (relative to final_scripts), as each script
+# resolves creds.txt and its output dirs against the working dir
+PIPELINES = {
+    'house_price_data': '..',
+    'movie_data': '.',
+}
+
+# Max number of stages of one pipeline running at the same time (independent stages run side by side)
+MAX_STAGE_WORKERS = 4
+
+
+class Task:
+    """
+    One stage of a pipeline DAG. func is called w/ the results of the tasks named in deps, in that order,
+    once all of them have finished. A task whose func returns None counts as failed (or, for the watermark
+    window, as nothing to do) and the tasks depending on it are skipped.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+
+
+def run_tasks(pipeline, tasks, max_workers=MAX_STAGE_WORKERS):
+    """
+    Run a pipeline DAG in this process. Every task runs exactly once, as soon as its deps are done, and its
+    result is handed to every dependent task, so a shared upstream result (e.g. the transformed frame used by
+    both load stages) is computed once. Independent tasks run concurrently in threads.
+    :param pipeline: pipeline name, for the records
+    :param tasks: list of Task objects
+    :param max_workers: max number of tasks running at the same time
+    :return:
+      records: list of dicts w/ 'pipeline', 'task', 'deps', 'status', 'start', 'end' and 'duration_s' per task
+    """
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        missing = [dep for dep in task.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Task {task.name} of {pipeline} depends on unknown tasks: {missing}")
+
+    results = {}
+    records = {}
+    running = {}
+
+    def timed(task, args):
+        start = time.time()
+        try:
+            result = task.func(*args)
+            status = 'ok' if result is not None else 'failed'
+        except Exception as e:
+            print(f"{pipeline}.{task.name} raised: {e}")
+            result, status = None, 'error'
+        return result, status, start, time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(records) < len(tasks):
+            for task in tasks:
+                if task.name in records or task.name in running.values():
+                    continue
+                if not all(dep in records for dep in task.deps):
+                    continue
+                if any(results.get(dep) is None for dep in task.deps):
+                    now = time.time()
+                    results[task.name] = None
+                    records[task.name] = {'pipeline': pipeline, 'task': task.name, 'deps': task.deps,
+                                          'status': 'skipped', 'start': now, 'end': now, 'duration_s': 0.0}
+                    continue
+                future = executor.submit(timed, task, [results[dep] for dep in task.deps])
+                running[future] = task.name
+
+            if not running:
+                if len(records) < len(tasks):
+                    raise ValueError(f"Dependency cycle in {pipeline}: "
+                                     f"{[task.name for task in tasks if task.name not in records]}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, status, start, end = future.result()
+                results[name] = result
+                records[name] = {'pipeline': pipeline, 'task': name, 'deps': by_name[name].deps, 'status': status,
+                                 'start': start, 'end': end, 'duration_s': round(end - start, 4)}
+
+    return [records[task.name] for task in tasks]
+
+
+def run_pipeline(pipeline, workdir='.'):
+    """
+    Import a pipeline module and run its tasks() DAG. Runs in a worker process of run_all().
+    :param pipeline: module name in final_scripts, e.g. 'movie_data'
+    :param workdir: working dir the pipeline expects, relative to final_scripts
+    :return:
+      records: task records, see run_tasks()
+    """
+    os.chdir(os.path.join(SCRIPT_DIR, workdir))
+    module = importlib.import_module(pipeline)
+    records = run_tasks(pipeline, module.tasks())
+
+    # Per-stage metrics of this pipeline; cleared so a reused worker process doesn't report them twice
+    emit_report()
+    clear_records()
+    return records
+
+
+def critical_path(records):
+    """
+    Longest chain of dependent tasks, by duration: the shortest wall time the DAG can finish in, however
+    many workers there are.
+    :param records: task records of one or more pipelines
+    :return:
+      path: list of (pipeline, task) on the critical path
+      seconds: summed duration of the path
+    """
+    by_key = {(r['pipeline'], r['task']): r for r in records}
+    finish = {}
+
+    def longest(key):
+        if key not in finish:
+            record = by_key[key]
+            best = max((longest((key[0], dep)) for dep in record['deps']), default=(0.0, []))
+            finish[key] = (best[0] + record['duration_s'], best[1] + [key])
+        return finish[key]
+
+    seconds, path = max((longest(key) for key in by_key), default=(0.0, []))
+    return path, round(seconds, 4)
+
+
+def run_all(pipelines=None, max_workers=None):
+    """
+    Run independent pipelines in parallel, one process each, and print a summary.
+    :param pipelines: dict of pipeline -> working dir, defaults to PIPELINES
+    :param max_workers: process pool size, defaults to one process per pipeline
+    :return:
+      records: task records of every pipeline
+    """
+    pipelines = pipelines or PIPELINES
+    start = time.time()
+    records = []
+    with ProcessPoolExecutor(max_workers=max_workers or len(pipelines)) as executor:
+        futures = {executor.submit(run_pipeline, name, workdir): name for name, workdir in pipelines.items()}
+        for future, name in futures.items():
+            try:
+                records.extend(future.result())
+            except Exception as e:
+                print(f"Pipeline {name} failed: {e}")
+    wall_s = time.time() - start
+
+    # Run summary
+    for r in records:
+        print(f"{r['pipeline']}.{r['task']}: {r['status']} ({r['duration_s']} s)")
+    path, path_s = critical_path(records)
+    print(f"wall time: {wall_s:.2f} s, summed task time: {sum(r['duration_s'] for r in records):.2f} s")
+    print(f"critical path: {path_s} s ({' -> '.join(f'{p}.{t}' for p, t in path)})")
+    return records
+
+
+if __name__ == '__main__':
+    # Optional pipeline names on the command line, e.g. python runner.py movie_data
+    selected = {name: PIPELINES[name] for name in sys.argv[1:]} if len(sys.argv) > 1 else None
+    run_all(selected)
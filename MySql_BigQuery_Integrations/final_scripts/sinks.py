@@ -0,0 +1,206 @@
+# modules
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from google.cloud import bigquery as bq
+import pandas as pd
+from staging import STAGING_FORMAT, StagedWriter, bq_load_config, upload_format
+
+
+def param_type(value):
+    """
+    BigQuery type of a query parameter value.
+    :param value: date/datetime, int, float or str
+    :return:
+      type: e.g. 'DATE'
+    """
+    if isinstance(value, datetime):
+        return 'DATETIME'
+    if isinstance(value, date):
+        return 'DATE'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    return 'STRING'
+
+
+class LocalSink:
+    """
+    Staged dataset on local disk (Parquet by default), written batch by batch w/ a StagedWriter. An appended
+    part w/ a key replaces the part(s) written w/ the same key before, see StagedWriter.
+    """
+
+    def __init__(self, file_path, fmt=STAGING_FORMAT, schema=None, append=False, name='local', key=None):
+        self.name = name
+        self.file_path = file_path
+        self._writer = StagedWriter(file_path, fmt, schema, append, key)
+
+    def write(self, df):
+        """
+        Write one batch.
+        :param df: DataFrame object
+        :return: None
+        """
+        self._writer.write(df)
+
+    def close(self):
+        """
+        Finalize the part and add it to the dataset.
+        :return:
+          stats: dict w/ the 'rows' and 'bytes' this sink added
+        """
+        if self._writer.rows == 0:
+            self._writer.abort()
+            raise ValueError("DataFrame is empty. Cannot export.")
+        self._writer.close()
+        return {'rows': self._writer.rows, 'bytes': self._writer.bytes}
+
+    def abort(self):
+        """
+        Drop the part after a failed write. The dataset keeps the data it had.
+        :return: None
+        """
+        self._writer.abort()
+
+
+class BigQuerySink:
+    """
+    BigQuery table. Batches are staged to a temp file on disk as they come in (so a streamed load doesn't
+    hold the whole upload in memory), which is sent in one load job on close(). Staged as Parquet when fmt
+    is 'arrow', see staging.upload_format(). With replace_after=(column, value), the rows past value in
+    column are deleted before the load, so appending a delta that was (partly) loaded before doesn't add its
+    rows twice.
+    """
+
+    def __init__(self, client, table_id, fmt=STAGING_FORMAT, schema=None, write_disposition='WRITE_TRUNCATE',
+                 name='bigquery', replace_after=None):
+        self.name = name
+        self.client = client
+        self.table_id = table_id
+        self.fmt = upload_format(fmt)
+        self.write_disposition = write_disposition
+        self.replace_after = replace_after
+        self._file = tempfile.TemporaryFile()
+        self._writer = StagedWriter(self._file, self.fmt, schema)
+
+    def write(self, df):
+        """
+        Stage one batch.
+        :param df: DataFrame object
+        :return: None
+        """
+        self._writer.write(df)
+
+    def close(self):
+        """
+        Run the load job w/ everything staged so far.
+        :return:
+          stats: dict w/ the 'rows' and 'bytes' uploaded
+        """
+        try:
+            self._writer.close()
+            if self._writer.rows == 0:
+                raise ValueError("DataFrame is empty. Cannot load.")
+
+            if self.replace_after is not None:
+                self.delete_after(*self.replace_after)
+
+            n_bytes = self._file.tell()
+            self._file.seek(0)
+            job = self.client.load_table_from_file(
+                self._file,
+                self.table_id,
+                job_config=bq_load_config(self.fmt, self.write_disposition)
+            )
+            job.result()
+
+            # Data load check
+            destination_tbl = self.client.get_table(self.table_id)
+            print(f"{destination_tbl.num_rows} loaded to {destination_tbl}.")
+            return {'rows': self._writer.rows, 'bytes': n_bytes}
+        finally:
+            self._file.close()
+
+    def delete_after(self, column, value):
+        """
+        Delete the rows of the table w/ column past value.
+        :param column: column name
+        :param value: date, int, float or str the rows are compared to
+        :return: None
+        """
+        job_config = bq.QueryJobConfig(query_parameters=[bq.ScalarQueryParameter('value', param_type(value), value)])
+        self.client.query(f"DELETE FROM `{self.table_id}` WHERE `{column}` > @value", job_config=job_config).result()
+
+    def abort(self):
+        """
+        Drop the staged data after a failed write, nothing is loaded.
+        :return: None
+        """
+        try:
+            self._writer.abort()
+        finally:
+            self._file.close()
+
+
+def fan_out(frames, sinks, parallel=False):
+    """
+    Write the same data to several sinks in one pass: each batch is handed to every sink before the next
+    one is pulled, so the extract and transformations run once however many sinks there are. A sink that
+    fails is dropped (and aborted), the others carry on and commit: the run is then partial, the sinks are out
+    of sync until it is retried, and the caller has to treat a None in results as a failed run (and write
+    idempotently, so the retry doesn't load the data twice in the sinks that succeeded). If frames itself
+    raises (e.g. a streamed extract failing part way), every sink is aborted and the error is raised: nothing
+    is loaded, truncated or replaced w/ the partial data.
+    :param frames: DataFrame object, or an iterable of DataFrame batches (e.g. a streamed extract)
+    :param sinks: list of sink objects w/ a unique 'name' and write(df) / close() / abort() methods,
+      e.g. LocalSink, BigQuerySink
+    :param parallel: if True, write each batch to the sinks concurrently in a thread pool, and close them
+      concurrently (e.g. the BigQuery upload next to finalizing the local file)
+    :return:
+      results: dict of sink name -> stats returned by its close(), None if the sink failed
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    errors = {}
+
+    def call(method, sink, *args):
+        try:
+            return getattr(sink, method)(*args)
+        except Exception as e:
+            errors[sink.name] = e
+            print(f"Sink {sink.name} failed: {e}")
+
+    executor = ThreadPoolExecutor(max_workers=len(sinks)) if parallel and len(sinks) > 1 else None
+    try:
+        try:
+            for df in frames:
+                active = [sink for sink in sinks if sink.name not in errors]
+                if not active:
+                    break
+                if executor:
+                    list(executor.map(lambda sink: call('write', sink, df), active))
+                else:
+                    for sink in active:
+                        call('write', sink, df)
+        except BaseException:
+            for sink in sinks:
+                call('abort', sink)
+            raise
+
+        for sink in sinks:
+            if sink.name in errors:
+                call('abort', sink)
+
+        active = [sink for sink in sinks if sink.name not in errors]
+        if executor:
+            stats = list(executor.map(lambda sink: call('close', sink), active))
+        else:
+            stats = [call('close', sink) for sink in active]
+    finally:
+        if executor:
+            executor.shutdown()
+
+    results = {sink.name: None for sink in sinks}
+    results.update({sink.name: result for sink, result in zip(active, stats) if sink.name not in errors})
+    return results
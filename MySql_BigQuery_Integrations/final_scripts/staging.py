@@ -0,0 +1,382 @@
+# modules
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from google.cloud import bigquery as bq
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Format of the files handed between the local and BigQuery load stages. Parquet keeps column types
+# (no text round trip, no type re-inference on upload); 'csv' restores the original behaviour. 'arrow' stages
+# uncompressed Arrow IPC (Feather v2) files, opt-in only: open_staged() memory-maps them, but no pipeline stage
+# reads the staged files back, and BigQuery can't load Arrow IPC, so uploads convert them to Parquet. Within the
+# pipelines they only cost bigger files and that conversion; they pay off for tools reading the staged data
+# w/ open_staged() (e.g. test_scripts/staged_reload_benchmark.py).
+STAGING_FORMAT = 'parquet'
+
+FILE_EXTENSIONS = {
+    'parquet': '.parquet',
+    'csv': '.csv',
+    'arrow': '.arrow',
+}
+
+
+def file_extension(fmt=STAGING_FORMAT):
+    """
+    File extension used for a staging format.
+    :param fmt: staging format, one of FILE_EXTENSIONS
+    :return:
+      ext: e.g. '.parquet'
+    """
+    try:
+        return FILE_EXTENSIONS[fmt]
+    except KeyError:
+        raise ValueError(f"Unsupported staging format: {fmt}. Use one of {sorted(FILE_EXTENSIONS)}.")
+
+
+def format_of(file_path):
+    """
+    Staging format of a file, from its extension.
+    :param file_path: staged file
+    :return:
+      fmt: one of FILE_EXTENSIONS, 'csv' for unknown extensions
+    """
+    for fmt, ext in FILE_EXTENSIONS.items():
+        if str(file_path).endswith(ext):
+            return fmt
+    return 'csv'
+
+
+def upload_format(fmt=STAGING_FORMAT):
+    """
+    Format staged data is sent to BigQuery in: the staging format itself, or Parquet for Arrow IPC.
+    :param fmt: staging format, one of FILE_EXTENSIONS
+    :return:
+      fmt: 'parquet' or 'csv'
+    """
+    return 'parquet' if file_extension(fmt) == '.arrow' else fmt
+
+
+def to_arrow(df, schema=None):
+    """
+    Convert a DataFrame to an Arrow table, casting to an explicit schema when one is given.
+    :param df: DataFrame object
+    :param schema: optional pyarrow schema; its column order wins over df's
+    :return:
+      table: pyarrow Table
+    """
+    if schema is not None:
+        df = df[schema.names]
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def part_suffix(key=None):
+    """
+    Part name suffix of a keyed part (see StagedWriter), e.g. 'key-2020_01_05' for '2020-01-05'.
+    :param key: part key, None for an unkeyed part
+    :return:
+      suffix: str, a random one for unkeyed parts
+    """
+    if key is None:
+        return uuid.uuid4().hex[:8]
+    return 'key-' + re.sub(r'\W+', '_', str(key))
+
+
+def new_part_name(fmt=STAGING_FORMAT, key=None):
+    """
+    Name of a new part file of a staged dataset. Names sort in the order the parts were written.
+    :param fmt: staging format, one of FILE_EXTENSIONS
+    :param key: optional part key, see StagedWriter
+    :return:
+      name: e.g. 'part-01712345678901234567-1a2b3c4d.parquet'
+    """
+    return f"part-{time.time_ns():020d}-{part_suffix(key)}{file_extension(fmt)}"
+
+
+def dataset_parts(path):
+    """
+    Part files of a staged dataset, in the order they were written. A plain staged file (as written before
+    datasets, or a committed sample) counts as a dataset of one part.
+    :param path: staged dataset dir or file
+    :return:
+      parts: list of file paths, empty if nothing is staged at path
+    """
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        return []
+    ext = os.path.splitext(path)[1]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.startswith('part-') and name.endswith(ext)]
+
+
+def staged_size(path):
+    """
+    Bytes on disk of a staged dataset (all of its parts).
+    :param path: staged dataset dir or file
+    :return:
+      n_bytes: int
+    """
+    return sum(os.path.getsize(part) for part in dataset_parts(path))
+
+
+def remove_staged(path):
+    """
+    Remove a staged dataset (or plain staged file), if there is one.
+    :param path: staged dataset dir or file
+    :return: None
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class StagedWriter:
+    """
+    Writes DataFrame batches to a staged dataset, one batch at a time, so a streamed extract never has to be
+    held in memory as a whole. A path target is a dataset dir ('<name><ext>/part-<n><ext>'), and each writer
+    adds one part file to it: Parquet batches become row groups of the part, csv batches are appended to it w/
+    a single header. The part is written to a temp file and only moved into the dataset by close(), so a
+    failed or aborted write leaves the dataset as it was. With append=True the existing parts are kept (a
+    delta run costs the size of the delta, not of the history), otherwise they are removed once the new part
+    is in place. An appended part can carry a key (e.g. the watermark a delta starts from): parts already in the
+    dataset w/ the same key are replaced by it, so writing the same delta again doesn't add its rows twice.
+    The target can also be a binary file-like object (a single file, append doesn't apply).
+    """
+
+    def __init__(self, file_path, fmt=STAGING_FORMAT, schema=None, append=False, key=None):
+        file_extension(fmt)  # validate format
+        self.file_path = file_path
+        self.fmt = fmt
+        self.schema = schema
+        self.is_path = isinstance(file_path, (str, os.PathLike))
+        self.append = append
+        self.key = key
+        self.rows = 0
+        self.bytes = 0
+        self._writer = None
+        if self.is_path:
+            self.file_path = os.fspath(file_path)
+            self._part_name = new_part_name(fmt, key)
+            # Next to the dataset dir, which may not exist yet (or still be a plain file)
+            self._target = f"{self.file_path}.{self._part_name}.tmp"
+        else:
+            self._target = file_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _open(self, table):
+        schema = self.schema or table.schema
+        if self.fmt == 'parquet':
+            self._writer = pq.ParquetWriter(self._target, schema)
+        else:
+            self._writer = pa.ipc.new_file(self._target, schema)
+
+    def write(self, df):
+        """
+        Write one batch.
+        :param df: DataFrame object
+        :return: None
+        """
+        if self.fmt in ('parquet', 'arrow'):
+            table = to_arrow(df, self.schema)
+            if self._writer is None:
+                self._open(table)
+            self._writer.write_table(table)
+        else:
+            first = self.rows == 0
+            if self.is_path:
+                df.to_csv(self._target, mode='w' if first else 'a', header=first, index=False)
+            else:
+                self._target.write(df.to_csv(header=first, index=False).encode('utf-8'))
+        self.rows += len(df)
+
+    def _publish(self):
+        # Move the finished part into the dataset, then drop the parts it replaces. A plain staged file at
+        # the path becomes the first part of the dataset (append) or is replaced.
+        previous = None
+        if os.path.isfile(self.file_path):
+            previous = f"{self.file_path}.{new_part_name(self.fmt)}.tmp"
+            os.replace(self.file_path, previous)
+        os.makedirs(self.file_path, exist_ok=True)
+        old_parts = dataset_parts(self.file_path)
+        if previous and self.append:
+            os.replace(previous, os.path.join(self.file_path, 'part-' + '0' * 20 + file_extension(self.fmt)))
+            previous = None
+
+        part = os.path.join(self.file_path, self._part_name)
+        os.replace(self._target, part)
+        self.bytes = os.path.getsize(part)
+
+        if not self.append:
+            for old_part in old_parts:
+                os.remove(old_part)
+        elif self.key is not None:
+            keyed = part_suffix(self.key) + file_extension(self.fmt)
+            for old_part in old_parts:
+                if old_part.endswith('-' + keyed):
+                    os.remove(old_part)
+        if previous:
+            os.remove(previous)
+
+    def close(self):
+        """
+        Finalize the part and add it to the dataset. If no batch was written, nothing is created and the
+        dataset is left as is.
+        :return: None
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.is_path and self.rows and os.path.exists(self._target):
+            self._publish()
+
+    def abort(self):
+        """
+        Drop the part after a failed write. The dataset keeps the parts it had.
+        :return: None
+        """
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            self._writer = None
+            if self.is_path and os.path.exists(self._target):
+                os.remove(self._target)
+
+
+def write_staged(df, target, fmt=STAGING_FORMAT, schema=None, append=False, key=None):
+    """
+    Write a DataFrame to a staged dataset (a new part file) or a file-like object.
+    :param df: DataFrame object
+    :param target: dataset path, or a binary file-like object (append is ignored for file-like objects)
+    :param fmt: staging format, one of FILE_EXTENSIONS
+    :param schema: optional pyarrow schema the data is cast to
+    :param append: if True, keep the parts already in the dataset, otherwise replace them
+    :param key: optional part key; an appended part replaces the parts w/ the same key, see StagedWriter
+    :return:
+      rows, bytes: rows written and bytes of the new part (bytes is 0 for file-like targets)
+    """
+    with StagedWriter(target, fmt, schema, append, key) as writer:
+        writer.write(df)
+    return len(df), writer.bytes
+
+
+def open_staged(file_path, fmt=None, columns=None):
+    """
+    Open a staged dataset as an Arrow table (its parts in write order). Arrow IPC parts are memory-mapped: the
+    table's buffers point into the page cache, so opening one is zero-copy and only the columns actually used
+    are ever paged in, by this or any other process mapping the same files. Parquet / csv parts are read
+    (decoded / parsed) into memory. Not used by the pipelines themselves, see STAGING_FORMAT.
+    :param file_path: staged dataset dir or file
+    :param fmt: staging format, inferred from the file extension if not given
+    :param columns: optional subset of columns
+    :return:
+      table: pyarrow Table
+    """
+    fmt = fmt or format_of(file_path)
+    parts = dataset_parts(file_path)
+    if not parts:
+        raise FileNotFoundError(f"Nothing staged at {file_path}")
+    if fmt == 'arrow':
+        tables = [pa.ipc.open_file(pa.memory_map(part)).read_all() for part in parts]
+        tables = [table.select(columns) for table in tables] if columns else tables
+    elif fmt == 'parquet':
+        tables = [pq.read_table(part, columns=columns) for part in parts]
+    else:
+        tables = [pa.Table.from_pandas(pd.read_csv(part, usecols=columns), preserve_index=False) for part in parts]
+    return tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+
+
+def read_staged(file_path, fmt=None, columns=None):
+    """
+    Read a staged dataset back into a DataFrame.
+    :param file_path: staged dataset dir or file
+    :param fmt: staging format, inferred from the file extension if not given
+    :param columns: optional subset of columns to read
+    :return:
+      df: DataFrame object
+    """
+    fmt = fmt or format_of(file_path)
+    if fmt in ('parquet', 'arrow'):
+        return open_staged(file_path, fmt, columns).to_pandas(date_as_object=False)
+    parts = dataset_parts(file_path)
+    if not parts:
+        raise FileNotFoundError(f"Nothing staged at {file_path}")
+    return pd.concat([pd.read_csv(part, usecols=columns) for part in parts], ignore_index=True)
+
+
+def open_upload(file_path):
+    """
+    Open a staged dataset for a BigQuery load job, as one file in upload_format(). A single Parquet / csv part
+    is sent as is; several parts (or Arrow IPC) are combined into a temp file, one row group / record batch
+    (or csv part) at a time.
+    :param file_path: staged dataset dir or file
+    :return:
+      file: binary file object positioned at the start, to be closed by the caller
+    """
+    fmt = format_of(file_path)
+    parts = dataset_parts(file_path)
+    if not parts:
+        raise FileNotFoundError(f"Nothing staged at {file_path}")
+    if len(parts) == 1 and fmt != 'arrow':
+        return open(parts[0], 'rb')
+
+    upload = tempfile.TemporaryFile()
+    if fmt == 'csv':
+        for i, part in enumerate(parts):
+            with open(part, 'rb') as source:
+                if i:
+                    source.readline()  # one header, from the first part
+                shutil.copyfileobj(source, upload)
+    else:
+        writer = None
+        for part in parts:
+            if fmt == 'arrow':
+                with pa.memory_map(part) as source:
+                    reader = pa.ipc.open_file(source)
+                    writer = writer or pq.ParquetWriter(upload, reader.schema)
+                    for i in range(reader.num_record_batches):
+                        writer.write_batch(reader.get_batch(i))
+            else:
+                source = pq.ParquetFile(part)
+                writer = writer or pq.ParquetWriter(upload, source.schema_arrow)
+                for i in range(source.num_row_groups):
+                    writer.write_table(source.read_row_group(i))
+        writer.close()
+    upload.seek(0)
+    return upload
+
+
+def bq_load_config(fmt=STAGING_FORMAT, write_disposition='WRITE_EMPTY'):
+    """
+    BigQuery load job config for files in a staging format. Parquet files carry their own schema, so
+    only csv needs a header skip and schema autodetection.
+    :param fmt: staging format, one of FILE_EXTENSIONS ('arrow' is uploaded as Parquet, see upload_format())
+    :param write_disposition: BigQuery write disposition
+    :return:
+      job_config: LoadJobConfig object
+    """
+    if upload_format(fmt) == 'parquet':
+        return bq.LoadJobConfig(
+            source_format=bq.SourceFormat.PARQUET,
+            write_disposition=write_disposition
+        )
+    return bq.LoadJobConfig(
+        skip_leading_rows=1,
+        source_format=bq.SourceFormat.CSV,
+        autodetect=True,
+        write_disposition=write_disposition
+    )
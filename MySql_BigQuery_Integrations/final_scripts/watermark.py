@@ -0,0 +1,122 @@
+# modules
+import json
+import os
+
+# File that stores the high-water mark of every pipeline, keyed by pipeline name
+WATERMARK_FILE = 'watermarks.json'
+
+
+def watermark_path():
+    """
+    Location of the watermark file. Like creds.txt, it is resolved against the current working directory.
+    :return:
+      path: absolute path of the watermark file
+    """
+    return os.path.join(os.getcwd(), WATERMARK_FILE)
+
+
+def read_watermark(pipeline):
+    """
+    Read the persisted high-water mark for a pipeline.
+    :param pipeline: name of the pipeline, e.g. 'house_price_data'
+    :return:
+      value: last committed mark, or None if the pipeline has never completed an incremental run
+    """
+    try:
+        with open(watermark_path(), "r") as file:
+            marks = json.load(file)
+        return marks.get(pipeline)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        print("Watermark file is corrupt. Falling back to a full reload.")
+        return None
+
+
+def write_watermark(pipeline, value):
+    """
+    Persist the high-water mark for a pipeline. Other pipelines' marks in the file are left untouched.
+    The file is replaced atomically so a crash mid-write cannot lose previously committed marks.
+    :param pipeline: name of the pipeline
+    :param value: new mark; dates are stored as ISO strings
+    :return: None
+    """
+    path = watermark_path()
+    try:
+        with open(path, "r") as file:
+            marks = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        marks = {}
+
+    marks[pipeline] = value if isinstance(value, (int, float)) else str(value)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "w") as file:
+        json.dump(marks, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def fetch_high_water_mark(conn, table, column):
+    """
+    Query the current max value of the watermark column in the source table.
+    :param conn: open MySql connection object
+    :param table: source table name
+    :param column: watermark column name
+    :return:
+      value: MAX(column), or None if the table is empty
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX({column}) FROM {table};")
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return value
+
+
+def window_clause(column, window, inclusive=False):
+    """
+    Build the WHERE clause restricting a query to rows inside an incremental window. The lower bound is
+    exclusive (already loaded by the previous run) and the upper bound inclusive.
+    :param column: watermark column name
+    :param window: (low, high) tuple; low is None on the first incremental run
+    :param inclusive: if True, the lower bound is inclusive too, for a column that isn't unique (rows can
+      still be added at the committed mark), see incremental_window()
+    :return:
+      clause: SQL text to append to the query, empty when window is None
+      params: tuple of query parameters matching the clause
+    """
+    if window is None:
+        return "", ()
+
+    low, high = window
+    if low is None:
+        return f"WHERE {column} <= %s", (high,)
+    return f"WHERE {column} {'>=' if inclusive else '>'} %s AND {column} <= %s", (low, high)
+
+
+def incremental_window(conn, pipeline, table, column, inclusive=False):
+    """
+    Work out the slice of the source table that has not been loaded yet.
+    :param conn: open MySql connection object
+    :param pipeline: name of the pipeline
+    :param table: source table name
+    :param column: watermark column name
+    :param inclusive: if True, the rows at the committed mark are extracted again (window_clause(inclusive=True)),
+      so there is always a window once the table has rows; the caller replaces what it loaded for those
+      values instead of appending to it
+    :return:
+      window: (last committed mark, current max value) tuple, or None if there are no new rows
+    """
+    low = read_watermark(pipeline)
+    high = fetch_high_water_mark(conn, table, column)
+
+    if high is None:
+        return None
+    if low is not None:
+        # Numeric marks compare as numbers, dates/timestamps as ISO strings
+        if isinstance(low, (int, float)):
+            caught_up = float(high) < low if inclusive else float(high) <= low
+        else:
+            caught_up = str(high) < low if inclusive else str(high) <= low
+        if caught_up:
+            return None
+    return low, high
@@ -0,0 +1,41 @@
+# modules
+import glob
+import os
+import sys
+import pandas as pd
+
+# make final_scripts importable when run from test_scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_scripts'))
+from dtype_plan import apply_dtype_plan, concat_planned, memory_report  # noqa: E402
+from house_price_data import HOUSE_DTYPES  # noqa: E402
+from movie_data import MOVIE_DTYPES  # noqa: E402
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def report(label, files, plan):
+    """
+    Reads the same staged files w/ default dtypes and w/ the pipeline's dtype plan and prints the footprint
+    of both.
+    :param label: dataset name
+    :param files: list of .csv files
+    :param plan: dict of column -> dtype, see dtype_plan.apply_dtype_plan()
+    :return:
+      report: DataFrame w/ MB per column before/after
+    """
+    before = pd.concat([pd.read_csv(file) for file in files], ignore_index=True)
+    after = concat_planned([apply_dtype_plan(pd.read_csv(file), plan) for file in files])
+
+    # Same vals either way, only the dtypes differ
+    assert before.astype(str).equals(after.astype(str).replace({'<NA>': 'nan', 'NaT': 'nan'})), \
+        "planned frame differs from the default read"
+
+    result = memory_report(before, after, label)
+    print(result.to_string())
+    print()
+    return result
+
+
+if __name__ == '__main__':
+    report('movie_data', sorted(glob.glob(os.path.join(PROJECT_DIR, 'movie_data', '*.csv'))), MOVIE_DTYPES)
+    report('house_price_data', [os.path.join(PROJECT_DIR, 'house_price_data', 'house_prices.csv')], HOUSE_DTYPES)
@@ -0,0 +1,85 @@
+# modules
+import io
+import os
+import sys
+import timeit
+import tracemalloc
+import pandas as pd
+
+# make final_scripts importable when run from test_scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_scripts'))
+from house_price_data import reshape  # noqa: E402
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'house_price_data', 'house_prices.csv')
+
+
+def reshape_stack(df):
+    """
+    The original stack/split implementation of transformations(), kept here as the reference.
+    :param df: wide DataFrame object
+    :return:
+      - df: transformed DataFrame object
+    """
+    df = df.set_index('Date')
+    df = df.stack()
+    df = df[df.notna()].reset_index()  # stack() used to drop empty cells itself
+    df.columns = ['Date', 'City', 'Price']
+    df['Price'] = pd.to_numeric(df['Price'], errors='coerce')
+    df['Date'] = pd.to_datetime(df['Date'])
+    df[['State', 'City']] = df['City'].str.split('-', expand=True)
+    return df[['Date', 'City', 'State', 'Price']]
+
+
+def source_table(scale=1):
+    """
+    Rebuilds the wide city_house_prices table (one text column per State-City) from the committed output.
+    :param scale: number of times the date range is repeated, to grow the table
+    :return:
+      df: wide DataFrame object
+    """
+    long = pd.read_csv(CSV_PATH, dtype=str, keep_default_na=False)
+    long['header'] = long['State'] + '-' + long['City']
+    wide = long.pivot(index='Date', columns='header', values='Price')
+    wide = wide[long['header'].unique()].reset_index()
+    wide.columns.name = None
+    return pd.concat([wide] * scale, ignore_index=True)
+
+
+def measure(func, df, repeat):
+    """
+    Best wall time and peak traced memory of one reshape implementation.
+    :return:
+      seconds, peak_mb
+    """
+    seconds = min(timeit.repeat(lambda: func(df), number=1, repeat=repeat))
+    tracemalloc.start()
+    func(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1024 ** 2
+
+
+def benchmark(scale=50, repeat=3):
+    """
+    Checks reshape() reproduces house_prices.csv byte for byte, then compares it against the stack path.
+    :param scale: size multiplier of the synthetic source table
+    :param repeat: number of timing runs, best run is reported
+    :return: None
+    """
+    out = io.StringIO()
+    reshape(source_table()).to_csv(out, index=False)
+    with open(CSV_PATH, newline='') as file:
+        assert out.getvalue() == file.read(), "reshape() output differs from house_prices.csv"
+
+    df = source_table(scale)
+    stack_s, stack_mb = measure(reshape_stack, df, repeat)
+    vector_s, vector_mb = measure(reshape, df, repeat)
+
+    print(f"source: {df.shape[0]} rows x {df.shape[1] - 1} State-City columns")
+    print(f"stack:      {stack_s * 1000:.1f} ms, peak {stack_mb:.1f} MB")
+    print(f"vectorized: {vector_s * 1000:.1f} ms, peak {vector_mb:.1f} MB")
+    print(f"speedup:    {stack_s / vector_s:.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,50 @@
+# modules
+import os
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+
+# make final_scripts importable when run from test_scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_scripts'))
+from movie_data import transformations, length_category  # noqa: E402
+
+
+def sample_durations(n_rows):
+    """
+    Synthetic duration column w/ the shape of imdb_movies: mostly 60-180 min, some shorts and some NULLs.
+    :param n_rows: number of rows to generate
+    :return:
+      s: Series of durations
+    """
+    rng = np.random.default_rng(0)
+    s = pd.Series(rng.integers(20, 240, n_rows), dtype='float64')
+    s[rng.random(n_rows) < 0.01] = np.nan
+    return s
+
+
+def benchmark(n_rows=85000, repeat=5):
+    """
+    Compares the row-wise apply path against the vectorized binning stage.
+    :param n_rows: number of rows to bin
+    :param repeat: number of timing runs, best run is reported
+    :return: None
+    """
+    durations = sample_durations(n_rows)
+
+    # Both paths must agree before timing means anything
+    expected = durations.apply(transformations).tolist()
+    actual = length_category(durations).tolist()
+    assert expected == actual, "length_category() output differs from transformations()"
+
+    apply_s = min(timeit.repeat(lambda: durations.apply(transformations), number=1, repeat=repeat))
+    vector_s = min(timeit.repeat(lambda: length_category(durations), number=1, repeat=repeat))
+
+    print(f"rows: {n_rows}")
+    print(f"apply:      {apply_s * 1000:.2f} ms")
+    print(f"vectorized: {vector_s * 1000:.2f} ms")
+    print(f"speedup:    {apply_s / vector_s:.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,57 @@
+# modules
+import os
+import sys
+import tempfile
+import timeit
+import pandas as pd
+import pyarrow as pa
+
+# make final_scripts importable when run from test_scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_scripts'))
+from house_price_data import HOUSE_SCHEMA  # noqa: E402
+from staging import file_extension, open_staged, read_staged, staged_size, write_staged  # noqa: E402
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'house_price_data', 'house_prices.csv')
+
+
+def benchmark(copies=20, repeat=5):
+    """
+    Stages the house prices as csv, Parquet and Arrow IPC and times reloading each one. Arrow IPC is timed
+    twice: memory-mapped as an Arrow table (what a downstream stage or another process gets, zero-copy) and
+    converted to a DataFrame.
+    :param copies: number of times the committed sample is repeated, to get a table worth timing
+    :param repeat: number of timing runs, best run is reported
+    :return: None
+    """
+    df = pd.concat([pd.read_csv(CSV_PATH, parse_dates=['Date'])] * copies, ignore_index=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {}
+        for fmt in ('csv', 'parquet', 'arrow'):
+            paths[fmt] = os.path.join(tmp_dir, 'house_prices' + file_extension(fmt))
+            write_staged(df, paths[fmt], fmt, HOUSE_SCHEMA)
+
+        # Same rows back whichever format they were staged in
+        expected = read_staged(paths['parquet'])
+        assert read_staged(paths['arrow']).equals(expected), "Arrow IPC reload differs from Parquet"
+
+        runs = [
+            ('csv (read_csv)', 'csv', lambda: read_staged(paths['csv'])),
+            ('parquet (DataFrame)', 'parquet', lambda: read_staged(paths['parquet'])),
+            ('arrow ipc (DataFrame)', 'arrow', lambda: read_staged(paths['arrow'])),
+            ('arrow ipc (mmap table)', 'arrow', lambda: open_staged(paths['arrow'])),
+        ]
+        print(f"{len(df)} rows")
+        for label, fmt, run in runs:
+            seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+            allocated = pa.total_allocated_bytes()
+            result = run()
+            allocated = pa.total_allocated_bytes() - allocated
+            file_mb = staged_size(paths[fmt]) / 1024 ** 2
+            print(f"{label:<24} {seconds * 1000:9.2f} ms  file {file_mb:7.2f} MB  "
+                  f"arrow heap {allocated / 1024 ** 2:7.2f} MB")
+            del result
+
+
+if __name__ == '__main__':
+    benchmark()
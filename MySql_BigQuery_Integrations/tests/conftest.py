@@ -0,0 +1,6 @@
+# modules
+import os
+import sys
+
+# make final_scripts importable, as the scripts import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final_scripts'))
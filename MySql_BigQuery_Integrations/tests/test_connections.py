@@ -0,0 +1,163 @@
+# modules
+import threading
+import mysql.connector
+import pytest
+import connections
+from connections import ConnectionPool, get_mysql_connection
+
+
+class FakeMySqlConnection:
+    """
+    Raw MySql connection w/ the state ConnectionPool checks: health, unread results, an open transaction.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.connected = True
+        self.unread_result = False
+        self.in_transaction = False
+        self.closed = False
+        self.rolled_back = False
+        self.cleanup_error = None
+
+    def is_connected(self):
+        return self.connected
+
+    def consume_results(self):
+        if self.cleanup_error:
+            raise self.cleanup_error
+        self.unread_result = False
+
+    def rollback(self):
+        self.rolled_back = True
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    # Every raw connection mysql.connector.connect() opened, in order
+    opened = []
+
+    def connect(**credentials):
+        opened.append(FakeMySqlConnection(len(opened)))
+        return opened[-1]
+    monkeypatch.setattr(mysql.connector, 'connect', connect)
+    return opened
+
+
+def test_closed_connection_goes_back_to_the_pool(opened):
+    pool = ConnectionPool({}, size=2)
+
+    conn = pool.get()
+    conn.close()
+    conn.close()  # a second close() doesn't return it twice
+    again = pool.get()
+
+    assert again.n == 0 and len(opened) == 1
+    assert pool.metrics['misses'] == 1 and pool.metrics['hits'] == 1
+
+
+def test_connection_is_returned_when_the_caller_fails(opened):
+    pool = ConnectionPool({}, size=1, timeout=0.1)
+
+    with pytest.raises(mysql.connector.Error):
+        conn = pool.get()
+        try:
+            raw, = opened
+            raw.unread_result, raw.in_transaction = True, True  # abandoned unbuffered query, open transaction
+            raise mysql.connector.Error(msg='Lost connection to MySQL server during query')
+        finally:
+            conn.close()
+
+    # Drained and rolled back, then handed out again
+    assert not raw.unread_result and raw.rolled_back
+    assert pool.get().n == 0
+
+
+def test_connection_that_cant_be_cleaned_up_is_discarded(opened):
+    pool = ConnectionPool({}, size=1, timeout=0.1)
+    conn = pool.get()
+    opened[0].unread_result = True
+    opened[0].cleanup_error = mysql.connector.Error(msg='Commands out of sync')
+
+    conn.close()
+
+    # Its slot is free again: the next checkout opens a new connection instead of waiting
+    assert opened[0].closed
+    assert pool.get().n == 1
+
+
+def test_failed_connect_frees_its_slot(opened, monkeypatch):
+    pool = ConnectionPool({}, size=1, timeout=0.1)
+    connect = mysql.connector.connect
+
+    def refuse(**credentials):
+        raise mysql.connector.Error(msg="Can't connect to MySQL server")
+    monkeypatch.setattr(mysql.connector, 'connect', refuse)
+    with pytest.raises(mysql.connector.Error):
+        pool.get()
+
+    monkeypatch.setattr(mysql.connector, 'connect', connect)
+    assert pool.get().n == 0
+
+
+def test_stale_connection_is_replaced(opened):
+    pool = ConnectionPool({}, size=1)
+    pool.get().close()
+    opened[0].connected = False
+
+    conn = pool.get()
+
+    assert conn.n == 1 and opened[0].closed
+    assert pool.metrics['health_check_failures'] == 1
+
+
+def test_exhausted_pool_waits_for_a_release(opened):
+    pool = ConnectionPool({}, size=1, timeout=5)
+    conn = pool.get()
+    threading.Timer(0.05, conn.close).start()
+
+    assert pool.get().n == 0
+    assert pool.metrics['waits'] == 1 and pool.metrics['wait_time_s'] > 0
+
+
+def test_exhausted_pool_times_out(opened):
+    pool = ConnectionPool({}, size=1, timeout=0.05)
+    pool.get()
+
+    with pytest.raises(mysql.connector.errors.PoolError):
+        pool.get()
+    assert len(opened) == 1
+
+
+def test_credentials_file_is_read_once_per_pool(opened, tmp_path, monkeypatch):
+    monkeypatch.setattr(connections, '_pools', {})
+    creds = tmp_path / 'creds.txt'
+    creds.write_text("host = localhost\nuser=etl\n")
+
+    get_mysql_connection(str(creds)).close()
+    creds.unlink()
+    conn = get_mysql_connection(str(creds))
+
+    assert conn.n == 0
+    pool, = connections._pools.values()
+    assert pool.credentials == {'host': 'localhost', 'user': 'etl'}
+
+
+def test_one_bigquery_client_per_project(monkeypatch):
+    monkeypatch.setattr(connections, '_bq_clients', {})
+    created = []
+    monkeypatch.setattr(connections.bq, 'Client', lambda project: created.append(project) or object())
+
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(connections.get_bq_client('etl'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ['etl'] and len({id(client) for client in clients}) == 1
+    assert connections.get_bq_client('other') is not clients[0]
@@ -0,0 +1,115 @@
+# modules
+import os
+import pandas as pd
+import pytest
+import extract_cache
+from extract_cache import cached_extract, evict, mysql_fingerprint
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+
+    def execute(self, qry, params=None):
+        self.conn.queries.append(qry)
+        if qry.startswith('CHECKSUM TABLE'):
+            self.row = ('db.movies', self.conn.checksum)
+        else:
+            self.row = (self.conn.rows, self.conn.max_id)
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, checksum=1, rows=10, max_id=10):
+        self.checksum = checksum
+        self.rows = rows
+        self.max_id = max_id
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture(autouse=True)
+def cache_in_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def test_checksum_fingerprint_changes_with_the_table():
+    conn = FakeConnection(checksum=1)
+    before = mysql_fingerprint(conn, 'movies')
+    conn.checksum = 2
+    assert mysql_fingerprint(conn, 'movies') != before
+    assert conn.queries == ['CHECKSUM TABLE `movies`;'] * 2
+
+
+def test_key_fingerprint_needs_a_key_column():
+    conn = FakeConnection(rows=10, max_id=10)
+    with pytest.raises(ValueError):
+        mysql_fingerprint(conn, 'movies', method='key')
+    assert mysql_fingerprint(conn, 'movies', method='key', key_column='id') == 'key:10:10'
+
+
+def test_missing_checksum_skips_the_cache():
+    conn = FakeConnection(checksum=None)
+    reads = []
+    read = lambda: reads.append(1) or pd.DataFrame({'a': [1]})
+    cached_extract(conn, 'SELECT 1', (), 'movies', read)
+    cached_extract(conn, 'SELECT 1', (), 'movies', read)
+    assert len(reads) == 2
+
+
+def test_cache_hit_until_the_fingerprint_changes():
+    conn = FakeConnection(checksum=1)
+    reads = []
+    read = lambda: reads.append(1) or pd.DataFrame({'a': [1, 2]})
+    cached_extract(conn, 'SELECT a', (), 'movies', read)
+    cached_extract(conn, 'SELECT a', (), 'movies', read)
+    assert len(reads) == 1
+
+    conn.checksum = 2
+    cached_extract(conn, 'SELECT a', (), 'movies', read)
+    assert len(reads) == 2
+
+
+def test_given_fingerprint_is_not_recomputed():
+    conn = FakeConnection()
+    df = cached_extract(conn, 'SELECT a', (), 'movies', lambda: pd.DataFrame({'a': [1]}), fingerprint='checksum:1')
+    assert len(df) == 1 and conn.queries == []
+
+
+def test_evict_skips_entries_removed_by_another_thread(monkeypatch):
+    directory = extract_cache.cache_dir()
+    for i in range(3):
+        pd.DataFrame({'a': range(1000)}).to_parquet(os.path.join(directory, f'{i}.parquet'))
+
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)  # another thread got there first
+        remove(path)
+
+    monkeypatch.setattr(extract_cache.os, 'remove', remove_twice)
+    assert evict(max_bytes=0) == []
+    assert os.listdir(directory) == []
+
+
+def test_changed_dtype_plan_is_a_miss():
+    conn = FakeConnection(checksum=1)
+    reads = []
+    read = lambda: reads.append(1) or pd.DataFrame({'a': [1, 2]})
+    cached_extract(conn, 'SELECT a', (), 'movies', read, plan={'a': 'Int16'})
+    cached_extract(conn, 'SELECT a', (), 'movies', read, plan={'a': 'Int16'})
+    assert len(reads) == 1
+
+    cached_extract(conn, 'SELECT a', (), 'movies', read, plan={'a': 'Int32'})
+    assert len(reads) == 2
@@ -0,0 +1,127 @@
+# modules
+import os
+import mysql.connector
+import pandas as pd
+import pytest
+from google.api_core.exceptions import GoogleAPIError
+import house_price_data
+from staging import read_staged
+
+
+class FakeLoadJob:
+    def result(self):
+        return None
+
+
+class FakeTable:
+    def __init__(self, num_rows):
+        self.num_rows = num_rows
+
+
+class FakeBigQueryClient:
+    """
+    Records every load job (table, write disposition, rows uploaded) and keeps the rows of the table: loads
+    truncate or append, DELETE queries drop the rows past their @value. Loads fail while fail is set.
+    """
+
+    def __init__(self):
+        self.loads = []
+        self.queries = []
+        self.rows = pd.DataFrame()
+        self.fail = False
+
+    def load_table_from_file(self, file_obj, destination, job_config=None):
+        if self.fail:
+            raise GoogleAPIError(f"load to {destination} failed")
+        df = pd.read_parquet(file_obj)
+        self.loads.append((destination, job_config.write_disposition, len(df)))
+        if job_config.write_disposition == 'WRITE_TRUNCATE':
+            self.rows = df
+        else:
+            self.rows = pd.concat([self.rows, df], ignore_index=True)
+        return FakeLoadJob()
+
+    def query(self, sql, job_config=None):
+        value, = [param.value for param in job_config.query_parameters]
+        self.queries.append((sql, value))
+        self.rows = self.rows[self.rows['Date'] <= value]
+        return FakeLoadJob()
+
+    def get_table(self, table_id):
+        return FakeTable(len(self.rows))
+
+
+def batch(start, n=5):
+    return pd.DataFrame({'Date': pd.date_range('2020-01-01', periods=n).shift(start), 'City': 'Austin',
+                         'State': 'TX', 'Price': [float(i) for i in range(start, start + n)]})
+
+
+def stream(n_batches, fail_after=None, first=0):
+    def transformations_stream(chunk_size=None, window=None):
+        for i in range(first, first + n_batches):
+            if fail_after is not None and i == first + fail_after:
+                raise mysql.connector.Error(msg='Lost connection to MySQL server during query')
+            yield batch(i * 5)
+    return transformations_stream
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = FakeBigQueryClient()
+    monkeypatch.setattr(house_price_data, 'bq_connector', lambda: client)
+    return client
+
+
+def test_failed_stream_loads_nothing_and_keeps_the_local_data(client, monkeypatch):
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(3))
+    assert house_price_data.load(stream=True) is True
+    assert client.loads == [(house_price_data.BQ_TABLE, 'WRITE_TRUNCATE', 15)]
+
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(3, fail_after=2))
+    assert house_price_data.load(stream=True) is None
+    assert len(client.loads) == 1  # no WRITE_TRUNCATE w/ the partial data
+    local = house_price_data.local_path()
+    assert len(read_staged(local)) == 15
+    assert not [file for file in os.listdir(os.path.dirname(local)) if file.endswith('.tmp')]
+
+
+def test_failed_stream_keeps_the_local_data_in_load_local(client, monkeypatch):
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(2))
+    assert house_price_data.load_local(stream=True) is True
+
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(3, fail_after=1))
+    assert house_price_data.load_local(stream=True) is None
+    assert len(read_staged(house_price_data.local_path())) == 10
+
+
+def fail_local(monkeypatch):
+    def write(self, df):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(house_price_data.LocalSink, 'write', write)
+
+
+@pytest.mark.parametrize('failing_sink', ['local', 'bigquery'])
+def test_retried_delta_replaces_what_the_failed_attempt_loaded(client, monkeypatch, failing_sink):
+    # Full load of 15 rows (2020-01-01..15), then a delta of 10 more (the mark is 2020-01-15)
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(3))
+    assert house_price_data.load(stream=True) is True
+    window = (str(batch(10)['Date'].iloc[-1]), str(batch(20)['Date'].iloc[-1]))
+    monkeypatch.setattr(house_price_data, 'transformations_stream', stream(2, first=3))
+
+    # One sink fails, the other one commits the delta: the run fails and the mark stays
+    with monkeypatch.context() as failing:
+        if failing_sink == 'local':
+            fail_local(failing)
+        else:
+            failing.setattr(client, 'fail', True)
+        assert house_price_data.load(stream=True, window=window) is None
+    assert (len(read_staged(house_price_data.local_path())), len(client.rows)) == \
+        ((15, 25) if failing_sink == 'local' else (25, 15))
+
+    # The retry replaces the delta in the sink that had it instead of appending it again
+    assert house_price_data.load(stream=True, window=window) is True
+    local = read_staged(house_price_data.local_path())
+    assert len(local) == len(client.rows) == 25
+    assert not local.duplicated().any() and not client.rows.duplicated().any()
+    assert {value for _, value in client.queries} == {pd.Timestamp(window[0]).date()}
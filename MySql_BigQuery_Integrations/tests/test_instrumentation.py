@@ -0,0 +1,74 @@
+# modules
+import threading
+import tracemalloc
+import pytest
+import instrumentation
+from instrumentation import clear_records, instrument, stage_records
+
+
+@pytest.fixture(autouse=True)
+def records():
+    clear_records()
+    yield
+    clear_records()
+
+
+def allocate(mb):
+    return bytearray(mb * 1024 ** 2)
+
+
+def test_stage_gets_an_rss_peak_without_tracing(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'TRACE_MALLOC', False)
+    instrument('test', 'stage')(lambda: len(allocate(8)))()
+
+    record, = stage_records()
+    assert record['traced_peak_mb'] is None
+    assert record['rss_peak_mb'] is not None
+    assert not tracemalloc.is_tracing()
+
+
+def test_overlapping_stages_w_the_same_rss_close_their_own_windows(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'current_rss_mb', lambda: 100.0)
+    first = instrumentation._open_rss_window()
+    second = instrumentation._open_rss_window()
+
+    assert first == second
+    instrumentation._close_rss_window(second)
+    assert [window is first for window in instrumentation._rss_windows] == [True]
+    instrumentation._close_rss_window(first)
+    assert instrumentation._rss_windows == []
+
+
+def test_tracing_is_stopped_after_the_last_stage(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'TRACE_MALLOC', True)
+
+    @instrument('test', 'outer')
+    def outer():
+        return instrument('test', 'inner')(lambda: len(allocate(8)))()
+
+    outer()
+    inner, outer_record = stage_records()
+    assert inner['traced_peak_mb'] >= 8
+    assert outer_record['traced_peak_mb'] >= inner['traced_peak_mb']
+    assert not tracemalloc.is_tracing()
+
+
+def test_overlapping_stages_get_no_traced_peak(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'TRACE_MALLOC', True)
+    started, release = threading.Event(), threading.Event()
+
+    @instrument('test', 'slow')
+    def slow():
+        started.set()
+        release.wait(5)
+        return True
+
+    thread = threading.Thread(target=slow)
+    thread.start()
+    started.wait(5)
+    instrument('test', 'fast')(lambda: len(allocate(1)))()
+    release.set()
+    thread.join()
+
+    assert {r['stage']: r['traced_peak_mb'] for r in stage_records()} == {'fast': None, 'slow': None}
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,109 @@
+# modules
+import threading
+import time
+import pandas as pd
+import pytest
+from google.api_core.exceptions import GoogleAPIError
+import movie_data
+from staging import file_extension, write_staged
+
+
+class FakeLoadJob:
+    def result(self):
+        return None
+
+
+class FakeTable:
+    def __init__(self, num_rows):
+        self.num_rows = num_rows
+
+
+class FakeBigQueryClient:
+    """
+    Records every load job (table, write disposition) and how many ran at the same time. Each load reads
+    the upload and takes delay_s, so concurrent loads overlap.
+    """
+
+    def __init__(self, delay_s=0.05, fail=()):
+        self.delay_s = delay_s
+        self.fail = set(fail)
+        self.loads = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def load_table_from_file(self, file_obj, destination, job_config=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            file_obj.read()
+            time.sleep(self.delay_s)
+            if destination in self.fail:
+                raise GoogleAPIError(f"load to {destination} failed")
+            with self._lock:
+                self.loads.append((destination, job_config.write_disposition))
+            return FakeLoadJob()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def get_table(self, table_id):
+        return FakeTable(1)
+
+
+@pytest.fixture
+def staging_dir(tmp_path):
+    # One staged yearly file per year, like load_local() writes
+    for year in range(2000, 2012):
+        df = pd.DataFrame({'year': [year], 'title': [f'Movie {year}'], 'genre': ['Drama'], 'avg_vote': [7.5],
+                           'movie_category': ['Excellent'], 'duration': [100], 'length_category': ['Avg. Length Film']})
+        write_staged(df, str(tmp_path / f'movies_{year}{file_extension()}'), schema=movie_data.MOVIE_SCHEMA)
+    return tmp_path
+
+
+def table_id(year):
+    return f'etl-project-419123.movie_data.movies_{year}'
+
+
+def test_load_bq_runs_loads_concurrently_up_to_max_in_flight(staging_dir):
+    client = FakeBigQueryClient()
+
+    assert movie_data.load_bq(str(staging_dir), client=client, max_in_flight=4) is True
+
+    assert sorted(table for table, _ in client.loads) == [table_id(year) for year in range(2000, 2012)]
+    assert client.max_in_flight == 4
+
+
+def test_load_bq_failed_table_does_not_stop_the_others(staging_dir):
+    client = FakeBigQueryClient(fail=[table_id(2003)])
+
+    assert movie_data.load_bq(str(staging_dir), client=client, max_in_flight=4) is None
+
+    loaded = {table for table, _ in client.loads}
+    assert table_id(2003) not in loaded
+    assert loaded == {table_id(year) for year in range(2000, 2012) if year != 2003}
+
+
+@pytest.mark.parametrize('write_disposition', ['WRITE_EMPTY', 'WRITE_APPEND', 'WRITE_TRUNCATE'])
+def test_load_bq_passes_the_write_disposition_to_every_job(staging_dir, write_disposition):
+    client = FakeBigQueryClient(delay_s=0)
+
+    assert movie_data.load_bq(str(staging_dir), write_disposition, client=client) is True
+
+    assert {disposition for _, disposition in client.loads} == {write_disposition}
+
+
+@pytest.mark.parametrize('window, staging_dir, write_disposition', [
+    ((None, 2011), '../movie_data', 'WRITE_TRUNCATE'),
+    ((2010, 2011), '../movie_data_delta', 'WRITE_TRUNCATE'),
+])
+def test_load_bq_window_replaces_the_delta_years(monkeypatch, window, staging_dir, write_disposition):
+    calls = []
+    monkeypatch.setattr(movie_data, 'load_bq', lambda *args, **kwargs: calls.append((args, kwargs)) or True)
+
+    assert movie_data.load_bq_window(window) is True
+
+    (args, kwargs), = calls
+    assert args[0] == staging_dir
+    assert kwargs.get('write_disposition', 'WRITE_EMPTY') == write_disposition
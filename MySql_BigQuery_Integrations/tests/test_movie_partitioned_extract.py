@@ -0,0 +1,145 @@
+# modules
+import os
+import sqlite3
+import threading
+import pandas as pd
+import pytest
+import movie_data
+from staging import file_extension, read_staged
+
+# Movies per year, skewed like imdb_movies: a few big years and a NULL year
+YEAR_COUNTS = {None: 3, 2000: 10, 2001: 1, 2002: 1, 2003: 8}
+
+
+class SqliteConnection:
+    """
+    Stand-in for a pooled MySql connection over sqlite, which runs the builder's backtick quoted SQL once the
+    %s placeholders become ?.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.closed = False
+
+    def cursor(self):
+        return SqliteCursor(self.conn.cursor())
+
+    def close(self):
+        self.closed = True
+
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, qry, params=()):
+        self._cursor.execute(qry.replace('%s', '?'), params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+def movies():
+    rows = [(year, f'Movie {year} {i}', 'Drama', 7.5, 'Excellent', 100, 'Avg. Length Film')
+            for year, n in YEAR_COUNTS.items() for i in range(n)]
+    return pd.DataFrame(rows, columns=movie_data.MOVIE_SCHEMA.names)
+
+
+@pytest.fixture
+def source():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute("CREATE TABLE `imdb_movies` (`year` INTEGER, `title` TEXT)")
+    conn.executemany("INSERT INTO `imdb_movies` VALUES (?, ?)", movies()[['year', 'title']].itertuples(index=False))
+    yield conn
+    conn.close()
+
+
+def in_range(year, key_range):
+    low, high = key_range
+    return year is not None and (low is None or year > low) and year <= high
+
+
+def test_ranges_cover_every_year_once_w_about_the_same_rows(source):
+    ranges = movie_data.partition_ranges(SqliteConnection(source), n_partitions=2)
+
+    # The skewed 2000 gets a range of its own; low exclusive (open for the first range), high inclusive like
+    # a watermark window
+    assert ranges == [(None, 2000), (2000, 2003)]
+    for year in range(2000, 2005):
+        assert sum(in_range(year, key_range) for key_range in ranges) == (year in YEAR_COUNTS)
+
+
+@pytest.mark.parametrize('n_partitions, ranges', [
+    (1, [(None, 2003)]),
+    (4, [(None, 2000), (2000, 2001), (2001, 2003)]),  # fewer ranges when a year holds more than its share
+    (50, [(None, 2000), (2000, 2001), (2001, 2002), (2002, 2003)]),  # at most one range per year
+])
+def test_number_of_ranges(source, n_partitions, ranges):
+    assert movie_data.partition_ranges(SqliteConnection(source), n_partitions=n_partitions) == ranges
+
+
+def test_ranges_of_a_window_split_only_its_rows(source):
+    # The window's lower bound is inclusive (WATERMARK_INCLUSIVE), so the 10 movies of 2000 are half its rows
+    assert movie_data.partition_ranges(SqliteConnection(source), (2000, 2001), n_partitions=2) == [
+        (None, 2000), (2000, 2001)]
+
+
+def test_no_rows_no_ranges(source):
+    source.execute("DELETE FROM `imdb_movies` WHERE `year` IS NOT NULL")
+
+    assert movie_data.partition_ranges(SqliteConnection(source)) == []
+
+
+@pytest.fixture
+def partitioned(source, tmp_path, monkeypatch):
+    # load_local_partitioned() over the sqlite source, w/ the staged files under tmp_path
+    workdir = tmp_path / 'final_scripts'
+    workdir.mkdir()
+    monkeypatch.chdir(workdir)
+    monkeypatch.setattr(movie_data, 'mysql_connector', lambda: SqliteConnection(source))
+    monkeypatch.setattr(movie_data, 'try_fingerprint', lambda conn, table: None)
+
+    extracted = []
+    lock = threading.Lock()
+
+    def extract_partition(key_range, window=None, pushdown=True, use_cache=True, fingerprint=None):
+        with lock:
+            extracted.append(key_range)
+        df = movies()
+        if window is not None:  # low inclusive, see WATERMARK_INCLUSIVE
+            low, high = window
+            df = df[[in_range(year, (None, high)) and (low is None or year >= low) for year in df['year']]]
+        return df[[in_range(year, key_range) for year in df['year']]].astype({'year': 'int64'})
+    monkeypatch.setattr(movie_data, 'extract_partition', extract_partition)
+    return extracted
+
+
+def staged_years(directory):
+    ext = file_extension()
+    return {int(file[len('movies_'):-len(ext)]): len(read_staged(os.path.join(directory, file)))
+            for file in os.listdir(directory) if file.endswith(ext)}
+
+
+def test_partitioned_load_writes_one_file_per_year(partitioned, tmp_path):
+    assert movie_data.load_local_partitioned(n_partitions=3, max_workers=2) is True
+
+    assert sorted(partitioned, key=str) == [(2000, 2003), (None, 2000)]  # every range extracted once
+    assert staged_years(tmp_path / 'movie_data') == {year: n for year, n in YEAR_COUNTS.items() if year}
+    assert not os.path.exists(tmp_path / 'movie_data_delta')
+
+
+def test_partitioned_delta_load_also_writes_the_delta_years(partitioned, tmp_path):
+    assert movie_data.load_local_partitioned((2002, 2003), n_partitions=4) is True
+
+    assert staged_years(tmp_path / 'movie_data_delta') == {2002: 1, 2003: 8}
+    assert staged_years(tmp_path / 'movie_data') == {2002: 1, 2003: 8}
+
+
+def test_partitioned_load_of_an_empty_source_fails(partitioned, source, tmp_path):
+    source.execute("DELETE FROM `imdb_movies`")
+
+    assert movie_data.load_local_partitioned() is None
+    assert partitioned == []
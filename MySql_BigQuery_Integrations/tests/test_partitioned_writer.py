@@ -0,0 +1,64 @@
+# modules
+import os
+import pandas as pd
+import pyarrow as pa
+import pytest
+from partitioned_writer import write_partitions
+from staging import read_staged
+
+
+def movies():
+    return pd.DataFrame({'year': [2001, 2000, 2001, 2002, 2000, 2001],
+                         'genre': ['Drama', 'Drama', 'Comedy', 'Drama', 'Comedy', 'Drama'],
+                         'title': [f'Movie {i}' for i in range(6)]})
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_one_file_per_value_w_its_rows(tmp_path, parallel):
+    df = movies()
+
+    stats = write_partitions(df, 'year', str(tmp_path / 'out'), 'movies_{}.parquet', parallel=parallel)
+
+    assert [part['partition'] for part in stats] == [2001, 2000, 2002]  # first-seen order
+    assert sorted(os.listdir(tmp_path / 'out')) == ['movies_2000.parquet', 'movies_2001.parquet', 'movies_2002.parquet']
+    for part in stats:
+        expected = df[df['year'] == part['partition']].reset_index(drop=True)
+        pd.testing.assert_frame_equal(read_staged(part['file_path']), expected)
+        assert part['rows'] == len(expected) and part['bytes'] > 0
+
+
+def test_multi_column_key_names_the_file_after_every_value(tmp_path):
+    stats = write_partitions(movies(), ['year', 'genre'], str(tmp_path), 'movies_{}.csv', fmt='csv')
+
+    assert sorted(os.path.basename(part['file_path']) for part in stats) == [
+        'movies_2000_Comedy.csv', 'movies_2000_Drama.csv', 'movies_2001_Comedy.csv', 'movies_2001_Drama.csv',
+        'movies_2002_Drama.csv']
+    assert sum(part['rows'] for part in stats) == 6
+
+
+def test_rewrite_replaces_a_partition_unless_appending(tmp_path):
+    df = movies()
+    write_partitions(df, 'year', str(tmp_path), 'movies_{}.parquet')
+    write_partitions(df[df['year'] == 2000], 'year', str(tmp_path), 'movies_{}.parquet')
+    assert len(read_staged(str(tmp_path / 'movies_2000.parquet'))) == 2
+
+    write_partitions(df[df['year'] == 2000], 'year', str(tmp_path), 'movies_{}.parquet', append=True)
+    assert len(read_staged(str(tmp_path / 'movies_2000.parquet'))) == 4
+    assert len(read_staged(str(tmp_path / 'movies_2001.parquet'))) == 3
+
+
+def test_partitions_are_cast_to_the_schema(tmp_path):
+    schema = pa.schema([('year', pa.int16()), ('title', pa.string())])
+
+    stats = write_partitions(movies(), 'year', str(tmp_path), 'movies_{}.parquet', schema=schema)
+
+    df = read_staged(stats[0]['file_path'])
+    assert list(df.columns) == ['year', 'title'] and df['year'].dtype == 'int16'
+
+
+def test_empty_categories_get_no_file(tmp_path):
+    df = movies().astype({'genre': pd.CategoricalDtype(['Comedy', 'Drama', 'Horror'])})
+
+    stats = write_partitions(df, 'genre', str(tmp_path), 'movies_{}.parquet')
+
+    assert sorted(part['partition'] for part in stats) == ['Comedy', 'Drama']
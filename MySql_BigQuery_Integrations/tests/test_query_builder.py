@@ -0,0 +1,140 @@
+# modules
+import sqlite3
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+import pytest
+from query_builder import Query, bucketize, quote, unpivot_frame
+
+
+@pytest.fixture
+def db():
+    # sqlite accepts MySql's backtick quoting, so the rendered SQL runs as is once %s becomes ?
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE `city_house_prices` (`Date` TEXT, `CA-Los Angeles` REAL, `NY-New York` REAL)")
+    conn.executemany("INSERT INTO `city_house_prices` VALUES (?, ?, ?)",
+                     [('2000-02', 210.0, None), ('2000-01', 200.0, 300.0)])
+    conn.execute("CREATE TABLE `movies` (`title` TEXT, `year` INTEGER, `rating` REAL)")
+    conn.executemany("INSERT INTO `movies` VALUES (?, ?, ?)",
+                     [('A', 1999, 5.5), ('B', 2000, 6.0), ('C', 2001, 7.2), ('D', 2002, None)])
+    yield conn
+    conn.close()
+
+
+def run(db, query):
+    qry, params = query.sql()
+    return query.finish(pd.read_sql(qry.replace('%s', '?'), db, params=params))
+
+
+def test_quote_doubles_backticks():
+    assert quote('State-City') == '`State-City`'
+    assert quote('odd`name') == '`odd``name`'
+
+
+def test_case_bucketing_sql():
+    query = Query('movies').select('title').bucket('rating', [6, 7], ['low', 'mid'], 'high', 'band')
+
+    qry, params = query.sql()
+
+    assert qry == ("SELECT `title`, CASE WHEN `rating` < 6.0 THEN %s WHEN `rating` < 7.0 THEN %s ELSE %s END "
+                   "AS `band` FROM `movies`")
+    assert params == ('low', 'mid', 'high')
+
+
+def test_right_closed_buckets_use_less_or_equal():
+    qry, _ = Query('movies').bucket('rating', [6], ['low'], 'high', 'band', closed='right').sql()
+
+    assert "WHEN `rating` <= 6.0 THEN %s" in qry
+
+
+@pytest.mark.parametrize('closed', ['left', 'right'])
+def test_pushed_down_buckets_match_bucketize(db, closed):
+    def query(pushdown):
+        return (Query('movies').select('title', 'rating').where('year', '>=', 1999)
+                .bucket('rating', [6, 7], ['low', 'mid'], 'high', 'band', closed=closed, pushdown=pushdown))
+
+    pushed, pandas = run(db, query(True)), run(db, query(False))
+
+    pd.testing.assert_frame_equal(pushed, pandas)
+    expected = ['low', 'mid', 'high', 'high'] if closed == 'left' else ['low', 'low', 'high', 'high']
+    assert list(pushed['band']) == expected  # a NULL rating gets the default
+
+
+def test_non_numeric_thresholds_are_not_pushed_down():
+    query = Query('movies').bucket('rating', [Decimal('6.5')], ['low'], 'high', 'band')
+
+    assert 'CASE' not in query.sql()[0]
+    assert list(query.finish(pd.DataFrame({'rating': [6.0, 6.5]}))['band']) == ['low', 'high']
+
+
+def test_bucketize_treats_non_numeric_vals_as_missing():
+    values = pd.Series(['5', 'n/a', None, 9], index=[3, 1, 2, 0])
+
+    band = bucketize(values, [6], ['low'], 'high', name='band')
+
+    assert list(band) == ['low', 'high', 'high', 'high'] and list(band.index) == [3, 1, 2, 0]
+    assert band.name == 'band' and list(band.cat.categories) == ['low', 'high']
+
+
+def test_bucketize_needs_one_label_per_threshold():
+    with pytest.raises(ValueError):
+        bucketize(pd.Series([1]), [1, 2], ['low'], 'high')
+
+
+def test_where_and_window_are_parameters():
+    query = Query('movies').select('title').where('title', '!=', "O'Brien").window('year', (2000, 2002))
+
+    assert query.sql() == ("SELECT `title` FROM `movies` WHERE `title` != %s AND `year` > %s AND `year` <= %s",
+                           ("O'Brien", 2000, 2002))
+    with pytest.raises(ValueError):
+        Query('movies').where('year', 'LIKE', '19%')
+
+
+def test_union_all_unpivot_sql():
+    query = Query('city_house_prices').unpivot('Date', ['CA-Los Angeles', 'NY-New York'], ['State', 'City'], 'Price')
+
+    qry, params = query.sql()
+
+    assert qry == ("SELECT `Date`, `State`, `City`, `Price` FROM ("
+                   "SELECT `Date`, %s AS `State`, %s AS `City`, `CA-Los Angeles` AS `Price`, 0 AS _ord "
+                   "FROM `city_house_prices` WHERE `CA-Los Angeles` IS NOT NULL UNION ALL "
+                   "SELECT `Date`, %s AS `State`, %s AS `City`, `NY-New York` AS `Price`, 1 AS _ord "
+                   "FROM `city_house_prices` WHERE `NY-New York` IS NOT NULL) AS u ORDER BY `Date`, _ord")
+    assert params == ('CA', 'Los Angeles', 'NY', 'New York')
+
+
+def test_pushed_down_unpivot_matches_unpivot_frame(db):
+    value_columns = ['CA-Los Angeles', 'NY-New York']
+
+    def query(pushdown):
+        return (Query('city_house_prices').window('Date', (None, '2000-02'))
+                .unpivot('Date', value_columns, ['State', 'City'], 'Price', pushdown=pushdown))
+
+    pushed, pandas = run(db, query(True)), run(db, query(False))
+
+    pd.testing.assert_frame_equal(pushed, pandas)
+    assert list(zip(pushed['Date'], pushed['City'], pushed['Price'])) == [
+        ('2000-01', 'Los Angeles', 200.0), ('2000-01', 'New York', 300.0), ('2000-02', 'Los Angeles', 210.0)]
+
+
+def test_unpivot_of_every_column_needs_a_connection():
+    query = Query('city_house_prices').unpivot('Date', None, ['State', 'City'], 'Price')
+
+    with pytest.raises(ValueError):
+        query.sql()
+
+
+def test_unpivot_header_must_split_into_names_to():
+    query = Query('city_house_prices').unpivot('Date', ['Los Angeles'], ['State', 'City'], 'Price')
+
+    with pytest.raises(ValueError):
+        query.sql()
+
+
+def test_unpivot_frame_splits_on_the_first_separators_only():
+    df = pd.DataFrame({'Date': ['2000-01'], 'CA-Winston-Salem': [1.0], 'NY-New York': [np.nan]})
+
+    long = unpivot_frame(df, 'Date', None, ['State', 'City'], 'Price')
+
+    assert list(long.columns) == ['Date', 'State', 'City', 'Price']
+    assert long.loc[0, 'City'] == 'Winston-Salem' and len(long) == 1
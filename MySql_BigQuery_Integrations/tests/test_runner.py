@@ -0,0 +1,73 @@
+# modules
+import threading
+import pytest
+from runner import Task, critical_path, run_tasks
+
+
+def statuses(records):
+    return {r['task']: r['status'] for r in records}
+
+
+def test_results_are_handed_to_dependents_once():
+    calls = []
+
+    def extract():
+        calls.append('extract')
+        return 2
+
+    tasks = [Task('extract', extract),
+             Task('transform', lambda n: n * 10, ['extract']),
+             Task('load_gcs', lambda df: calls.append(('gcs', df)) or True, ['transform']),
+             Task('load_bq', lambda df: calls.append(('bq', df)) or True, ['transform'])]
+
+    records = run_tasks('movies', tasks)
+
+    assert [r['task'] for r in records] == ['extract', 'transform', 'load_gcs', 'load_bq']  # task order
+    assert set(statuses(records).values()) == {'ok'}
+    assert calls.count('extract') == 1 and sorted(calls[1:]) == [('bq', 20), ('gcs', 20)]
+
+
+def test_independent_tasks_run_side_by_side():
+    both_running = threading.Barrier(2, timeout=5)
+
+    def load():
+        both_running.wait()  # only returns once the other load runs at the same time
+        return True
+
+    records = run_tasks('movies', [Task('load_gcs', load), Task('load_bq', load)], max_workers=2)
+
+    assert set(statuses(records).values()) == {'ok'}
+
+
+@pytest.mark.parametrize('func, status', [(lambda: None, 'failed'), (lambda: 1 / 0, 'error')])
+def test_tasks_downstream_of_a_failure_are_skipped(func, status):
+    tasks = [Task('extract', func),
+             Task('transform', lambda df: df, ['extract']),
+             Task('load', lambda df: True, ['transform']),
+             Task('report', lambda: True)]
+
+    records = run_tasks('movies', tasks)
+
+    assert statuses(records) == {'extract': status, 'transform': 'skipped', 'load': 'skipped', 'report': 'ok'}
+    assert all(r['duration_s'] == 0.0 for r in records if r['status'] == 'skipped')
+
+
+def test_unknown_deps_and_cycles_are_rejected():
+    with pytest.raises(ValueError, match='unknown'):
+        run_tasks('movies', [Task('load', lambda df: True, ['transform'])])
+    with pytest.raises(ValueError, match='cycle'):
+        run_tasks('movies', [Task('a', lambda x: x, ['b']), Task('b', lambda x: x, ['a'])])
+
+
+def test_critical_path_is_the_longest_chain_by_duration():
+    def record(pipeline, task, duration_s, deps=()):
+        return {'pipeline': pipeline, 'task': task, 'deps': list(deps), 'duration_s': duration_s}
+
+    records = [record('movies', 'extract', 1.0),
+               record('movies', 'transform', 2.0, ['extract']),
+               record('movies', 'load_gcs', 0.5, ['transform']),
+               record('movies', 'load_bq', 3.0, ['transform']),
+               record('houses', 'extract', 5.0)]
+
+    assert critical_path(records) == ([('movies', 'extract'), ('movies', 'transform'), ('movies', 'load_bq')], 6.0)
+    assert critical_path([]) == ([], 0.0)
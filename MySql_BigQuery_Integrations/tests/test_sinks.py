@@ -0,0 +1,69 @@
+# modules
+import os
+import pandas as pd
+import pytest
+from sinks import LocalSink, fan_out
+from staging import dataset_parts, read_staged, write_staged
+
+
+class FailingSink:
+    """
+    Sink whose write() fails on the given batch; records whether it was aborted or closed.
+    """
+
+    def __init__(self, fail_on=0, name='failing'):
+        self.name = name
+        self.fail_on = fail_on
+        self.batches = 0
+        self.aborted = self.closed = False
+
+    def write(self, df):
+        if self.batches == self.fail_on:
+            raise OSError("connection reset")
+        self.batches += 1
+
+    def close(self):
+        self.closed = True
+        return {'rows': 0, 'bytes': 0}
+
+    def abort(self):
+        self.aborted = True
+
+
+def frame(start, n):
+    return pd.DataFrame({'id': range(start, start + n)})
+
+
+def frames(n_batches, fail_after=None):
+    for i in range(n_batches):
+        if i == fail_after:
+            raise RuntimeError("extract failed")
+        yield frame(i * 2, 2)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_failed_sink_leaves_a_partial_run(tmp_path, parallel):
+    # Delta run: the local part is appended next to the one already there
+    path = str(tmp_path / 'data.parquet')
+    write_staged(frame(0, 2), path)
+    failing = FailingSink(fail_on=1)
+
+    results = fan_out(frames(3), [LocalSink(path, append=True, key='mark'), failing], parallel)
+
+    # The other sink committed, the failed one is reported as None and was aborted
+    assert results == {'local': {'rows': 6, 'bytes': results['local']['bytes']}, 'failing': None}
+    assert failing.aborted and not failing.closed
+    assert len(dataset_parts(path)) == 2
+    assert read_staged(path)['id'].tolist() == [0, 1, 0, 1, 2, 3, 4, 5]
+    assert sorted(os.listdir(tmp_path)) == ['data.parquet']  # no temp file left behind
+
+
+def test_failed_frames_abort_every_sink(tmp_path):
+    path = str(tmp_path / 'data.parquet')
+    failing = FailingSink(fail_on=5)
+
+    with pytest.raises(RuntimeError):
+        fan_out(frames(3, fail_after=2), [LocalSink(path), failing])
+
+    assert failing.aborted and not failing.closed
+    assert dataset_parts(path) == []
@@ -0,0 +1,84 @@
+# modules
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from staging import StagedWriter, dataset_parts, open_upload, read_staged, write_staged
+
+
+def frame(start, n):
+    return pd.DataFrame({'id': range(start, start + n), 'value': [float(i) for i in range(start, start + n)]})
+
+
+@pytest.fixture(params=['parquet', 'csv', 'arrow'])
+def fmt(request):
+    return request.param
+
+
+def dataset(tmp_path, fmt):
+    return str(tmp_path / f'data.{fmt}')
+
+
+def test_append_adds_a_part_and_keeps_the_old_ones(tmp_path, fmt):
+    path = dataset(tmp_path, fmt)
+    write_staged(frame(0, 3), path, fmt)
+    first = dataset_parts(path)
+    write_staged(frame(3, 2), path, fmt, append=True)
+
+    parts = dataset_parts(path)
+    assert len(parts) == 2 and parts[0] == first[0]
+    assert read_staged(path)['id'].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_full_write_replaces_the_old_parts(tmp_path, fmt):
+    path = dataset(tmp_path, fmt)
+    write_staged(frame(0, 3), path, fmt)
+    write_staged(frame(3, 2), path, fmt, append=True)
+    write_staged(frame(10, 1), path, fmt)
+
+    assert len(dataset_parts(path)) == 1
+    assert read_staged(path)['id'].tolist() == [10]
+
+
+def test_failed_write_leaves_the_dataset_as_it_was(tmp_path, fmt):
+    path = dataset(tmp_path, fmt)
+    write_staged(frame(0, 3), path, fmt)
+
+    with pytest.raises(RuntimeError):
+        with StagedWriter(path, fmt) as writer:
+            writer.write(frame(3, 2))
+            raise RuntimeError("extract failed")
+
+    assert read_staged(path)['id'].tolist() == [0, 1, 2]
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(path)]  # no temp file left behind
+
+
+def test_plain_file_becomes_the_first_part_on_append(tmp_path):
+    path = str(tmp_path / 'data.parquet')
+    frame(0, 3).to_parquet(path, index=False)
+    assert read_staged(path)['id'].tolist() == [0, 1, 2]
+
+    write_staged(frame(3, 1), path, append=True)
+    assert os.path.isdir(path)
+    assert read_staged(path)['id'].tolist() == [0, 1, 2, 3]
+
+
+def test_open_upload_combines_the_parts(tmp_path, fmt):
+    path = dataset(tmp_path, fmt)
+    write_staged(frame(0, 3), path, fmt)
+    write_staged(frame(3, 2), path, fmt, append=True)
+
+    with open_upload(path) as upload:
+        df = pd.read_csv(upload) if fmt == 'csv' else pq.read_table(upload).to_pandas()
+    assert df['id'].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_keyed_part_replaces_the_part_w_the_same_key(tmp_path, fmt):
+    path = dataset(tmp_path, fmt)
+    write_staged(frame(0, 3), path, fmt)
+    write_staged(frame(3, 2), path, fmt, append=True, key='2020-01-15')
+    write_staged(frame(3, 3), path, fmt, append=True, key='2020-01-15')  # retried delta
+    write_staged(frame(6, 1), path, fmt, append=True, key='2020-01-18')
+
+    assert len(dataset_parts(path)) == 3
+    assert read_staged(path)['id'].tolist() == [0, 1, 2, 3, 4, 5, 6]
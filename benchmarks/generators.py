@@ -0,0 +1,143 @@
+# modules
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Size of each dataset at scale 1, roughly the committed samples (house_prices.csv, movies_*.csv) and a couple
+# of days of Xetra files
+HOUSE_DATES = 348
+HOUSE_CITIES = 23
+MOVIE_ROWS = 80000
+XETRA_DAYS = 2
+XETRA_FILES_PER_DAY = 8
+XETRA_ROWS_PER_FILE = 2000
+# Symbols of the daily stock prices at scale 1; scale 10 ~ the full 'stock prices.csv' (NYSE, ~500 symbols, 2010-2016)
+STOCK_SYMBOLS = 50
+STOCK_START = '2010-01-01'
+STOCK_END = '2016-12-31'
+
+STATES = ['AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'MA', 'MI', 'MN', 'NC', 'NV', 'NY', 'OH', 'OR', 'TX', 'WA']
+GENRES = ['Drama', 'Comedy', 'Action', 'Horror', 'Thriller', 'Romance', 'Crime', 'Documentary', 'Animation']
+
+
+def city_house_prices(scale=1, seed=0):
+    """
+    Synthetic city_house_prices: one row per month, one 'State-City' column per city, ~5% empty cells.
+    Scales up in cities first (up to 10x, MySql / SQLite column limits) and in months past that.
+    :param scale: size multiplier, 1 ~ the committed house_prices.csv
+    :param seed: random seed
+    :return:
+      df: wide DataFrame object w/ a 'Date' column
+    """
+    rng = np.random.default_rng(seed)
+    n_cities = HOUSE_CITIES * min(scale, 10)
+    n_dates = int(HOUSE_DATES * max(scale / 10, 1))
+
+    columns = [f'{STATES[i % len(STATES)]}-City{i:04d}' for i in range(n_cities)]
+    prices = 50 + rng.random((n_dates, n_cities)).cumsum(axis=0)
+    prices[rng.random(prices.shape) < 0.05] = np.nan
+
+    df = pd.DataFrame(prices.round(2), columns=columns)
+    df.insert(0, 'Date', pd.date_range('1900-01-01', periods=n_dates, freq='MS').strftime('%Y-%m-%d'))
+    return df
+
+
+def imdb_movies(scale=1, seed=0):
+    """
+    Synthetic imdb_movies w/ the columns movie_data.py reads; some durations are missing.
+    :param scale: size multiplier, 1 ~ the committed movies_*.csv
+    :param seed: random seed
+    :return:
+      df: DataFrame object
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = MOVIE_ROWS * scale
+    duration = rng.integers(20, 240, n_rows).astype('float64')
+    duration[rng.random(n_rows) < 0.01] = np.nan
+    return pd.DataFrame({
+        'imdb_title_id': [f'tt{i:08d}' for i in range(n_rows)],
+        'title': [f'Movie {i}' for i in range(n_rows)],
+        'year': rng.integers(1906, 2020, n_rows),
+        'genre': rng.choice(GENRES, n_rows),
+        'duration': duration,
+        'avg_vote': rng.uniform(1, 10, n_rows).round(1),
+    })
+
+
+def write_sqlite(path, table, df):
+    """
+    Store a generated table in a SQLite file, the MySql stand-in of stand_ins.SQLiteConnection.
+    :param path: .db file, replaced if it exists
+    :param table: table name
+    :param df: DataFrame object
+    :return:
+      path: the .db file
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as db:
+        df.to_sql(table, db, index=False)
+    return path
+
+
+def xetra_files(output_dir, scale=1, seed=0):
+    """
+    Synthetic Xetra trade files, '<date>/<date>_BINS_XETR<hour>.csv' like the deutsche-boerse bucket: one
+    row per ISIN and minute traded, in no particular order.
+    :param output_dir: directory the files are written to
+    :param scale: size multiplier (days of files)
+    :param seed: random seed
+    :return:
+      dates: list of generated dates, 'YYYY-MM-DD'
+      rows: number of trade rows generated
+    """
+    rng = np.random.default_rng(seed)
+    isins = np.array([f'DE{i:010d}' for i in range(XETRA_ROWS_PER_FILE // 4)])
+    dates = [d.strftime('%Y-%m-%d') for d in pd.date_range('2022-01-03', periods=XETRA_DAYS * scale, freq='B')]
+
+    rows = 0
+    for date in dates:
+        os.makedirs(os.path.join(output_dir, date), exist_ok=True)
+        for hour in range(8, 8 + XETRA_FILES_PER_DAY):
+            minutes = rng.choice(isins.size * 60, XETRA_ROWS_PER_FILE, replace=False)
+            prices = rng.uniform(1, 100, (XETRA_ROWS_PER_FILE, 4)).round(2)
+            df = pd.DataFrame({'ISIN': isins[minutes // 60], 'Mnemonic': 'XX', 'SecurityDesc': 'STOCK',
+                               'SecurityType': 'Common stock', 'Currency': 'EUR', 'SecurityID': minutes // 60,
+                               'Date': date, 'Time': [f'{hour:02d}:{m % 60:02d}' for m in minutes],
+                               'StartPrice': prices[:, 0], 'MaxPrice': prices[:, 1],
+                               'MinPrice': prices[:, 2], 'EndPrice': prices[:, 3],
+                               'NumberOfTrades': rng.integers(1, 50, XETRA_ROWS_PER_FILE),
+                               'TradedVolume': rng.integers(0, 10000, XETRA_ROWS_PER_FILE)})
+            df.to_csv(os.path.join(output_dir, date, f'{date}_BINS_XETR{hour:02d}.csv'), index=False)
+            rows += len(df)
+    return dates, rows
+
+
+def stock_prices(path, scale=1, seed=0):
+    """
+    Synthetic daily stock prices in one csv file, the columns of 'stock prices.csv': one row per symbol and business
+    day, a fifth of the symbols listed part way through, ~0.1% empty cells.
+    :param path: csv file written
+    :param scale: size multiplier (symbols)
+    :param seed: random seed
+    :return:
+      rows: number of price rows generated
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(STOCK_START, STOCK_END)
+    n_symbols = STOCK_SYMBOLS * scale
+    listed = np.where(np.arange(n_symbols) % 5 == 0, rng.integers(0, days.size, n_symbols), 0)
+    day = np.tile(np.arange(days.size), n_symbols)
+    symbol = np.repeat(np.arange(n_symbols), days.size)
+    keep = day >= listed[symbol]
+    n_rows = int(keep.sum())
+
+    prices = rng.uniform(1, 500, (n_rows, 4)).round(2)
+    prices[rng.random(prices.shape) < 0.00025] = np.nan
+    df = pd.DataFrame({'date': days[day[keep]].strftime('%Y-%m-%d'),
+                       'symbol': np.array([f'SYM{i:04d}' for i in range(n_symbols)])[symbol[keep]],
+                       'open': prices[:, 0], 'close': prices[:, 1], 'low': prices[:, 2], 'high': prices[:, 3],
+                       'volume': rng.integers(0, 10 ** 7, n_rows).astype('float64')})
+    df.to_csv(path, index=False)
+    return n_rows
@@ -0,0 +1,323 @@
+# modules
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+FINAL_SCRIPTS_DIR = os.path.join(REPO_DIR, 'MySql_BigQuery_Integrations', 'final_scripts')
+COMMON_DIR = os.path.join(REPO_DIR, 'common')
+XETRA_NOTEBOOK = os.path.join(REPO_DIR, 'Duetsche Bank Trading Report', 'Functional Approach', 'Functional Approach.ipynb')
+STOCK_NOTEBOOK = os.path.join(REPO_DIR, 'Stock Trading Report', 'Functional Approach', 'Stock Trades ETL Job -  v6.2.ipynb')
+
+sys.path.insert(0, COMMON_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+import generators  # noqa: E402
+
+PIPELINES = ['house_price_data', 'movie_data', 'xetra_report1', 'stock_report']
+
+# Scales run by default; 100 is supported but takes minutes and a few GB of RAM for the Xetra files in moto
+DEFAULT_SCALES = [1, 10]
+
+# Stored results a run is compared against, one entry per pipeline and scale
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# Allowed regression before a run fails: rows/s may drop and peak memory may grow by this fraction
+TOLERANCE = 0.3
+
+
+def generate(pipeline, scale, data_dir):
+    """
+    Write the synthetic source data of one benchmark case to disk, so the case's own process only pays for
+    loading it into the stand-in.
+    :param pipeline: one of PIPELINES
+    :param scale: size multiplier
+    :param data_dir: directory for the generated data
+    :return:
+      source: path of the SQLite file (MySql pipelines), the dir of Xetra files or the stock prices csv
+      rows: number of source rows the pipeline reads
+    """
+    if pipeline == 'house_price_data':
+        df = generators.city_house_prices(scale)
+        path = generators.write_sqlite(os.path.join(data_dir, f'house_{scale}.db'), 'city_house_prices', df)
+        return path, int(df.drop(columns='Date').notna().sum().sum())
+    if pipeline == 'movie_data':
+        df = generators.imdb_movies(scale)
+        return generators.write_sqlite(os.path.join(data_dir, f'movies_{scale}.db'), 'imdb_movies', df), len(df)
+    if pipeline == 'stock_report':
+        source = os.path.join(data_dir, f'stock_prices_{scale}.csv')
+        return source, generators.stock_prices(source, scale)
+    source = os.path.join(data_dir, f'xetra_{scale}')
+    _, rows = generators.xetra_files(source, scale)
+    return source, rows
+
+
+def run_house_price_data(source, work_dir):
+    """
+    house_price_data.py's __main__ path, a full (non-delta) run: streamed extract + reshape fanned out to the
+    local Parquet file and BigQuery.
+    """
+    import house_price_data
+    from stand_ins import FakeBigQueryClient, SQLiteConnection
+
+    client = FakeBigQueryClient()
+    house_price_data.mysql_connector = lambda: SQLiteConnection(source)
+    house_price_data.bq_connector = lambda: client
+    os.chdir(work_dir)
+
+    def run():
+        if not house_price_data.load(stream=True):
+            raise RuntimeError("house_price_data load failed")
+        return client.tables[house_price_data.BQ_TABLE]
+    return run
+
+
+def run_movie_data(source, work_dir):
+    """
+    movie_data.py's __main__ path, a full run: partitioned extract to the yearly files, BigQuery load of every file.
+    """
+    import movie_data
+    from stand_ins import FakeBigQueryClient, SQLiteConnection
+
+    client = FakeBigQueryClient()
+    movie_data.mysql_connector = lambda: SQLiteConnection(source)
+    os.makedirs(os.path.join(work_dir, 'final_scripts'))
+    os.chdir(os.path.join(work_dir, 'final_scripts'))
+
+    def run():
+        if not movie_data.load_local_partitioned():
+            raise RuntimeError("movie_data load_local_partitioned failed")
+        if not movie_data.load_bq('../movie_data', 'WRITE_TRUNCATE', client=client):
+            raise RuntimeError("movie_data load_bq failed")
+        return sum(client.tables.values())
+    return run
+
+
+def notebook_namespace(path, stop):
+    """
+    Run a notebook's code cells up to (not including) the first one starting w/ stop.
+    :return:
+      ns: dict of the names the cells defined
+    """
+    with open(path) as f:
+        cells = [''.join(cell['source']) for cell in json.load(f)['cells'] if cell['cell_type'] == 'code']
+    ns = {}
+    for cell in cells:
+        if cell.startswith(stop):
+            break
+        exec(compile(cell, path, 'exec'), ns)
+    return ns
+
+
+def run_xetra_report1(source, work_dir):
+    """
+    The Xetra notebook's etl_report1() against moto S3: source files uploaded to a mocked bucket, report
+    written back as a partitioned Parquet dataset.
+    """
+    import boto3
+    import object_cache
+    import s3_layer
+    from moto import mock_aws
+
+    # Every code cell up to main(): imports, adapter, dataset, aggregation and application layers
+    ns = notebook_namespace(XETRA_NOTEBOOK, '# main function entrypoint')
+    object_cache.CACHE_DIR = os.path.join(work_dir, '.extract_cache')
+    s3_layer.MANIFEST_DIR = os.path.join(work_dir, '.object_manifest')
+
+    mock = mock_aws()
+    mock.start()
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    bucket_src = s3.create_bucket(Bucket='xetra-src')
+    bucket_trg = s3.create_bucket(Bucket='xetra-trg')
+    dates = sorted(os.listdir(source))
+    for date in dates:
+        for file in sorted(os.listdir(os.path.join(source, date))):
+            bucket_src.upload_file(os.path.join(source, date, file), f'{date}/{file}')
+
+    columns = ['ISIN', 'Date', 'Time', 'StartPrice', 'MaxPrice', 'MinPrice', 'EndPrice', 'TradedVolume']
+    dtypes = {'ISIN': 'category', 'Date': 'string[pyarrow]', 'Time': 'string[pyarrow]'}
+
+    def run():
+        ns['etl_report1'](bucket_src, bucket_trg, dates, columns, dates[1], 'xetra_daily_report_', '.parquet', dtypes)
+        report = [obj for obj in bucket_trg.objects.all()]
+        if not any(obj.key.endswith('/_metadata') for obj in report):
+            raise RuntimeError("xetra_report1 wrote no report")
+        return sum(obj.size for obj in report)
+    return run
+
+
+def run_stock_report(source, work_dir):
+    """
+    The stock notebook's (v6.2) etl_report() against moto S3: the prices csv uploaded as one object, read in
+    chunks through the yearly aggregation, report written back as a Year-partitioned Parquet dataset.
+    """
+    import boto3
+    import s3_layer
+    from moto import mock_aws
+
+    ns = notebook_namespace(STOCK_NOTEBOOK, 'def main()')
+    s3_layer.MANIFEST_DIR = os.path.join(work_dir, '.object_manifest')
+
+    mock = mock_aws()
+    mock.start()
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    bucket_src = s3.create_bucket(Bucket='stock-src')
+    s3.create_bucket(Bucket='stock-trg')
+    bucket_src.upload_file(source, 'stock_prices.csv')
+
+    def run():
+        objects = s3_layer.list_prefixes(bucket_src, [''])['']
+        ns['etl_report'](s3, bucket_src, 'stock-trg', objects, {'symbol': 'category'}, ['date'], 100000)
+        report = [obj for obj in s3.Bucket('stock-trg').objects.all()]
+        if not any(obj.key.endswith('/_metadata') for obj in report):
+            raise RuntimeError("stock_report wrote no report")
+        return sum(obj.size for obj in report)
+    return run
+
+
+CASES = {
+    'house_price_data': run_house_price_data,
+    'movie_data': run_movie_data,
+    'xetra_report1': run_xetra_report1,
+    'stock_report': run_stock_report,
+}
+
+
+def rss_mb():
+    # Current resident set size; /proc on Linux, the high-water mark (ru_maxrss, bytes on macOS) elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+class PeakMemory:
+    """
+    Samples the process RSS in a background thread while the with block runs; peak_mb is the highest RSS
+    seen over the RSS at the start.
+    """
+
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self.peak_mb = 0.0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.is_set():
+            self.peak_mb = max(self.peak_mb, rss_mb() - self._start)
+            time.sleep(self.interval_s)
+
+    def __enter__(self):
+        self._start = rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._done.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb() - self._start)
+
+
+def run_case(pipeline, scale, source, rows):
+    """
+    Run one benchmark case. Called in a fresh (spawned) process, so nothing is left over from other cases.
+    :return:
+      result: dict w/ 'pipeline', 'scale', 'rows', 'seconds', 'rows_per_s' and 'peak_mb' (RSS growth while
+        the pipeline ran, on top of the process w/ the source data loaded into its stand-in)
+    """
+    sys.path.insert(0, FINAL_SCRIPTS_DIR)
+    sys.path.insert(0, COMMON_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            run = CASES[pipeline](source, work_dir)
+            with PeakMemory() as memory:
+                start = time.perf_counter()
+                run()
+                seconds = time.perf_counter() - start
+            peak_mb = memory.peak_mb
+        os.chdir(BENCHMARK_DIR)
+
+    return {'pipeline': pipeline, 'scale': scale, 'rows': rows, 'seconds': round(seconds, 3),
+            'rows_per_s': round(rows / seconds), 'peak_mb': round(peak_mb, 1)}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Check results against the baseline.
+    :param results: list of run_case() results
+    :param baseline: dict of '<pipeline>@<scale>' -> stored result
+    :param tolerance: allowed regression, as a fraction
+    :return:
+      regressions: list of messages, empty if nothing regressed
+    """
+    regressions = []
+    for result in results:
+        stored = baseline.get(f"{result['pipeline']}@{result['scale']}")
+        if stored is None:
+            continue
+        if result['rows_per_s'] < stored['rows_per_s'] * (1 - tolerance):
+            regressions.append(f"{result['pipeline']}@{result['scale']}: {result['rows_per_s']} rows/s "
+                               f"vs {stored['rows_per_s']} in the baseline")
+        # Small absolute growth (allocator noise) is never a regression
+        if result['peak_mb'] > max(stored['peak_mb'] * (1 + tolerance), stored['peak_mb'] + 20):
+            regressions.append(f"{result['pipeline']}@{result['scale']}: peak {result['peak_mb']} MB "
+                               f"vs {stored['peak_mb']} MB in the baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput / memory benchmarks of the pipelines on synthetic data.")
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=PIPELINES)
+    parser.add_argument('--scales', nargs='+', type=int, default=DEFAULT_SCALES)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true', help="store this run's results as the baseline")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        # One fresh process per case: no warm caches or memory high-water marks carried over between cases
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'), max_tasks_per_child=1) as executor:
+            for pipeline in args.pipelines:
+                for scale in args.scales:
+                    source, rows = generate(pipeline, scale, data_dir)
+                    result = executor.submit(run_case, pipeline, scale, source, rows).result()
+                    results.append(result)
+                    print(f"{pipeline:<18} {scale:>4}x {result['rows']:>10} rows {result['seconds']:>9.3f} s "
+                          f"{result['rows_per_s']:>10} rows/s {result['peak_mb']:>8.1f} MB peak")
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({f"{r['pipeline']}@{r['scale']}": r for r in results})
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline updated: {BASELINE_FILE}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
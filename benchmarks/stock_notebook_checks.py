@@ -0,0 +1,249 @@
+# modules
+import argparse
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+from types import SimpleNamespace
+import boto3
+import numpy as np
+import pandas as pd
+from moto import mock_aws
+from run_benchmarks import BENCHMARK_DIR, STOCK_NOTEBOOK, notebook_namespace
+from s3_layer import diff_listing, invalidate_object_manifest, list_prefixes, query_dataset, read_object_manifest
+from xetra_notebook_checks import DiscardingClient, peak_mb
+
+
+class DiscardingS3:
+    """
+    boto3 resource, Bucket and Object in one, sending everything to a DiscardingClient.
+    """
+    name = 'discard'
+    meta = SimpleNamespace(client=DiscardingClient())
+
+    def Bucket(self, name):
+        return self
+
+    def Object(self, bucket, key):
+        return self
+
+    def put(self, **kwargs):
+        return {}
+
+    def put_object(self, **kwargs):
+        return {}
+
+
+def daily_prices(symbols, days, seed):
+    """
+    prices.csv-shaped frame, one row per symbol and business day.
+    :return:
+      df: DataFrame object w/ 'symbol', 'date', 'open', 'close', 'low', 'high' and 'volume'
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'symbol': pd.Categorical(np.tile(symbols, len(days))), 'date': np.repeat(days, len(symbols))})
+    for column in ['open', 'close', 'low', 'high']:
+        df[column] = rng.uniform(1, 500, len(df))
+    df['volume'] = rng.integers(0, 10 ** 7, len(df)).astype('float64')
+    return df
+
+
+def check_multipart_upload(nb):
+    """
+    load() (Year files streamed into multipart uploads) vs the previous buffered CSV put of the whole report: peak
+    memory, requests sent and the same rows back.
+    """
+    # Report-shaped frame w/ Year files big enough for several parts
+    rng = np.random.default_rng(0)
+    upload_rows = 1_200_000
+    df_upload = pd.DataFrame({'symbol': rng.choice([f'SYM{i}' for i in range(500)], upload_rows),
+                              'Year': rng.choice(['2014', '2015', '2016', '2017'], upload_rows),
+                              'opening_price': rng.uniform(1, 500, upload_rows).round(2),
+                              'closing_price': rng.uniform(1, 500, upload_rows).round(2),
+                              'minimum_price': rng.uniform(1, 500, upload_rows).round(2),
+                              'maximum_price': rng.uniform(1, 500, upload_rows).round(2),
+                              'daily_traded_volume': rng.integers(0, 10 ** 9, upload_rows)})
+
+    def write_buffered(s3, bucket_trg, df):
+        # Previous write path: whole CSV in a StringIO, copied by getvalue(), encoded again by the request
+        csv_buffer = StringIO()
+        df.to_csv(csv_buffer)
+        s3.Object(bucket_trg, 'stock_data_cleansed.csv').put(Body=csv_buffer.getvalue())
+        return True
+
+    buffered_python, buffered_arrow = peak_mb(write_buffered, DiscardingS3(), 'discard', df_upload)
+    streamed_python, streamed_arrow = peak_mb(nb.load, DiscardingS3(), 'discard', df_upload)
+
+    with mock_aws():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        bucket = s3.create_bucket(Bucket='stock-upload')
+        upload_requests = []
+        s3.meta.client.meta.events.register(
+            'before-send.s3', lambda **kwargs: upload_requests.append(kwargs['event_name'].split('.')[-1]))
+
+        nb.load(s3, 'stock-upload', df_upload)
+        streamed_requests = pd.Series(upload_requests).value_counts().to_dict()
+        dataset_mb = sum(obj.size for obj in bucket.objects.all()) / 1024 ** 2
+
+        # Same rows back as were written
+        prefix = [obj.key for obj in bucket.objects.all()][0].split('/')[0] + '/'
+        key_order = lambda df: df.loc[:, list(df_upload.columns)].sort_values(by=list(df_upload.columns), ignore_index=True)
+        pd.testing.assert_frame_equal(key_order(query_dataset(bucket, prefix)), key_order(df_upload))
+
+    print(f'{upload_rows} rows, {dataset_mb:.1f} MB of Parquet, requests: {streamed_requests}')
+    return pd.DataFrame([{'run': 'buffered csv put', 'python_mb': buffered_python, 'arrow_mb': buffered_arrow},
+                         {'run': 'load(), streamed multipart', 'python_mb': streamed_python, 'arrow_mb': streamed_arrow}]).set_index('run')
+
+
+def check_object_manifest(nb):
+    """
+    list_prefixes() over the whole source bucket (no date prefixes), cold and then w/ the manifest and objects
+    added, re-uploaded and removed since: list requests and what diff_listing() tells apart.
+    """
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='stock-list')
+        for part in range(200):
+            bucket.put_object(Body=b'', Key=f'stock_prices_{part:04d}.csv')
+
+        list_requests = []
+        bucket.meta.client.meta.events.register('before-send.s3.ListObjectsV2',
+                                                lambda **kwargs: list_requests.append(kwargs['request'].url))
+
+        invalidate_object_manifest()
+        cold = list_prefixes(bucket, [''])['']
+        cold_requests = len(list_requests)
+
+        # Next run: a key sorting before the last one, a key after it, a re-uploaded and a removed object
+        list_requests.clear()
+        bucket.put_object(Body=b'', Key='stock_prices_0099_late.csv')
+        bucket.put_object(Body=b'', Key='stock_prices_0200.csv')
+        bucket.put_object(Body=b'revised', Key='stock_prices_0042.csv')
+        bucket.Object('stock_prices_0007.csv').delete()
+        cached = read_object_manifest('stock-list')['']['objects']
+        warm = list_prefixes(bucket, [''])['']
+        added, changed, removed = diff_listing(cached, warm)
+        truth = [obj.key for obj in bucket.objects.all()]
+
+    assert [obj['key'] for obj in warm] == truth
+    return pd.DataFrame([{'run': 'cold', 'keys': len(cold), 'list_requests': cold_requests},
+                         {'run': 'full listing + diff', 'keys': len(warm), 'list_requests': len(list_requests),
+                          'new': len(added), 're-uploaded': len(changed), 'removed': len(removed)}]).set_index('run')
+
+
+def check_query_report(nb):
+    """
+    query_report() on a report written by load(): rows of one year and two symbols, GETs and bytes fetched.
+    """
+    # Daily prices of 2000 symbols over the four report years, run through transformations() and load()
+    symbols = [f'SYM{i:04d}' for i in range(2000)]
+    df_yearly = nb.transformations(daily_prices(symbols, pd.bdate_range('2014-01-01', '2017-12-31'), seed=1))
+
+    with mock_aws():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        bucket = s3.create_bucket(Bucket='stock-query')
+        nb.load(s3, 'stock-query', df_yearly)
+        prefix = [obj.key for obj in bucket.objects.all()][0].split('/')[0] + '/'
+
+        get_bytes = []
+        bucket.meta.client.meta.events.register(
+            'after-call.s3.GetObject', lambda http_response, **kwargs: get_bytes.append(int(http_response.headers['Content-Length'])))
+        df_lookup = nb.query_report(bucket, prefix, ['symbol', 'Year', 'closing_price'], years=[2016],
+                                    symbols=['SYM0042', 'SYM1999'])
+        dataset_mb = sum(obj.size for obj in bucket.objects.all()) / 1024 ** 2
+
+    expected = df_yearly[df_yearly.symbol.isin(['SYM0042', 'SYM1999']) & (df_yearly.Year == 2016)]
+    assert sorted(df_lookup.closing_price) == sorted(expected.closing_price)
+    print(f'{len(df_lookup)} rows, {len(get_bytes)} GETs, {sum(get_bytes) / 1024 ** 2:.2f} of {dataset_mb:.2f} MB fetched')
+    return df_lookup
+
+
+def check_yearly_aggregation(nb):
+    """
+    transformations() grouping by the calendar year vs the previous positional Year (2014-2017 written over the
+    grouped rows four at a time), on prices over 2010-2016 w/ symbols listed part way through.
+    """
+    def transformations_positional(df):
+        # Previous transformations()
+        df.dropna(inplace=True)
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.groupby(['symbol', df['date'].dt.year], as_index=False, observed=True).agg(
+            opening_price=('open', 'min'), closing_price=('close', 'min'), minimum_price=('low', 'min'),
+            maximum_price=('high', 'max'), daily_traded_volume=('volume', 'sum'), avg_opening_price=('open', 'mean'),
+            avg_closing_price=('close', 'mean'), avg_minimum_price=('low', 'mean'), avg_maximum_price=('high', 'mean'),
+            avg_daily_traded_volume=('volume', 'mean'))
+        df['$_change_closing_price'] = df['closing_price'] - df['opening_price']
+        df['%_change_closing_price'] = (df['$_change_closing_price']/df['closing_price'])*100
+        df = df.round(decimals=2)
+        df['Year'] = ''
+        df.loc[df.index[range(0, len(df), 4)], 'Year'] = "2014"
+        df.loc[df.index[range(1, len(df), 4)], 'Year'] = "2015"
+        df.loc[df.index[range(2, len(df), 4)], 'Year'] = "2016"
+        df.loc[df.index[range(3, len(df), 4)], 'Year'] = "2017"
+        cols = list(df.columns.values)
+        cols.insert(1, cols.pop(cols.index('Year')))
+        return df.loc[:, cols]
+
+    # prices.csv-shaped input: 500 symbols over 2010-2016, a fifth of them listed part way through, a few empty cells
+    rng = np.random.default_rng(2)
+    days = pd.bdate_range('2010-01-01', '2016-12-31')
+    symbols = [f'SYM{i:03d}' for i in range(500)]
+    listed = np.where(np.arange(len(symbols)) % 5 == 0, rng.integers(0, len(days), len(symbols)), 0)
+    df_span = daily_prices(symbols, days, seed=3)
+    df_span = df_span[np.repeat(np.arange(len(days)), len(symbols)) >= np.tile(listed, len(days))]
+    df_span.loc[df_span.sample(frac=0.001, random_state=0).index, 'close'] = np.nan
+    df_span = df_span.sort_values(by=['symbol', 'date'], kind='stable', ignore_index=True)
+    chunks = [df_span.iloc[start:start + 100_000] for start in range(0, len(df_span), 100_000)]
+
+    runs = []
+
+    def timed(run, func, *args):
+        start = time.perf_counter()
+        df = func(*args)
+        runs.append({'run': run, 'seconds': round(time.perf_counter() - start, 2), 'report rows': len(df)})
+        return df
+
+    df_positional = timed('positional Year, whole frame', transformations_positional, df_span.copy())
+    df_grouped = timed('grouped Year, whole frame', nb.transformations, df_span.copy())
+    df_chunked = timed(f'grouped Year, {len(chunks)} chunks', nb.transformations, iter(chunks))
+
+    # Same report whether chunked or not (averages as sum/rows may differ in the last digit before rounding)
+    pd.testing.assert_frame_equal(df_grouped, df_chunked, atol=0.011)
+    expected_years = df_span.dropna().groupby(['symbol', df_span['date'].dt.year.rename('Year')], observed=True).size()
+    assert list(zip(df_grouped.symbol, df_grouped.Year)) == list(expected_years.index)
+    # Same report columns as before, incl. the grouped year as 'date'
+    assert list(df_grouped.columns) == list(df_positional.columns)
+    assert (df_grouped['date'] == df_grouped['Year']).all()
+    mislabelled = (df_positional['Year'].astype(int) != df_positional['date']).sum()
+    print(f'{len(df_span)} price rows, years {sorted(df_grouped.Year.unique().tolist())}')
+    print(f'positional Year: {mislabelled} of {len(df_positional)} report rows labelled w/ the wrong year')
+    return pd.DataFrame(runs).set_index('run')
+
+
+CHECKS = {
+    'multipart_upload': check_multipart_upload,
+    'object_manifest': check_object_manifest,
+    'query_report': check_query_report,
+    'yearly_aggregation': check_yearly_aggregation,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks of the stock notebook's (v6.2) layers against moto S3.")
+    parser.add_argument('--checks', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    args = parser.parse_args(argv)
+
+    # Every code cell up to main(), run in a scratch directory so the object manifest is too
+    nb = SimpleNamespace(**notebook_namespace(STOCK_NOTEBOOK, 'def main()'))
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        for name in args.checks:
+            print(f'## {name}')
+            print(CHECKS[name](nb).to_string())
+            print()
+        os.chdir(BENCHMARK_DIR)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
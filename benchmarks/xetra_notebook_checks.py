@@ -0,0 +1,442 @@
+# modules
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime as dt
+from datetime import timedelta as td
+from io import BytesIO
+from types import SimpleNamespace
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from moto import mock_aws
+from run_benchmarks import BENCHMARK_DIR, XETRA_NOTEBOOK, notebook_namespace
+from s3_layer import (invalidate_object_manifest, list_prefixes, read_footer, read_summary, summary_files, write_dataset,
+                      write_partition, write_summary)
+
+# moto answers in-process, so a fixed delay per request stands in for the round trip to S3
+S3_LATENCY_S = 0.05
+
+COLUMNS = ['ISIN', 'Date', 'Time', 'StartPrice', 'MaxPrice', 'MinPrice', 'EndPrice', 'TradedVolume']
+DTYPES = {'ISIN': 'category', 'Date': 'string[pyarrow]', 'Time': 'string[pyarrow]'}
+
+
+class DiscardingClient:
+    """
+    S3 client that drops every body. moto keeps every byte it receives in memory, which would swamp the writer's
+    own footprint, so memory is measured against this one.
+    """
+
+    def put_object(self, **kwargs):
+        return {}
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'discard'}
+
+    def upload_part(self, **kwargs):
+        return {'ETag': str(kwargs['PartNumber'])}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {}
+
+
+class DiscardingBucket:
+    name = 'discard'
+    meta = SimpleNamespace(client=DiscardingClient())
+
+    def put_object(self, **kwargs):
+        return self.meta.client.put_object(**kwargs)
+
+
+def peak_mb(func, *args):
+    """
+    Peak of Python allocations (tracemalloc) and of Arrow's allocator (sampled every ms, tracemalloc doesn't see
+    Arrow's memory pool) while func runs.
+    :return:
+      peaks: (python MB, arrow MB)
+    """
+    arrow_start, arrow_peak, done = pa.total_allocated_bytes(), [0], threading.Event()
+
+    def sample():
+        while not done.is_set():
+            arrow_peak[0] = max(arrow_peak[0], pa.total_allocated_bytes() - arrow_start)
+            time.sleep(0.001)
+
+    sampler = threading.Thread(target=sample)
+    tracemalloc.start()
+    mem_start = tracemalloc.get_traced_memory()[0]
+    sampler.start()
+    func(*args)
+    done.set()
+    sampler.join()
+    python_peak = tracemalloc.get_traced_memory()[1] - mem_start
+    tracemalloc.stop()
+    return round(python_peak / 1024 ** 2, 1), round(arrow_peak[0] / 1024 ** 2, 1)
+
+
+def write_streamed(bucket, df, key):
+    """
+    The report as one Parquet object, written the way load() writes every dataset file (write_partition(): row
+    groups converted one at a time, streamed into a multipart upload).
+    """
+    return write_partition(bucket, key, df, pa.Schema.from_pandas(df, preserve_index=False))
+
+
+def put_trades(bucket, dates, hours, trades, seed):
+    """
+    Upload Xetra-style trade files, '<date>/<date>_BINS_XETR<hour>.csv'.
+    :param trades: function (rng, date, hour) -> DataFrame of the trades of one file
+    """
+    rng = np.random.default_rng(seed)
+    for date in dates:
+        for hour in hours:
+            bucket.put_object(Body=trades(rng, date, hour).to_csv(index=False).encode('utf-8'),
+                              Key=f'{date}/{date}_BINS_XETR{hour:02d}.csv')
+
+
+def check_concurrent_extract(nb):
+    """
+    extract() w/ one worker vs concurrently, and the memory of the extract w/ and w/o the dtype plan.
+    """
+    days, files_per_day, rows_per_file = 5, 24, 2000
+    isins = [f'DE{i:010d}' for i in range(300)]
+
+    def trades(rng, date, hour):
+        prices = rng.uniform(1, 100, (rows_per_file, 4)).round(2)
+        return pd.DataFrame({'ISIN': rng.choice(isins, rows_per_file), 'Date': date, 'Time': f'{hour:02d}:00',
+                             'StartPrice': prices[:, 0], 'MaxPrice': prices[:, 1],
+                             'MinPrice': prices[:, 2], 'EndPrice': prices[:, 3],
+                             'TradedVolume': rng.integers(0, 10000, rows_per_file)})
+
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='xetra-bench')
+        dates = [(dt(2022, 12, 1) + td(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+        put_trades(bucket, dates, range(files_per_day), trades, seed=0)
+        bucket.meta.client.meta.events.register('before-send.s3', lambda **kwargs: time.sleep(S3_LATENCY_S))
+
+        # Cold listings for both runs, so only the fetches differ
+        invalidate_object_manifest()
+        start = time.perf_counter()
+        df_serial = nb.extract(bucket, dates, max_workers=1)
+        serial_s = time.perf_counter() - start
+
+        invalidate_object_manifest()
+        start = time.perf_counter()
+        df_concurrent = nb.extract(bucket, dates)
+        concurrent_s = time.perf_counter() - start
+
+        df_planned = nb.extract(bucket, dates, dtypes=DTYPES)
+
+    assert df_serial.equals(df_concurrent)
+    print(f'{days * files_per_day} files, {len(df_concurrent)} rows')
+    print(f'serial:     {serial_s:.2f} s')
+    print(f'concurrent: {concurrent_s:.2f} s ({serial_s / concurrent_s:.1f}x)')
+    return nb.memory_report(df_concurrent, df_planned)
+
+
+def check_streamed_aggregation(nb):
+    """
+    extract_transform_report1() vs extract() + transform_report1(), and a rerun served from the extract cache.
+    """
+    days, files_per_day = 10, 8
+    isins = [f'DE{i:010d}' for i in range(500)]
+    dates = [(dt(2022, 12, 1) + td(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+
+    def trades(rng, date, hour):
+        # One trade row per ISIN and minute traded, like the Xetra files, so opening/closing prices are unambiguous
+        minutes = pd.MultiIndex.from_product([isins, range(60)], names=['ISIN', 'minute']).to_frame(index=False)
+        minutes = minutes[rng.random(len(minutes)) < 0.3]
+        prices = rng.uniform(1, 100, (len(minutes), 4)).round(2)
+        df = pd.DataFrame({'ISIN': minutes['ISIN'].to_numpy(), 'Date': date,
+                           'Time': [f'{hour:02d}:{minute:02d}' for minute in minutes['minute']],
+                           'StartPrice': prices[:, 0], 'MaxPrice': prices[:, 1],
+                           'MinPrice': prices[:, 2], 'EndPrice': prices[:, 3],
+                           'TradedVolume': rng.integers(0, 10000, len(minutes))})
+        return df.sample(frac=1, random_state=hour)  # files aren't sorted by Time
+
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='xetra-agg')
+        put_trades(bucket, dates, range(8, 8 + files_per_day), trades, seed=1)
+
+        invalidate_object_manifest()
+        nb.stage_records.clear()
+        df_in_memory = nb.transform_report1(nb.extract(bucket, dates, columns=COLUMNS, dtypes=DTYPES), COLUMNS, dates[1])
+        df_streamed = nb.extract_transform_report1(bucket, dates, COLUMNS, dates[1], dtypes=DTYPES, use_cache=False)
+
+        # Extract cache: a cold run fills it, a rerun over unchanged objects does no GetObject at all
+        nb.invalidate_cache()
+        nb.extract_transform_report1(bucket, dates, COLUMNS, dates[1], dtypes=DTYPES)
+        get_requests = []
+        bucket.meta.client.meta.events.register('before-send.s3.GetObject', lambda **kwargs: get_requests.append(1))
+        df_cached = nb.extract_transform_report1(bucket, dates, COLUMNS, dates[1], dtypes=DTYPES)
+
+    assert df_in_memory.reset_index(drop=True).equals(df_streamed.reset_index(drop=True))
+    assert df_cached.reset_index(drop=True).equals(df_streamed.reset_index(drop=True))
+    print(f'{days * files_per_day} files, {len(df_streamed)} report rows, '
+          f'{len(get_requests)} GetObject requests on the cached rerun')
+    return pd.DataFrame(nb.stage_records).set_index('stage')[['wall_s', 'cpu_s', 'rss_peak_mb', 'rows_out']]
+
+
+def check_multipart_upload(nb):
+    """
+    Streamed multipart upload vs a buffered put_object: peak memory by report size and requests sent. What the
+    writer does (parts, single put, aborts) is covered by tests/test_s3_layer.py.
+    """
+    upload_rows = 1_500_000
+    rng = np.random.default_rng(2)
+    df_upload = pd.DataFrame({'ISIN': pd.Categorical(rng.choice([f'DE{i:010d}' for i in range(3000)], upload_rows)),
+                              'Date': '2022-12-28',
+                              'opening_price_eur': rng.uniform(1, 100, upload_rows).round(2),
+                              'closing_price_eur': rng.uniform(1, 100, upload_rows).round(2),
+                              'minimum_price_eur': rng.uniform(1, 100, upload_rows).round(2),
+                              'maximum_price_eur': rng.uniform(1, 100, upload_rows).round(2),
+                              'daily_traded_volume': rng.integers(0, 10000, upload_rows),
+                              'change_prev_closing_%': rng.normal(0, 5, upload_rows).round(2)})
+
+    def write_buffered(bucket, df, key):
+        # Previous write path: whole Parquet file in a BytesIO, copied again by getvalue(), one put_object
+        out_buffer = BytesIO()
+        df.to_parquet(out_buffer, index=False)
+        bucket.put_object(Body=out_buffer.getvalue(), Key=key)
+        return True
+
+    # Peak memory by report size: the buffered path grows w/ the file, the streamed one stays at ~ the parts in flight
+    write_buffered(DiscardingBucket(), df_upload.head(1000), 'warmup.parquet')  # lazy imports out of the way
+    upload_peaks = []
+    for df_size in [df_upload.head(upload_rows // 3), df_upload, pd.concat([df_upload] * 3, ignore_index=True)]:
+        buffered_python, buffered_arrow = peak_mb(write_buffered, DiscardingBucket(), df_size, 'buffered.parquet')
+        streamed_python, streamed_arrow = peak_mb(write_streamed, DiscardingBucket(), df_size, 'streamed.parquet')
+        upload_peaks.append({'rows': len(df_size), 'buffered_python_mb': buffered_python, 'buffered_arrow_mb': buffered_arrow,
+                             'streamed_python_mb': streamed_python, 'streamed_arrow_mb': streamed_arrow})
+
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='xetra-upload')
+        upload_requests = []
+        bucket.meta.client.meta.events.register(
+            'before-send.s3', lambda **kwargs: upload_requests.append(kwargs['event_name'].split('.')[-1]))
+
+        write_streamed(bucket, df_upload, 'streamed.parquet')
+        streamed_requests = pd.Series(upload_requests).value_counts().to_dict()
+        streamed_mb = bucket.Object('streamed.parquet').content_length / 1024 ** 2
+
+    print(f'{upload_rows} rows, {streamed_mb:.1f} MB of Parquet, requests: {streamed_requests}')
+    return pd.DataFrame(upload_peaks).set_index('rows')
+
+
+def check_incremental_report(nb):
+    """
+    etl_report1_incremental() over three runs (five days, then the two that came in since, then nothing new):
+    prefixes listed and objects downloaded by each, and the same report as a full run.
+    """
+    # Seven calendar days of trades, none on the fourth (a holiday)
+    isins = [f'DE{i:010d}' for i in range(200)]
+    dates = [(dt(2022, 12, 1) + td(days=d)).strftime('%Y-%m-%d') for d in range(7)]
+
+    def trades(rng, date, hour):
+        minutes = rng.choice(len(isins) * 60, 3000, replace=False)
+        prices = rng.uniform(1, 100, (len(minutes), 4)).round(2)
+        return pd.DataFrame({'ISIN': np.array(isins)[minutes // 60], 'Date': date,
+                             'Time': [f'{hour:02d}:{m % 60:02d}' for m in minutes],
+                             'StartPrice': prices[:, 0], 'MaxPrice': prices[:, 1],
+                             'MinPrice': prices[:, 2], 'EndPrice': prices[:, 3],
+                             'TradedVolume': rng.integers(0, 10000, len(minutes))})
+
+    with mock_aws():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        bucket_src = s3.create_bucket(Bucket='xetra-inc-src')
+        bucket_trg = s3.create_bucket(Bucket='xetra-inc-trg')
+        put_trades(bucket_src, dates[:3] + dates[4:], range(8, 12), trades, seed=3)
+
+        # Source prefixes listed and objects downloaded by each run
+        listed, downloaded = [], []
+
+        def count_request(params, **kwargs):
+            if params['Bucket'] == 'xetra-inc-src':
+                (listed if 'Prefix' in params else downloaded).append(params.get('Prefix', params.get('Key')))
+        bucket_src.meta.client.meta.events.register('provide-client-params.s3.ListObjectsV2', count_request)
+        bucket_src.meta.client.meta.events.register('provide-client-params.s3.GetObject', count_request)
+
+        nb.invalidate_cache()
+        invalidate_object_manifest()
+        runs = []
+        for run_dates in [dates[:5], dates, dates]:
+            listed.clear(), downloaded.clear()
+            nb.etl_report1_incremental(bucket_src, bucket_trg, run_dates, COLUMNS, dates[1], 'xetra_daily_report/',
+                                       '.parquet', DTYPES)
+            runs.append({'days': len(run_dates), 'prefixes_listed': sorted(listed), 'objects_downloaded': len(downloaded)})
+
+        manifest = nb.read_manifest(bucket_trg, 'xetra_daily_report/' + nb.manifest_name)
+        # The files _metadata lists are all the part files there are, and read back (w/ the partition values from
+        # their paths) they are the whole report
+        report_files = summary_files(read_summary(bucket_trg, 'xetra_daily_report/_metadata'))
+        assert sorted(report_files) == sorted(obj.key[len('xetra_daily_report/'):]
+                                              for obj in bucket_trg.objects.filter(Prefix='xetra_daily_report/Date='))
+        df_incremental = pd.concat([pd.read_parquet(BytesIO(bucket_trg.Object('xetra_daily_report/' + path).get()['Body'].read()))
+                                      .assign(**dict(part.split('=') for part in path.split('/')[:-1]))
+                                    for path in report_files], ignore_index=True)
+
+        # The manifest's row count of each day is the rows of the day's files
+        file_rows = {date: sum(read_footer(bucket_trg, 'xetra_daily_report/' + path).num_rows for path in entry['files'])
+                     for date, entry in manifest.items()}
+
+        # Same report as a full run over all the days
+        df_full = nb.extract_transform_report1(bucket_src, dates, COLUMNS, dates[1], dtypes=DTYPES, use_cache=False)
+
+    df_incremental = df_incremental[df_full.columns].sort_values(by=nb.report1_keys, ignore_index=True)
+    assert df_incremental.equals(df_full.reset_index(drop=True))
+    assert manifest[dates[3]] == {'rows': 0, 'files': []}
+    assert {date: entry['rows'] for date, entry in manifest.items()} == file_rows
+    assert sum(file_rows.values()) == len(df_full)
+    print(f'{len(report_files)} partition files, e.g. {report_files[0]}')
+    return pd.DataFrame(runs)
+
+
+def check_prefix_listing(nb):
+    """
+    Listing a quarter of daily prefixes: one filter() per date vs list_prefixes() cold, then w/ the object manifest
+    and one more file on the last (still trading) day.
+    """
+    days, files_per_day = 90, 24
+    dates = [(dt(2022, 9, 1) + td(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+    open_day = lambda prefix: prefix != dates[-1]
+    new_key = f'{dates[-1]}/{dates[-1]}_BINS_XETR{files_per_day:02d}.csv'
+
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='xetra-list')
+        for date in dates:
+            for hour in range(files_per_day):
+                bucket.put_object(Body=b'', Key=f'{date}/{date}_BINS_XETR{hour:02d}.csv')
+
+        list_requests = []
+
+        def count_list(**kwargs):
+            list_requests.append(1)
+            time.sleep(S3_LATENCY_S)
+        bucket.meta.client.meta.events.register('before-send.s3.ListObjectsV2', count_list)
+        bucket.meta.client.meta.events.register('before-send.s3.ListObjects', count_list)
+
+        runs = []
+
+        def timed_listing(run, func):
+            list_requests.clear()
+            start = time.perf_counter()
+            keys = func()
+            runs.append({'run': run, 'seconds': round(time.perf_counter() - start, 2),
+                         'list_requests': len(list_requests), 'keys': len(keys)})
+            return keys
+
+        # Previous listing: one filter() per date, one after the other
+        serial_keys = timed_listing('serial, per date',
+                                    lambda: [obj.key for date in dates for obj in bucket.objects.filter(Prefix=date)])
+        invalidate_object_manifest()
+        listed = lambda: [obj['key'] for objects in list_prefixes(bucket, dates, final=open_day).values() for obj in objects]
+        concurrent_keys = timed_listing('concurrent, cold manifest', listed)
+        bucket.put_object(Body=b'', Key=new_key)
+        timed_listing('manifest, 1 open day', listed)
+
+    assert concurrent_keys == serial_keys
+    return pd.DataFrame(runs).set_index('run')
+
+
+def check_query_dataset(nb):
+    """
+    query_report1() on half a year of daily reports w/ ranged GETs vs downloading the report as one object and
+    filtering it: GETs, bytes fetched and time.
+    """
+    days = 120
+    isins = [f'DE{i:010d}' for i in range(3000)]
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range('2022-07-01', periods=days)]
+    rng = np.random.default_rng(4)
+    df_history = pd.DataFrame({'ISIN': np.tile(isins, days), 'Date': np.repeat(dates, len(isins))})
+    for column in ['opening_price_eur', 'closing_price_eur', 'minimum_price_eur', 'maximum_price_eru']:
+        df_history[column] = rng.uniform(1, 100, len(df_history)).round(2)
+    df_history['daily_traded_volume'] = rng.integers(0, 10 ** 6, len(df_history))
+    df_history['%_change_closing_price'] = rng.normal(0, 5, len(df_history)).round(2)
+
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='xetra-query')
+        files = write_dataset(bucket, nb.partition_report1(df_history), 'history/', nb.report1_partition_cols, sort_by='ISIN')
+        write_summary(bucket, 'history/_metadata', files.values())
+        # The report as the single object load() used to write
+        write_streamed(bucket, df_history, 'xetra_daily_report_history.parquet')
+
+        # Every GET pays a round trip, and the bytes it returns are counted
+        get_bytes = []
+
+        def count_get(http_response, **kwargs):
+            get_bytes.append(int(http_response.headers.get('Content-Length', 0)))
+        bucket.meta.client.meta.events.register('before-send.s3.GetObject', lambda **kwargs: time.sleep(S3_LATENCY_S))
+        bucket.meta.client.meta.events.register('after-call.s3.GetObject', count_get)
+
+        runs = []
+
+        def timed_query(run, func):
+            get_bytes.clear()
+            start = time.perf_counter()
+            df = func()
+            runs.append({'run': run, 'seconds': round(time.perf_counter() - start, 2), 'gets': len(get_bytes),
+                         'mb_fetched': round(sum(get_bytes) / 1024 ** 2, 2), 'rows': len(df)})
+            return df
+
+        lookup_isins = ['DE0000000042', 'DE0000002718']
+        lookup_columns = ['ISIN', 'Date', 'closing_price_eur']
+        week = (dates[50], dates[54])
+
+        # Previous inspection: the whole object, then filter
+        def download_and_filter():
+            df = pd.read_parquet(BytesIO(bucket.Object('xetra_daily_report_history.parquet').get()['Body'].read()))
+            return df[df.ISIN.isin(lookup_isins) & df.Date.between(*week)][lookup_columns]
+        df_downloaded = timed_query('download + filter, 1 week x 2 ISINs', download_and_filter)
+        df_week = timed_query('query, 1 week x 2 ISINs',
+                              lambda: nb.query_report1(bucket, 'history/', lookup_columns, *week, isins=lookup_isins))
+        df_day = timed_query('query, 1 day, all ISINs',
+                             lambda: nb.query_report1(bucket, 'history/', lookup_columns, dates[50], dates[50]))
+        df_isin = timed_query('query, all days x 1 ISIN',
+                              lambda: nb.query_report1(bucket, 'history/', lookup_columns, isins=lookup_isins[:1]))
+
+        # W/o the _metadata summary (e.g. a load that failed before writing it) the file footers are read instead
+        bucket.Object('history/_metadata').delete()
+        timed_query('query w/o _metadata, 1 week x 2 ISINs',
+                    lambda: nb.query_report1(bucket, 'history/', lookup_columns, *week, isins=lookup_isins))
+
+    key_order = lambda df: df.sort_values(by=nb.report1_keys, ignore_index=True)
+    assert key_order(df_week).equals(key_order(df_downloaded.astype({'Date': str})))
+    assert len(df_day) == len(isins) and len(df_isin) == days
+    print(f'{len(df_history)} report rows, {len(files)} partition files')
+    return pd.DataFrame(runs).set_index('run')
+
+
+CHECKS = {
+    'concurrent_extract': check_concurrent_extract,
+    'streamed_aggregation': check_streamed_aggregation,
+    'multipart_upload': check_multipart_upload,
+    'incremental_report': check_incremental_report,
+    'prefix_listing': check_prefix_listing,
+    'query_dataset': check_query_dataset,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks of the Xetra notebook's layers against moto S3.")
+    parser.add_argument('--checks', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    args = parser.parse_args(argv)
+
+    # Every code cell up to main(), run in a scratch directory so the extract cache and object manifest are too
+    nb = SimpleNamespace(**notebook_namespace(XETRA_NOTEBOOK, '# main function entrypoint'))
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        for name in args.checks:
+            print(f'## {name}')
+            print(CHECKS[name](nb).to_string())
+            print()
+        os.chdir(BENCHMARK_DIR)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# modules
+import hashlib
+import json
+import os
+import pandas as pd
+
+# Directory of cached frames (e.g. the partial aggregates of every source object), resolved against the working dir
+CACHE_DIR = '.extract_cache'
+
+# Size limit of CACHE_DIR; least recently used entries are evicted past it, see evict_cache()
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(*parts):
+    """
+    Key of a cached frame: what was read (e.g. object key + ETag/LastModified) and how (columns, dtypes, step).
+    :param parts: anything w/ a stable str()
+    :return:
+      key: hex digest
+    """
+    return hashlib.sha256(json.dumps([str(part) for part in parts]).encode('utf-8')).hexdigest()
+
+
+def cache_path(key):
+    """
+    File of a cached frame.
+    :param key: cache key
+    :return:
+      path: .parquet file in CACHE_DIR
+    """
+    return os.path.join(CACHE_DIR, key + '.parquet')
+
+
+def read_cached(key):
+    """
+    Read a cached frame. A hit marks the entry as recently used.
+    :param key: cache key
+    :return:
+      df: DataFrame object, or None on a miss
+    """
+    path = cache_path(key)
+    try:
+        df = pd.read_parquet(path)
+    except (FileNotFoundError, OSError):
+        return None
+    try:
+        os.utime(path)  # mtime = last use, for LRU eviction
+    except FileNotFoundError:
+        pass  # evicted by another thread since
+    return df
+
+
+def write_cached(key, df):
+    """
+    Store a frame (dtypes incl.).
+    :param key: cache key
+    :param df: DataFrame object
+    :return:
+      path: cached file
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(key)
+    df.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def evict_cache(max_bytes=None):
+    """
+    Remove least recently used entries until the cache fits in max_bytes. Entries removed by another thread or
+    process (evicting at the same time) in the meantime are skipped.
+    :param max_bytes: size limit, defaults to CACHE_MAX_BYTES
+    :return:
+      removed: list of removed files
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for file in os.listdir(CACHE_DIR):
+        if file.endswith('.parquet'):
+            path = os.path.join(CACHE_DIR, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(path)
+    return removed
+
+
+def invalidate_cache():
+    """
+    Drop every cached frame.
+    :return:
+      n: number of entries removed
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    removed = 0
+    for file in os.listdir(CACHE_DIR):
+        try:
+            os.remove(os.path.join(CACHE_DIR, file))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
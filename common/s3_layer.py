@@ -0,0 +1,541 @@
+# modules
+import copy
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+# Multipart uploads: S3 parts must be >= 5 MiB (but the last one); about PART_SIZE * (MAX_PARTS_IN_FLIGHT + 1)
+# bytes of output are held in memory at any time, however big the file
+PART_SIZE = 8 * 1024 ** 2
+MAX_PARTS_IN_FLIGHT = 4
+
+# Where the cached listings of the source buckets are kept, see list_prefixes()
+MANIFEST_DIR = '.object_manifest'
+# Final prefixes are listed again (in full) once their listing is older than this, which picks up objects
+# re-uploaded under them w/ their new ETag/LastModified
+FINAL_MAX_AGE_S = 24 * 3600
+
+# Rows per Parquet row group of a dataset file, see write_dataset()
+ROWS_PER_GROUP = 10000
+
+
+def read_csv_to_df(bucket, key, decoding='utf-8', sep=',', usecols=None, dtype=None, parse_dates=None, chunksize=None):
+    """
+    Parse a csv object straight from the response byte stream, no decoded string copy of the object. Goes
+    through the (thread-safe) client so it can be called from worker threads.
+    :param bucket: boto3 Bucket
+    :param key: object key
+    :param decoding: text encoding of the object
+    :param sep: field delimiter
+    :param usecols: columns to keep; the others are never materialised
+    :param dtype: dtype plan applied by the parser, so default (object) dtypes never take up memory
+    :param parse_dates: columns parsed as datetimes by the parser
+    :param chunksize: w/ a chunksize, frames of that many rows are read off the stream as they are consumed
+    :return:
+      df: DataFrame object, or an iterator of DataFrames w/ a chunksize
+    """
+    body = bucket.meta.client.get_object(Bucket=bucket.name, Key=key)['Body']
+    return pd.read_csv(body, delimiter=sep, encoding=decoding, usecols=usecols, dtype=dtype, parse_dates=parse_dates,
+                       chunksize=chunksize)
+
+
+def concat_frames(frames):
+    """
+    Concat frames w/o losing categoricals: pd.concat turns categoricals w/ different categories (one per file)
+    back into object columns, so every frame gets the (sorted) union of the categories first.
+    :param frames: iterable of DataFrames w/ the same columns
+    :return:
+      df: DataFrame object
+    """
+    frames = list(frames)
+    for column in frames[0].select_dtypes('category').columns:
+        categories = union_categoricals([df[column] for df in frames], sort_categories=True).categories
+        for df in frames:
+            df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Binary file object that streams what is written to it into an S3 multipart upload: every part_size bytes
+    become a part, uploaded in a worker thread while the writer carries on. Output that fits in one part is
+    sent w/ a single put_object on close(). Leaving a with block on an exception aborts the upload.
+    """
+
+    def __init__(self, bucket, key, part_size=None, max_in_flight=None):
+        max_in_flight = MAX_PARTS_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.client = bucket.meta.client
+        self.bucket_name = bucket.name
+        self.key = key
+        self.part_size = PART_SIZE if part_size is None else part_size
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        # Blocks write() while max_in_flight parts are uploading, which bounds the memory held in parts
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            with memoryview(self.buffer) as view:
+                part = bytes(view[:self.part_size])  # single copy of the part, handed to the upload thread
+            del self.buffer[:self.part_size]
+            self.upload_part(part)
+        return len(data)
+
+    def upload_part(self, body):
+        # Stop writing as soon as a part has failed, instead of finding out on close()
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self.key)['UploadId']
+        self.slots.acquire()
+        self.futures.append(self.executor.submit(self.send_part, len(self.futures) + 1, body))
+
+    def send_part(self, part_number, body):
+        try:
+            response = self.client.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                               PartNumber=part_number, Body=body)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self.slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self.upload_part(bytes(self.buffer))
+                parts = [future.result() for future in self.futures]
+                self.client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                                      UploadId=self.upload_id, MultipartUpload={'Parts': parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.buffer = bytearray()
+            self.executor.shutdown()
+            super().close()
+
+    def abort(self):
+        """
+        Drop the parts uploaded so far, nothing is written to the key.
+        """
+        for future in self.futures:
+            future.cancel()
+        # Wait for the parts in flight first: a part that completes after the abort is stored (and billed) anyway
+        self.executor.shutdown()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an S3 object that fetches only what is read: every read() is a ranged
+    GET of just those bytes. The tail (where a Parquet footer is) comes w/ the first request, which also gives
+    the size.
+    """
+
+    def __init__(self, bucket, key, tail_bytes=64 * 1024):
+        self.client = bucket.meta.client
+        self.bucket_name = bucket.name
+        self.key = key
+        self.position = 0
+        response = self.client.get_object(Bucket=self.bucket_name, Key=key, Range=f'bytes=-{tail_bytes}')
+        self.size = int(response['ContentRange'].split('/')[-1])
+        self.tail = response['Body'].read()
+        self.tail_start = self.size - len(self.tail)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+        if self.position >= self.tail_start:
+            data = self.tail[self.position - self.tail_start:end - self.tail_start]
+        else:
+            data = self.client.get_object(Bucket=self.bucket_name, Key=self.key,
+                                          Range=f'bytes={self.position}-{end - 1}')['Body'].read()
+        self.position = end
+        return data
+
+
+def list_prefix(client, bucket_name, prefix, start_after=''):
+    """
+    List the objects under a prefix.
+    :param client: boto3 S3 client
+    :param bucket_name: bucket to list
+    :param prefix: key prefix, '' for the whole bucket
+    :param start_after: only the keys after this one are listed
+    :return:
+      entries: list of {'key', 'size', 'etag', 'last_modified'} dicts, in key order
+    """
+    entries = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix, StartAfter=start_after):
+        entries += [{'key': obj['Key'], 'size': obj['Size'], 'etag': obj['ETag'], 'last_modified': obj['LastModified'].isoformat()}
+                    for obj in page.get('Contents', [])]
+    return entries
+
+
+def diff_listing(cached, listed):
+    """
+    Compare two listings of a prefix by key, ETag and LastModified.
+    :param cached: entries of the earlier listing (see list_prefix())
+    :param listed: entries of the later listing
+    :return:
+      added: entries of listed whose key isn't in cached
+      changed: entries of listed whose key is in cached w/ another ETag or LastModified (re-uploaded)
+      removed: entries of cached whose key isn't in listed
+    """
+    before = {entry['key']: entry for entry in cached}
+    after = {entry['key'] for entry in listed}
+    added = [entry for entry in listed if entry['key'] not in before]
+    changed = [entry for entry in listed if entry['key'] in before
+               and (entry['etag'], entry['last_modified']) != (before[entry['key']]['etag'], before[entry['key']]['last_modified'])]
+    removed = [entry for entry in cached if entry['key'] not in after]
+    return added, changed, removed
+
+
+def read_object_manifest(bucket_name):
+    """
+    Cached listings of a bucket.
+    :param bucket_name: bucket the listings are of
+    :return:
+      manifest: dict of prefix -> {'objects': [entries], 'final': bool, 'listed_at': epoch seconds}; {} if there
+        are none
+    """
+    try:
+        with open(os.path.join(MANIFEST_DIR, bucket_name + '.json')) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_object_manifest(bucket_name, manifest):
+    """
+    Replace the cached listings of a bucket (written to a temp file first, so a reader never sees half of it).
+    :param bucket_name: bucket the listings are of
+    :param manifest: dict as returned by read_object_manifest()
+    :return:
+      True
+    """
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = os.path.join(MANIFEST_DIR, bucket_name + '.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def invalidate_object_manifest():
+    """
+    Drop every cached listing.
+    :return:
+      True
+    """
+    if os.path.isdir(MANIFEST_DIR):
+        for file in os.listdir(MANIFEST_DIR):
+            os.remove(os.path.join(MANIFEST_DIR, file))
+    return True
+
+
+def list_prefixes(bucket, prefixes, final=None, max_workers=16, use_manifest=True):
+    """
+    Object entries of every prefix, the prefixes listed concurrently. The listings are cached in a local object
+    manifest (MANIFEST_DIR/<bucket>.json):
+    - '' (a bucket w/o date prefixes) is always listed in full, as new objects may sort anywhere among the keys
+      and objects may be replaced in place; diff_listing() against the cached listing gives what changed.
+    - Under a date prefix objects are only added, in key order (the hourly files of a day), so a prefix already
+      in the manifest is only listed past its last cached key.
+    - A prefix that was final when it was listed (final(prefix), e.g. a past trading day) isn't listed again until
+      its listing is FINAL_MAX_AGE_S old, then it is listed in full.
+    use_manifest=False lists everything again and refreshes the manifest.
+    :param bucket: boto3 Bucket
+    :param prefixes: key prefixes, '' for the whole bucket
+    :param final: optional function prefix -> bool, True once no new objects come in under the prefix
+    :param max_workers: prefixes listed at the same time
+    :param use_manifest: False ignores the cached listings
+    :return:
+      listings: dict of prefix -> list of entries (see list_prefix())
+    """
+    manifest = read_object_manifest(bucket.name) if use_manifest else {}
+    client = bucket.meta.client
+
+    def refresh(prefix):
+        cached = manifest.get(prefix, {'objects': [], 'final': False})
+        listed_at = time.time()
+        if cached['final'] and listed_at - cached.get('listed_at', 0) < FINAL_MAX_AGE_S:
+            return cached
+        # Decided before listing, so a final prefix's listing is complete
+        is_final = final is not None and final(prefix)
+        if prefix == '' or cached['final'] or not cached['objects']:
+            objects = list_prefix(client, bucket.name, prefix)
+        else:
+            objects = cached['objects'] + list_prefix(client, bucket.name, prefix, cached['objects'][-1]['key'])
+        return {'objects': objects, 'final': is_final, 'listed_at': listed_at}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = dict(zip(prefixes, executor.map(refresh, prefixes)))
+    manifest.update(listings)
+    write_object_manifest(bucket.name, manifest)
+    return {prefix: listing['objects'] for prefix, listing in listings.items()}
+
+
+def write_partition(bucket, key, df, schema, rows_per_group=None):
+    """
+    Write one partition file, streamed into the upload (S3MultipartWriter).
+    :param bucket: boto3 Bucket
+    :param key: object key of the file
+    :param df: DataFrame object, the rows of the partition
+    :param schema: pyarrow schema of the file
+    :param rows_per_group: rows per Parquet row group, ROWS_PER_GROUP by default
+    :return:
+      metadata: pyarrow FileMetaData, the footer of the file
+    """
+    rows_per_group = ROWS_PER_GROUP if rows_per_group is None else rows_per_group
+    collector = []
+    with S3MultipartWriter(bucket, key) as out_file:
+        # Closed only once every row group is written: closing it after a failed upload would raise over the
+        # upload's error (no footer to collect), the upload itself is aborted by S3MultipartWriter either way
+        writer = pq.ParquetWriter(out_file, schema, metadata_collector=collector)
+        for start in range(0, max(len(df), 1), rows_per_group):
+            writer.write_table(pa.Table.from_pandas(df.iloc[start:start + rows_per_group], schema=schema,
+                                                    preserve_index=False))
+        writer.close()
+    return collector[0]
+
+
+def write_dataset(bucket, df, prefix, partition_cols, sort_by=None, file_name='part-0.parquet', max_workers=16,
+                  rows_per_group=None):
+    """
+    Write a Hive-style partitioned Parquet dataset: a file per combination of partition_cols values,
+    '<prefix><column>=<value>/.../<file_name>' (the values are kept in the path, not in the file), written
+    concurrently. Rows are sorted by sort_by within a file, so the row group statistics narrow down on those
+    columns too.
+    :param bucket: boto3 Bucket
+    :param df: DataFrame object
+    :param prefix: key prefix of the dataset, ending in '/'
+    :param partition_cols: columns to partition by
+    :param sort_by: optional column(s) to sort the rows of a file by
+    :param file_name: name of the file in every partition
+    :param max_workers: files written at the same time
+    :param rows_per_group: rows per Parquet row group, ROWS_PER_GROUP by default
+    :return:
+      files: dict of path relative to prefix -> footer metadata w/ that file path set, what write_summary() takes
+    """
+    schema = pa.Schema.from_pandas(df.drop(columns=partition_cols), preserve_index=False)
+
+    def write(group):
+        values, df_part = group
+        path = '/'.join(f'{column}={value}' for column, value in zip(partition_cols, values)) + '/' + file_name
+        df_part = df_part.drop(columns=partition_cols)
+        if sort_by:
+            df_part = df_part.sort_values(by=sort_by, kind='stable')
+        metadata = write_partition(bucket, prefix + path, df_part, schema, rows_per_group)
+        metadata.set_file_path(path)
+        return path, metadata
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(write, df.groupby(partition_cols, sort=True, observed=True)))
+
+
+def write_summary(bucket, key, metadata):
+    """
+    Write a _metadata-style summary: footer-only Parquet file w/ the row groups of every file in metadata
+    (schema, row groups and their min/max statistics), so a reader can pick the files and row groups it needs
+    from the summary alone. Without any files the summary is removed.
+    :param bucket: boto3 Bucket
+    :param key: object key of the summary, e.g. '<prefix>_metadata'
+    :param metadata: iterable of footer metadata w/ their file paths set, left as they are
+    :return:
+      summary: a copy of the first footer w/ the row groups of the others appended, None w/o any files
+    """
+    summary = None
+    for file_metadata in metadata:
+        if summary is None:
+            # A copy: append_row_groups() changes the footer in place, and callers still read their own
+            summary = copy.deepcopy(file_metadata)
+        else:
+            summary.append_row_groups(file_metadata)
+    if summary is None:
+        bucket.Object(key).delete()
+        return None
+    out_buffer = BytesIO()
+    summary.write_metadata_file(out_buffer)
+    bucket.put_object(Body=out_buffer.getvalue(), Key=key)
+    return summary
+
+
+def read_summary(bucket, key):
+    """
+    Read a summary written by write_summary().
+    :param bucket: boto3 Bucket
+    :param key: object key of the summary
+    :return:
+      summary: pyarrow FileMetaData, None if there is none
+    """
+    try:
+        body = bucket.meta.client.get_object(Bucket=bucket.name, Key=key)['Body'].read()
+    except bucket.meta.client.exceptions.NoSuchKey:
+        return None
+    return pq.read_metadata(BytesIO(body))
+
+
+def summary_files(summary):
+    """
+    Paths of the files in a summary.
+    :param summary: pyarrow FileMetaData written by write_summary()
+    :return:
+      paths: list of paths relative to the dataset prefix, in order
+    """
+    return list(dict.fromkeys(summary.row_group(i).column(0).file_path for i in range(summary.num_row_groups)))
+
+
+def read_footer(bucket, key):
+    """
+    Footer metadata of a Parquet object w/o downloading it, from a ranged GET of its tail.
+    :param bucket: boto3 Bucket
+    :param key: object key
+    :return:
+      metadata: pyarrow FileMetaData
+    """
+    return pq.read_metadata(S3RangeReader(bucket, key))
+
+
+def dataset_summary(bucket, prefix, max_workers=16):
+    """
+    Summary of a dataset written by write_dataset(): its '_metadata', or if there is none (a load that failed
+    before write_summary(), a summary deleted by hand), one built from the footers of its files, read w/ ranged
+    GETs (read_footer()). Files are the objects under prefix whose name doesn't start w/ '_' or '.'; w/o any,
+    FileNotFoundError is raised.
+    :param bucket: boto3 Bucket
+    :param prefix: key prefix of the dataset, ending in '/'
+    :param max_workers: footers read at the same time
+    :return:
+      summary: pyarrow FileMetaData w/ the row groups of every file, their paths relative to prefix set
+    """
+    summary = read_summary(bucket, prefix + '_metadata')
+    if summary is not None:
+        return summary
+    paths = [entry['key'][len(prefix):] for entry in list_prefix(bucket.meta.client, bucket.name, prefix)
+             if not entry['key'].rsplit('/', 1)[-1].startswith(('_', '.'))]
+    if not paths:
+        raise FileNotFoundError(f"No dataset at s3://{bucket.name}/{prefix}: no _metadata summary and no data files.")
+    print(f"No _metadata summary at s3://{bucket.name}/{prefix}, reading the footers of its {len(paths)} files.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        footers = list(executor.map(lambda path: read_footer(bucket, prefix + path), paths))
+    for path, metadata in zip(paths, footers):
+        metadata.set_file_path(path)
+    summary = footers[0]
+    for metadata in footers[1:]:
+        summary.append_row_groups(metadata)
+    return summary
+
+
+def partition_values(path):
+    """
+    Partition values of a dataset file, from its path.
+    :param path: e.g. 'Date=2022-12-28/isin_bucket=03/part-0.parquet'
+    :return:
+      values: dict of column -> value (as a string)
+    """
+    return dict(part.split('=', 1) for part in path.split('/')[:-1])
+
+
+def query_dataset(bucket, prefix, columns=None, partitions=None, values=None, max_workers=16):
+    """
+    Rows of a dataset written by write_dataset(), w/o downloading it. Files are picked from the dataset summary
+    (dataset_summary(): _metadata, or the file footers w/o one) by their partition values and their row groups
+    by min/max statistics; only the column chunks of 'columns' in those row groups are then fetched, w/ ranged
+    GETs (S3RangeReader), and rows filtered on values.
+    :param bucket: boto3 Bucket
+    :param prefix: key prefix of the dataset, ending in '/'
+    :param columns: columns to return, all (incl. the partition columns) by default
+    :param partitions: optional function partition values -> bool, True for the files to read
+    :param values: optional (column, list of values): row groups whose range holds none of them are skipped
+    :param max_workers: files read at the same time
+    :return:
+      df: DataFrame object
+    """
+    summary = dataset_summary(bucket, prefix, max_workers)
+    names = summary.schema.names
+    column, wanted = values if values is not None else (None, None)
+
+    row_groups = {}
+    positions = {}
+    for i in range(summary.num_row_groups):
+        row_group = summary.row_group(i)
+        path = row_group.column(0).file_path
+        # Row groups of a file follow each other in the summary; index is the one within the file
+        index = positions[path] = positions.get(path, -1) + 1
+        if partitions is not None and not partitions(partition_values(path)):
+            continue
+        if column:
+            statistics = row_group.column(names.index(column)).statistics
+            if statistics is not None and statistics.has_min_max and not any(statistics.min <= value <= statistics.max for value in wanted):
+                continue
+        row_groups.setdefault(path, []).append(index)
+
+    file_columns = None if columns is None else [name for name in names if name in columns or name == column]
+
+    def read(item):
+        path, groups = item
+        parquet_file = pq.ParquetFile(S3RangeReader(bucket, prefix + path), pre_buffer=True)
+        df = parquet_file.read_row_groups(groups, columns=file_columns).to_pandas()
+        if column:
+            df = df[df[column].isin(wanted)]
+        return df.assign(**partition_values(path))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(read, row_groups.items()))
+    if not frames:
+        return pd.DataFrame(columns=columns if columns is not None else names)
+    df = pd.concat(frames, ignore_index=True)
+    return df.loc[:, columns] if columns is not None else df
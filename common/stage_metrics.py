@@ -0,0 +1,157 @@
+# modules
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime as dt
+import pandas as pd
+
+# One record per stage run, see instrument()
+stage_records = []
+
+# How often the RSS is sampled while a stage runs, for its RSS peak (rss_peak_mb)
+RSS_SAMPLE_S = 0.01
+
+# Also trace Python allocations w/ tracemalloc for a traced peak per stage (traced_peak_mb). Off by default, as
+# tracing slows every allocation down several times over. Only the outermost stage gets a traced peak
+# (tracemalloc's peak is process wide), and tracing stops when it returns.
+TRACE_MALLOC = False
+
+
+def rss_mb():
+    """
+    Current resident set size of the process.
+    :return:
+      mb: float, None where /proc isn't available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RssPeak:
+    """
+    Peak RSS while the with block runs, sampled in a background thread every interval_s.
+    """
+
+    def __init__(self, interval_s=None):
+        self.interval_s = RSS_SAMPLE_S if interval_s is None else interval_s
+        self.peak = rss_mb()
+        self.done = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        while not self.done.wait(self.interval_s):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        if self.peak is not None:
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.peak is not None:
+            self.done.set()
+            self.thread.join()
+            self.peak = round(max(self.peak, rss_mb()), 1)
+
+
+def instrument(stage):
+    """
+    Decorator recording wall time, CPU time, the RSS peak (and w/ TRACE_MALLOC the traced peak) and the rows/bytes
+    of the DataFrames in and out of every call of a stage, appended to stage_records.
+    :param stage: stage name
+    :return:
+      decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            frames_in = [arg for arg in list(args) + list(kwargs.values()) if isinstance(arg, pd.DataFrame)]
+            tracing = TRACE_MALLOC and not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            try:
+                with RssPeak() as rss:
+                    result = func(*args, **kwargs)
+                traced_peak_mb = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 3) if tracing else None
+            finally:
+                if tracing:
+                    tracemalloc.stop()
+            wall_s, cpu_s = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            frame_out = result if isinstance(result, pd.DataFrame) else None
+            stage_records.append({
+                'timestamp': dt.today().isoformat(timespec='seconds'),
+                'stage': stage,
+                'wall_s': round(wall_s, 4),
+                'cpu_s': round(cpu_s, 4),
+                'rss_peak_mb': rss.peak,
+                'traced_peak_mb': traced_peak_mb,
+                'rows_in': sum(len(df) for df in frames_in) if frames_in else None,
+                'bytes_in': int(sum(df.memory_usage().sum() for df in frames_in)) if frames_in else None,
+                'rows_out': len(frame_out) if frame_out is not None else None,
+                'bytes_out': int(frame_out.memory_usage().sum()) if frame_out is not None else None,
+            })
+            return result
+        return wrapper
+    return decorator
+
+
+def memory_report(before, after):
+    """
+    In-memory footprint per column (incl. the strings object columns point to) of the same data read w/ default
+    dtypes and w/ a dtype plan.
+    :param before: DataFrame object read w/ default dtypes
+    :param after: the same data read w/ the dtype plan
+    :return:
+      report: DataFrame object, one row per column and a 'total' row
+    """
+    report = pd.DataFrame({'dtype_before': before.dtypes.astype(str),
+                           'mb_before': before.memory_usage(index=False, deep=True) / 1024 ** 2,
+                           'dtype_after': after.dtypes.astype(str),
+                           'mb_after': after.memory_usage(index=False, deep=True) / 1024 ** 2})
+    report.loc['total', ['mb_before', 'mb_after']] = report[['mb_before', 'mb_after']].sum()
+    report['reduction'] = report['mb_before'] / report['mb_after']
+    return report.round(3)
+
+
+def prometheus_text(records, pipeline):
+    """
+    Stage records as Prometheus gauges, one per metric and stage run.
+    :param records: stage records, see instrument()
+    :param pipeline: value of the 'pipeline' label
+    :return:
+      text: Prometheus text exposition format
+    """
+    lines = []
+    for key in ['wall_s', 'cpu_s', 'rss_peak_mb', 'traced_peak_mb', 'rows_in', 'rows_out', 'bytes_in', 'bytes_out']:
+        metric = 'etl_stage_' + key
+        lines.append(f'# TYPE {metric} gauge')
+        lines += [f'{metric}{{pipeline="{pipeline}",stage="{r["stage"]}"}} {r[key]}'
+                  for r in records if r[key] is not None]
+    return '\n'.join(lines) + '\n'
+
+
+def write_stage_report(report_path, prometheus_path=None, pipeline='etl'):
+    """
+    Append one JSON line per stage run to report_path and, if prometheus_path is set, replace it w/ the runs as
+    Prometheus gauges.
+    :param report_path: JSON lines file
+    :param prometheus_path: optional Prometheus text file
+    :param pipeline: value of the 'pipeline' label of the gauges
+    :return:
+      True
+    """
+    with open(report_path, 'a') as file:
+        for record in stage_records:
+            file.write(json.dumps(record) + '\n')
+    if prometheus_path:
+        with open(prometheus_path, 'w') as file:
+            file.write(prometheus_text(stage_records, pipeline))
+    return True
@@ -0,0 +1,6 @@
+# modules
+import os
+import sys
+
+# make common importable, as the notebooks import the shared modules by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
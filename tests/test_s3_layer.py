@@ -0,0 +1,335 @@
+# modules
+import io
+import os
+from io import BytesIO
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from moto import mock_aws
+import s3_layer
+from s3_layer import (S3MultipartWriter, S3RangeReader, diff_listing, list_prefixes, query_dataset, read_footer,
+                      read_object_manifest, read_summary, summary_files, write_dataset, write_object_manifest,
+                      write_partition, write_summary)
+
+MIB = 1024 ** 2
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The object manifest is kept in the working dir
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def bucket():
+    with mock_aws():
+        yield boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='etl-test')
+
+
+@pytest.fixture
+def sent(bucket):
+    # Operation of every request the bucket's client sends, e.g. 'UploadPart'
+    requests = []
+    bucket.meta.client.meta.events.register('before-send.s3',
+                                            lambda **kwargs: requests.append(kwargs['event_name'].split('.')[-1]))
+    return requests
+
+
+def keys(bucket):
+    return [obj.key for obj in bucket.objects.all()]
+
+
+def pending_uploads(bucket):
+    return bucket.meta.client.list_multipart_uploads(Bucket=bucket.name).get('Uploads', [])
+
+
+def test_multipart_upload_in_parts(bucket, sent):
+    data = os.urandom(12 * MIB)
+
+    with S3MultipartWriter(bucket, 'report.parquet', part_size=5 * MIB) as out_file:
+        for start in range(0, len(data), MIB):
+            out_file.write(data[start:start + MIB])
+        assert out_file.tell() == len(data)
+
+    assert sent == ['CreateMultipartUpload', 'UploadPart', 'UploadPart', 'UploadPart', 'CompleteMultipartUpload']
+    assert bucket.Object('report.parquet').get()['Body'].read() == data
+
+
+def test_output_that_fits_in_one_part_is_a_single_put(bucket, sent):
+    with S3MultipartWriter(bucket, 'small.parquet', part_size=5 * MIB) as out_file:
+        out_file.write(b'PAR1')
+
+    assert sent == ['PutObject']
+    assert bucket.Object('small.parquet').get()['Body'].read() == b'PAR1'
+
+
+def test_failing_part_aborts_the_upload(bucket):
+    def fail_second_part(params, **kwargs):
+        if params.get('PartNumber') == 2:
+            raise ConnectionError('connection reset')
+    bucket.meta.client.meta.events.register('provide-client-params.s3.UploadPart', fail_second_part)
+
+    with pytest.raises(ConnectionError):
+        with S3MultipartWriter(bucket, 'failed.parquet', part_size=5 * MIB, max_in_flight=1) as out_file:
+            for _ in range(16):
+                out_file.write(os.urandom(MIB))
+
+    assert keys(bucket) == [] and pending_uploads(bucket) == []
+
+
+def test_error_in_the_with_block_aborts_the_upload(bucket, sent):
+    with pytest.raises(ValueError):
+        with S3MultipartWriter(bucket, 'failed.parquet', part_size=5 * MIB) as out_file:
+            out_file.write(os.urandom(6 * MIB))
+            raise ValueError('no footer')
+
+    assert sent[-1] == 'AbortMultipartUpload'
+    assert keys(bucket) == [] and pending_uploads(bucket) == []
+
+
+@pytest.fixture
+def listed(bucket):
+    # (Prefix, StartAfter) of every ListObjectsV2 request
+    requests = []
+    bucket.meta.client.meta.events.register(
+        'provide-client-params.s3.ListObjectsV2',
+        lambda params, **kwargs: requests.append((params['Prefix'], params.get('StartAfter', ''))))
+    return requests
+
+
+def put_files(bucket, date, hours):
+    for hour in hours:
+        bucket.put_object(Body=b'', Key=f'{date}/{date}_BINS_XETR{hour:02d}.csv')
+
+
+def listing_keys(listings):
+    return {prefix: [entry['key'].rsplit('_', 1)[-1] for entry in entries] for prefix, entries in listings.items()}
+
+
+def test_date_prefixes_are_only_listed_past_the_last_cached_key(bucket, listed):
+    put_files(bucket, '2022-12-27', range(3))
+    put_files(bucket, '2022-12-28', range(2))
+    open_day = lambda prefix: prefix != '2022-12-28'
+    list_prefixes(bucket, ['2022-12-27', '2022-12-28'], final=open_day)
+    put_files(bucket, '2022-12-28', [2])
+
+    listed.clear()
+    listings = list_prefixes(bucket, ['2022-12-27', '2022-12-28'], final=open_day)
+
+    # The final day isn't listed at all, the open one only past its last cached key
+    assert listed == [('2022-12-28', '2022-12-28/2022-12-28_BINS_XETR01.csv')]
+    assert listing_keys(listings) == {'2022-12-27': ['XETR00.csv', 'XETR01.csv', 'XETR02.csv'],
+                                      '2022-12-28': ['XETR00.csv', 'XETR01.csv', 'XETR02.csv']}
+
+
+def test_final_prefix_is_listed_again_in_full_once_its_listing_is_old(bucket, listed, monkeypatch):
+    put_files(bucket, '2022-12-27', range(2))
+    list_prefixes(bucket, ['2022-12-27'], final=lambda prefix: True)
+    bucket.put_object(Body=b'revised', Key='2022-12-27/2022-12-27_BINS_XETR00.csv')
+    etag = bucket.Object('2022-12-27/2022-12-27_BINS_XETR00.csv').e_tag
+
+    monkeypatch.setattr(s3_layer, 'FINAL_MAX_AGE_S', 0)
+    listed.clear()
+    entries = list_prefixes(bucket, ['2022-12-27'], final=lambda prefix: True)['2022-12-27']
+
+    assert listed == [('2022-12-27', '')]
+    assert entries[0]['etag'] == etag
+
+
+def test_prefix_less_bucket_is_listed_in_full_and_diffed(bucket, listed):
+    for part in range(5):
+        bucket.put_object(Body=b'', Key=f'stock_prices_{part:04d}.csv')
+    list_prefixes(bucket, [''])
+
+    # A key sorting before the last one, a key after it, a re-uploaded and a removed object
+    bucket.put_object(Body=b'', Key='stock_prices_0002_late.csv')
+    bucket.put_object(Body=b'', Key='stock_prices_0005.csv')
+    bucket.put_object(Body=b'revised', Key='stock_prices_0003.csv')
+    bucket.Object('stock_prices_0001.csv').delete()
+    cached = read_object_manifest(bucket.name)['']['objects']
+    listed.clear()
+    entries = list_prefixes(bucket, [''])['']
+    added, changed, removed = diff_listing(cached, entries)
+
+    assert listed == [('', '')]
+    assert [entry['key'] for entry in entries] == keys(bucket)
+    assert [entry['key'] for entry in added] == ['stock_prices_0002_late.csv', 'stock_prices_0005.csv']
+    assert [entry['key'] for entry in changed] == ['stock_prices_0003.csv']
+    assert [entry['key'] for entry in removed] == ['stock_prices_0001.csv']
+
+
+def test_listing_w_o_the_manifest_refreshes_it(bucket, listed):
+    put_files(bucket, '2022-12-27', range(2))
+    list_prefixes(bucket, ['2022-12-27'], final=lambda prefix: True)
+
+    listed.clear()
+    list_prefixes(bucket, ['2022-12-27'], use_manifest=False)
+
+    assert listed == [('2022-12-27', '')]
+    assert read_object_manifest(bucket.name)['2022-12-27']['final'] is False
+
+
+def test_unreadable_manifest_is_empty(bucket, workdir):
+    write_object_manifest(bucket.name, {'': {'objects': [], 'final': False}})
+    (workdir / s3_layer.MANIFEST_DIR / (bucket.name + '.json')).write_text('{"": {"obj')
+
+    assert read_object_manifest(bucket.name) == {}
+
+
+def report(rows=40):
+    # Daily report rows of two days, in two ISIN buckets a day
+    return pd.DataFrame({'Date': np.repeat(['2022-12-27', '2022-12-28'], rows // 2),
+                         'isin_bucket': np.tile(['00', '01'], rows // 2),
+                         'ISIN': [f'DE{i:010d}' for i in reversed(range(rows))],
+                         'closing_price_eur': np.arange(rows, dtype='float64')})
+
+
+def read_object(bucket, key):
+    return pd.read_parquet(BytesIO(bucket.Object(key).get()['Body'].read()))
+
+
+def test_dataset_has_a_file_per_partition_w_its_rows_sorted(bucket):
+    df = report()
+
+    files = write_dataset(bucket, df, 'report/', ['Date', 'isin_bucket'], sort_by='ISIN', rows_per_group=4)
+
+    paths = ['Date=2022-12-27/isin_bucket=00/part-0.parquet', 'Date=2022-12-27/isin_bucket=01/part-0.parquet',
+             'Date=2022-12-28/isin_bucket=00/part-0.parquet', 'Date=2022-12-28/isin_bucket=01/part-0.parquet']
+    assert sorted(files) == paths and keys(bucket) == ['report/' + path for path in paths]
+    for path, metadata in files.items():
+        # Partition values are in the path only, rows sorted by ISIN in row groups of rows_per_group
+        date, isin_bucket = [part.split('=')[1] for part in path.split('/')[:-1]]
+        expected = (df[(df['Date'] == date) & (df['isin_bucket'] == isin_bucket)].drop(columns=['Date', 'isin_bucket'])
+                    .sort_values(by='ISIN', ignore_index=True))
+        pd.testing.assert_frame_equal(read_object(bucket, 'report/' + path), expected)
+        assert metadata.num_row_groups == 3 and metadata.row_group(0).column(0).file_path == path
+
+
+def test_summary_has_every_row_group_and_leaves_the_footers_alone(bucket):
+    files = write_dataset(bucket, report(), 'report/', ['Date', 'isin_bucket'], rows_per_group=4)
+
+    summary = write_summary(bucket, 'report/_metadata', files.values())
+
+    assert summary.num_row_groups == 12 and summary.num_rows == 40
+    assert summary_files(read_summary(bucket, 'report/_metadata')) == list(files)
+    # The footers passed in still describe their own file only
+    assert [metadata.num_row_groups for metadata in files.values()] == [3, 3, 3, 3]
+    assert [metadata.num_rows for metadata in files.values()] == [10, 10, 10, 10]
+
+
+def test_summary_of_no_files_is_removed(bucket):
+    files = write_dataset(bucket, report(), 'report/', ['Date'])
+    write_summary(bucket, 'report/_metadata', files.values())
+
+    assert write_summary(bucket, 'report/_metadata', []) is None
+    assert read_summary(bucket, 'report/_metadata') is None
+
+
+def test_empty_partition_file_is_still_a_parquet_file(bucket):
+    df = report().head(0)
+
+    write_partition(bucket, 'empty.parquet', df, pa.Schema.from_pandas(df, preserve_index=False))
+
+    assert read_object(bucket, 'empty.parquet').empty
+    assert pq.read_metadata(BytesIO(bucket.Object('empty.parquet').get()['Body'].read())).num_rows == 0
+
+
+@pytest.fixture
+def ranges(bucket):
+    # Range header of every GetObject request
+    requests = []
+    bucket.meta.client.meta.events.register('provide-client-params.s3.GetObject',
+                                            lambda params, **kwargs: requests.append(params.get('Range')))
+    return requests
+
+
+def test_range_reader_fetches_only_what_is_read(bucket, ranges):
+    data = os.urandom(100_000)
+    bucket.put_object(Body=data, Key='report.parquet')
+
+    reader = S3RangeReader(bucket, 'report.parquet', tail_bytes=1000)
+    assert reader.size == len(data) and ranges == ['bytes=-1000']
+
+    # The tail comes w/ the first request
+    reader.seek(-8, io.SEEK_END)
+    assert reader.read() == data[-8:] and len(ranges) == 1
+    assert reader.read(10) == b''
+
+    reader.seek(100)
+    reader.seek(50, io.SEEK_CUR)
+    assert reader.read(50) == data[150:200] and reader.tell() == 200
+    assert ranges[1:] == ['bytes=150-199']
+
+
+def test_footer_is_read_from_the_tail(bucket, ranges):
+    files = write_dataset(bucket, report(), 'report/', ['Date'], rows_per_group=4)
+    path, written = next(iter(files.items()))
+
+    ranges.clear()
+    footer = read_footer(bucket, 'report/' + path)
+
+    assert ranges == ['bytes=-65536']
+    assert footer.num_rows == written.num_rows and footer.num_row_groups == written.num_row_groups
+
+
+@pytest.fixture
+def dataset(bucket):
+    df = report(400)
+    files = write_dataset(bucket, df, 'report/', ['Date', 'isin_bucket'], sort_by='ISIN', rows_per_group=10)
+    write_summary(bucket, 'report/_metadata', files.values())
+    return df
+
+
+def lookup(df, dates, isins, columns):
+    rows = df[df['Date'].isin(dates) & df['ISIN'].isin(isins)]
+    return rows[columns].sort_values(by='ISIN', ignore_index=True)
+
+
+@pytest.mark.parametrize('summary', [True, False])
+def test_query_reads_the_wanted_rows(bucket, dataset, summary):
+    if not summary:
+        # W/o _metadata (a load that failed before write_summary()) the file footers are read instead
+        bucket.Object('report/_metadata').delete()
+    isins = ['DE0000000042', 'DE0000000301', 'DE9999999999']
+    columns = ['ISIN', 'Date', 'closing_price_eur']
+
+    df = query_dataset(bucket, 'report/', columns, partitions=lambda values: values['Date'] == '2022-12-27',
+                       values=('ISIN', isins))
+
+    pd.testing.assert_frame_equal(df.sort_values(by='ISIN', ignore_index=True),
+                                  lookup(dataset, ['2022-12-27'], isins, columns))
+
+
+def test_query_w_o_filters_reads_the_whole_dataset(bucket, dataset):
+    df = query_dataset(bucket, 'report/')
+
+    assert list(df.columns) == ['ISIN', 'closing_price_eur', 'Date', 'isin_bucket']
+    assert sorted(df['closing_price_eur']) == sorted(dataset['closing_price_eur'])
+
+
+def test_query_skips_row_groups_outside_the_values(bucket, dataset, ranges):
+    query_dataset(bucket, 'report/', ['closing_price_eur'])
+    every_group = len(ranges)
+
+    ranges.clear()
+    df = query_dataset(bucket, 'report/', ['closing_price_eur'], values=('ISIN', ['DE0000000042']))
+
+    assert list(df['closing_price_eur']) == [357.0]
+    assert len(ranges) < every_group
+
+
+def test_query_w_o_matching_rows_is_empty(bucket, dataset):
+    df = query_dataset(bucket, 'report/', ['ISIN', 'Date'], partitions=lambda values: values['Date'] == '2023-01-02')
+
+    assert df.empty and list(df.columns) == ['ISIN', 'Date']
+
+
+def test_query_of_no_dataset_fails(bucket):
+    bucket.put_object(Body=b'', Key='report/_SUCCESS')
+
+    with pytest.raises(FileNotFoundError):
+        query_dataset(bucket, 'report/')